@@ -2,10 +2,13 @@ from __future__ import annotations
 
 import sys
 from enum import Enum
-from typing import Any
+from typing import TYPE_CHECKING, Any, Literal
 
 import pytest
 
+if TYPE_CHECKING:
+    from pytest import Function, Item, TestReport
+
 if sys.version_info < (3, 11):
 
     class StrEnum(str, Enum):
@@ -28,3 +31,27 @@ if pytest.version_tuple < (7, 4):
         word: str | tuple[str, Mapping[str, bool]]
 else:
     from pytest import TestShortLogReport  # type: ignore[no-redef] # noqa: F401
+
+
+# Private pytest APIs used to run phases of the runtest protocol individually. They have not changed within this range
+# of pytest versions, which needs to be revisited when extending it
+IS_RUNTEST_PHASE_API_SUPPORTED = (7, 0) <= pytest.version_tuple[:2] < (10, 0)
+
+
+def call_and_report(item: Item, when: Literal["setup", "call", "teardown"], **kwargs: Any) -> TestReport:
+    """Run a phase of the runtest protocol of the item and return its report without logging it"""
+    from _pytest import runner
+
+    return runner.call_and_report(item, when, log=False, **kwargs)
+
+
+def init_fixture_request(item: Function) -> None:
+    """Initialize the fixture request of the item before the setup phase, as the runtest protocol does"""
+    if not item._request:
+        item._initrequest()
+
+
+def release_fixture_request(item: Function) -> None:
+    """Release the fixture request of the item after the teardown phase, as the runtest protocol does"""
+    item._request = False
+    item.funcargs = None
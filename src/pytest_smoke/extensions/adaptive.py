@@ -0,0 +1,131 @@
+from __future__ import annotations
+
+import hashlib
+from typing import TYPE_CHECKING, Any
+
+from pytest import hookimpl
+
+from pytest_smoke import smoke
+from pytest_smoke.plugin import STASH_KEY_SMOKE_GROUP_ID
+from pytest_smoke.types import SmokeCacheKey, SmokeOption
+from pytest_smoke.utils import Cache, generate_group_id, get_cache
+
+if smoke.is_xdist_installed:
+    from xdist import is_xdist_worker
+
+if TYPE_CHECKING:
+    from pathlib import Path
+
+    from pytest import Config, Item, Session, TestReport
+
+
+class PytestSmokeAdaptive:
+    """A plugin that adapts N of each smoke scope group based on the historical stability of the group
+
+    The quota of a group is set to the maximum value when the group is new, changed, or failed in the last run, and it
+    decreases by one with every subsequent run where all selected tests in the group passed, down to a minimum of 1.
+    On the very first run, the regular N is used as the initial quota of every group.
+
+    This plugin will be dynamically registered when the --smoke-adaptive option is given
+    """
+
+    name = "smoke-adaptive"
+
+    def __init__(self, config: Config, max_n: int) -> None:
+        self.config = config
+        self.max_n = max_n
+        self._state: dict[str, dict[str, Any]] = {}
+        self._fingerprints: dict[str, str] = {}
+        self._quotas: dict[str, int] = {}
+        self._group_ids: dict[str, str] = {}
+        self._executed_groups: set[str] = set()
+        self._failed_groups: set[str] = set()
+
+    @property
+    def scope(self) -> str:
+        return SmokeOption(self.config).scope
+
+    def prepare(self, items: list[Item]) -> None:
+        """Load the history and compute the fingerprint of each smoke scope group from the collected items
+
+        :param items: Collected Pytest items
+        """
+        self._state = get_cache(self.config).get(SmokeCacheKey.ADAPTIVE, {}).get(self.scope, {})
+        items_per_group: dict[str, list[Item]] = {}
+        for item in items:
+            if (group_id := generate_group_id(item, self.scope)) is not None:
+                items_per_group.setdefault(str(group_id), []).append(item)
+        self._fingerprints = {
+            group_id: _generate_fingerprint(group_items) for group_id, group_items in items_per_group.items()
+        }
+
+    def get_threshold(self, group_id: Any, default: float) -> int:
+        """Return the number of tests to select from the smoke scope group
+
+        :param group_id: Smoke scope group ID
+        :param default: The threshold calculated from the regular N
+        """
+        group_id = str(group_id)
+        if group_id not in self._quotas:
+            if not self._state:
+                # No history yet
+                self._quotas[group_id] = int(default)
+            elif self._is_changed(group_id):
+                self._quotas[group_id] = self.max_n
+            else:
+                self._quotas[group_id] = min(self._state[group_id]["quota"], self.max_n)
+        return self._quotas[group_id]
+
+    @hookimpl
+    def pytest_collection_finish(self, session: Session) -> None:
+        self._group_ids = {item.nodeid: str(item.stash[STASH_KEY_SMOKE_GROUP_ID]) for item in session.items}
+
+    @hookimpl
+    def pytest_runtest_logreport(self, report: TestReport) -> None:
+        if (group_id := self._group_ids.get(report.nodeid)) is not None:
+            self._executed_groups.add(group_id)
+            if report.failed:
+                self._failed_groups.add(group_id)
+
+    @hookimpl
+    def pytest_sessionfinish(self, session: Session) -> None:
+        if (
+            session.config.option.collectonly
+            or not self._quotas
+            or (smoke.is_xdist_installed and is_xdist_worker(session))
+        ):
+            return
+
+        # Groups that were not collected in this run (eg. renamed or deleted) are pruned
+        new_state = {k: v for k, v in self._state.items() if k in self._fingerprints}
+        for group_id, quota in self._quotas.items():
+            if group_id in self._failed_groups:
+                new_quota = self.max_n
+            elif group_id in self._executed_groups:
+                new_quota = max(1, quota - 1)
+            else:
+                new_quota = quota
+            new_state[group_id] = {"quota": new_quota, "fingerprint": self._fingerprints[group_id]}
+        cache = get_cache(session.config)
+        cache.set(SmokeCacheKey.ADAPTIVE, {**cache.get(SmokeCacheKey.ADAPTIVE, {}), self.scope: new_state})
+
+    def _is_changed(self, group_id: str) -> bool:
+        group_state = self._state.get(group_id)
+        return group_state is None or group_state["fingerprint"] != self._fingerprints.get(group_id)
+
+
+def _generate_fingerprint(items: list[Item]) -> str:
+    """Generate a fingerprint of the smoke scope group from the node IDs of the items and the modification time of
+    their test files
+    """
+    h = hashlib.sha1()
+    for nodeid in sorted(item.nodeid for item in items):
+        h.update(nodeid.encode())
+    for path in sorted({item.path for item in items}):
+        h.update(f"{path}:{_get_mtime(path)}".encode())
+    return h.hexdigest()
+
+
+@Cache
+def _get_mtime(path: Path) -> int:
+    return path.stat().st_mtime_ns
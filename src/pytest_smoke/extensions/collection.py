@@ -0,0 +1,237 @@
+from __future__ import annotations
+
+import os
+import sys
+import time
+from collections import Counter
+from collections.abc import Generator
+from functools import cached_property
+from typing import TYPE_CHECKING, Any
+
+from pytest import Session, hookimpl
+
+from pytest_smoke import smoke
+from pytest_smoke.types import SmokeCacheKey, SmokeIniOption, SmokeMarker
+from pytest_smoke.utils import format_size, get_cache, parse_ini_option, sort_items_by_marginal_cost
+
+if smoke.is_xdist_installed:
+    from xdist import is_xdist_worker
+
+if TYPE_CHECKING:
+    from pytest import Collector, CollectReport, Config, Item, TerminalReporter, TestReport
+
+
+# The weight of the latest duration in the exponential moving average of the collection duration of each node and the
+# duration of each test
+DURATION_SMOOTHING = 0.3
+
+
+class PytestSmokeCollectionProfile:
+    """A plugin that profiles the collection per test module and directory
+
+    The wall time and the RSS growth of the process are measured around the collection of each collector node, excluding
+    nodes collected within it. The cost of a test module includes importing it and collecting its tests (including
+    classes in it), and the cost of a directory includes importing its conftest.py and listing its entries. Costs of
+    the latest collection are recorded in the pytest cache, so that they are available for later runs.
+
+    This plugin will be dynamically registered when the --smoke-collect-profile option is given or the collection select
+    mode is used. The terminal summary is shown only with the --smoke-collect-profile option
+    """
+
+    name = "smoke-collection-profile"
+
+    def __init__(self, config: Config, top_k: int | None = None) -> None:
+        self.config = config
+        self.top_k = top_k
+        # module or directory: (duration, memory)
+        self._costs: dict[str, tuple[float, int]] = {}
+        self._directories: set[str] = set()
+        self._nested_durations: list[float] = []
+        self._collection_duration = 0.0
+        # module or directory: the number of selected tests
+        self._num_selected: Counter[str] = Counter()
+
+    @cached_property
+    def costs(self) -> dict[str, dict[str, Any]]:
+        """Recorded collection costs of modules and directories"""
+        return get_cache(self.config).get(SmokeCacheKey.COLLECTION, {})
+
+    @hookimpl(wrapper=True)
+    def pytest_collection(self, session: Session) -> Generator[None, Any, Any]:
+        start = time.perf_counter()
+        try:
+            return (yield)
+        finally:
+            self._collection_duration = time.perf_counter() - start
+
+    @hookimpl(wrapper=True)
+    def pytest_make_collect_report(self, collector: Collector) -> Generator[None, CollectReport, CollectReport]:
+        if isinstance(collector, Session):
+            return (yield)
+
+        self._nested_durations.append(0.0)
+        start_memory = _get_rss()
+        start = time.perf_counter()
+        try:
+            return (yield)
+        finally:
+            elapsed = time.perf_counter() - start
+            duration = elapsed - self._nested_durations.pop()
+            if self._nested_durations:
+                self._nested_durations[-1] += elapsed
+            # Classes are accounted for as part of their modules
+            key = collector.nodeid.split("::")[0] or "."
+            if collector.path.is_dir():
+                self._directories.add(key)
+            prev_duration, prev_memory = self._costs.get(key, (0.0, 0))
+            self._costs[key] = (prev_duration + duration, prev_memory + max(0, _get_rss() - start_memory))
+
+    @hookimpl
+    def pytest_collection_finish(self, session: Session) -> None:
+        for key, count in Counter(x.nodeid.split("::")[0] for x in session.items).items():
+            self._num_selected[key] += count
+            parts = key.split("/")[:-1]
+            for i in range(len(parts) + 1):
+                self._num_selected["/".join(parts[:i]) or "."] += count
+
+    @hookimpl
+    def pytest_sessionfinish(self, session: Session) -> None:
+        if not self._costs or (smoke.is_xdist_installed and is_xdist_worker(session)):
+            return
+        costs = self.costs
+        for key, (duration, memory) in self._costs.items():
+            if (entry := costs.get(key)) is None:
+                costs[key] = {"duration": duration, "memory": memory}
+            else:
+                entry["duration"] += DURATION_SMOOTHING * (duration - entry["duration"])
+                entry["memory"] = memory
+        get_cache(session.config).set(SmokeCacheKey.COLLECTION, costs)
+
+    @hookimpl
+    def pytest_terminal_summary(self, terminalreporter: TerminalReporter) -> None:
+        if not self._costs or self.top_k is None:
+            return
+
+        tr = terminalreporter
+        module_costs = {k: v for k, v in self._costs.items() if k not in self._directories}
+        total_module_duration = sum(x for x, _ in module_costs.values())
+        unused_modules = [k for k in module_costs if not self._num_selected[k]]
+        unused_duration = sum(module_costs[k][0] for k in unused_modules)
+        tr.section("smoke collection profile")
+        tr.write_line(
+            f"collection: {self._collection_duration:.2f}s wall time, {total_module_duration:.2f}s in "
+            f"{len(module_costs)} test modules, "
+            f"{sum(x for k, (x, _) in self._costs.items() if k in self._directories):.2f}s in "
+            f"{len(self._directories)} directories (including conftest.py)"
+        )
+        tr.write_line(
+            f"{len(unused_modules)} of {len(module_costs)} test modules have no selected smoke tests, accounting for "
+            f"{unused_duration:.2f}s "
+            f"({unused_duration / total_module_duration if total_module_duration else 0:.1%}) of the collection time "
+            "of test modules"
+        )
+        top_costs = sorted(self._costs.items(), key=lambda x: x[1][0], reverse=True)[: self.top_k]
+        tr.write_line("")
+        tr.write_line(f"Top {len(top_costs)} modules and directories by collection time:")
+        tr.write_line(f"{'time':>10} {'memory':>10} {'selected':>9}  module/directory")
+        for key, (duration, memory) in top_costs:
+            tr.write_line(
+                f"{duration:>9.3f}s {format_size(memory):>10} {self._num_selected[key]:>9}  "
+                f"{key}{'/' if key in self._directories and key != '.' else ''}"
+            )
+
+
+class PytestSmokeCollectionCost:
+    """A plugin that implements the collection select mode, which selects tests so that the total cost of collecting
+    their test modules and executing them is as low as possible
+
+    The cost of a test is the recorded collection time of its test module and the directories above it (including their
+    conftest.py), which is paid once for all tests picked from the same module or directory, plus the recorded duration
+    of the test (setup, call, and teardown). Tests are picked from each smoke scope group in rounds, choosing the test
+    with the lowest marginal cost, so that the selected tests concentrate in cheap modules. Modules of critical smoke
+    tests are considered already paid for. Costs that are not recorded yet are considered free, so the selection falls
+    back to the first N tests until they are recorded.
+
+    Collection costs are recorded by the PytestSmokeCollectionProfile plugin, and durations of tests are recorded by
+    this plugin. Costs are read only from previous runs, so that pytest-xdist workers make the same selection.
+
+    This plugin will be dynamically registered when the collection select mode is used
+    """
+
+    name = "smoke-collection-cost"
+
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        # nodeid: the total duration of the test phases in this run
+        self._test_durations: dict[str, float] = {}
+
+    @cached_property
+    def costs(self) -> dict[str, dict[str, Any]]:
+        """Recorded collection costs of modules and directories"""
+        return get_cache(self.config).get(SmokeCacheKey.COLLECTION, {})
+
+    @cached_property
+    def durations(self) -> dict[str, float]:
+        """Recorded durations of tests"""
+        return get_cache(self.config).get(SmokeCacheKey.DURATIONS, {})
+
+    def sort_items(self, items: list[Item], scope: str) -> list[Item]:
+        """Sort collected items so that the first N items of each smoke scope group minimize the collection time of
+        their test modules plus their durations
+
+        :param items: Collected Pytest items
+        :param scope: Smoke scope
+        """
+        enable_critical_tests = parse_ini_option(self.config, SmokeIniOption.SMOKE_MARKED_TESTS_AS_CRITICAL)
+        return sort_items_by_marginal_cost(
+            items,
+            scope,
+            self._get_costs,
+            lambda x: self.costs[x]["duration"],
+            is_prepaid=lambda x: bool(
+                enable_critical_tests and (smoke_marker := SmokeMarker.from_item(x)) and smoke_marker.runif
+            ),
+        )
+
+    @hookimpl
+    def pytest_runtest_logreport(self, report: TestReport) -> None:
+        self._test_durations[report.nodeid] = self._test_durations.get(report.nodeid, 0.0) + report.duration
+
+    @hookimpl
+    def pytest_sessionfinish(self, session: Session) -> None:
+        if (
+            session.config.option.collectonly
+            or not self._test_durations
+            or (smoke.is_xdist_installed and is_xdist_worker(session))
+        ):
+            return
+        durations = self.durations
+        for nodeid, duration in self._test_durations.items():
+            if nodeid in durations:
+                durations[nodeid] += DURATION_SMOOTHING * (duration - durations[nodeid])
+            else:
+                durations[nodeid] = duration
+        get_cache(session.config).set(SmokeCacheKey.DURATIONS, durations)
+
+    def _get_costs(self, item: Item) -> tuple[frozenset[str], float]:
+        """Return keys of the test module and the directories above it that have a recorded collection cost, and the
+        recorded duration of the item
+        """
+        module_key = item.nodeid.split("::")[0]
+        parts = module_key.split("/")
+        keys = {module_key, *("/".join(parts[:i]) or "." for i in range(len(parts)))}
+        return frozenset(x for x in keys if x in self.costs), self.durations.get(item.nodeid, 0.0)
+
+
+def _get_rss() -> int:
+    """Return the current RSS of the process in bytes, or the peak RSS where the current one is not available"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        if sys.platform == "win32":
+            return 0
+        import resource
+
+        # ru_maxrss is in bytes on macOS, and in kilobytes on other platforms
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == "darwin" else 1024)
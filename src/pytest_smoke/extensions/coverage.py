@@ -0,0 +1,290 @@
+from __future__ import annotations
+
+import os
+import sqlite3
+import sys
+import time
+from abc import ABC, abstractmethod
+from array import array
+from collections.abc import Generator, Iterable, Mapping
+from contextlib import closing, contextmanager
+from functools import cached_property
+from pathlib import Path
+from types import CodeType, FrameType
+from typing import TYPE_CHECKING, Any
+
+from pytest import hookimpl
+
+from pytest_smoke.utils import get_cache
+
+if TYPE_CHECKING:
+    from _typeshed import TraceFunction
+    from pytest import Config, Item, TerminalReporter
+
+
+# Coverage data is flushed to the index every this number of tests to limit memory usage
+FLUSH_INTERVAL = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (id INTEGER PRIMARY KEY, path TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS tests (id INTEGER PRIMARY KEY, nodeid TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS coverage (
+    file_id INTEGER NOT NULL,
+    test_id INTEGER NOT NULL,
+    lines BLOB NOT NULL,
+    PRIMARY KEY (file_id, test_id)
+) WITHOUT ROWID;
+"""
+
+
+class CoverageIndex:
+    """A local index of source lines covered by each test, stored in SQLite
+
+    Each row is keyed by a source file and a test, and holds the covered line numbers of the file as a packed array of
+    unsigned integers. Paths of source files are stored relative to the rootdir.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+    @classmethod
+    def from_config(cls, config: Config) -> CoverageIndex:
+        return cls(get_cache(config).mkdir("smoke") / "coverage.db")
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def write(self, coverage: Mapping[str, Mapping[str, Iterable[int]]]) -> None:
+        """Replace coverage data of the given tests
+
+        :param coverage: Covered lines per source file per test node ID
+        """
+        with self._connect() as conn:
+            for nodeid, lines_per_file in coverage.items():
+                test_id = self._get_or_create_id(conn, "tests", "nodeid", nodeid)
+                conn.execute("DELETE FROM coverage WHERE test_id = ?", (test_id,))
+                for path, lines in lines_per_file.items():
+                    file_id = self._get_or_create_id(conn, "files", "path", path)
+                    conn.execute(
+                        "INSERT INTO coverage (file_id, test_id, lines) VALUES (?, ?, ?)",
+                        (file_id, test_id, array("I", sorted(lines)).tobytes()),
+                    )
+
+    def get_files(self) -> set[str]:
+        """Return all source files recorded in the index"""
+        with self._connect() as conn:
+            return {x for (x,) in conn.execute("SELECT path FROM files")}
+
+    def get_tests(self) -> set[str]:
+        """Return node IDs of all tests recorded in the index"""
+        with self._connect() as conn:
+            return {x for (x,) in conn.execute("SELECT nodeid FROM tests")}
+
+    def find_tests(self, changed_lines: dict[str, set[int]]) -> set[str]:
+        """Return node IDs of tests covering any of the changed lines
+
+        :param changed_lines: Changed line numbers per source file
+        """
+        nodeids = set()
+        with self._connect() as conn:
+            for path, lines in changed_lines.items():
+                rows = conn.execute(
+                    "SELECT tests.nodeid, coverage.lines FROM coverage "
+                    "JOIN files ON files.id = coverage.file_id JOIN tests ON tests.id = coverage.test_id "
+                    "WHERE files.path = ?",
+                    (path,),
+                )
+                for nodeid, blob in rows:
+                    if nodeid not in nodeids:
+                        covered_lines = array("I")
+                        covered_lines.frombytes(blob)
+                        if not lines.isdisjoint(covered_lines):
+                            nodeids.add(nodeid)
+        return nodeids
+
+    @contextmanager
+    def _connect(self) -> Generator[sqlite3.Connection, None, None]:
+        # Allow concurrent writes from pytest-xdist workers
+        with closing(sqlite3.connect(self.path, timeout=60)) as conn, conn:
+            conn.executescript(SCHEMA)
+            yield conn
+
+    @staticmethod
+    def _get_or_create_id(conn: sqlite3.Connection, table: str, column: str, value: str) -> int:
+        conn.execute(f"INSERT OR IGNORE INTO {table} ({column}) VALUES (?)", (value,))
+        return conn.execute(f"SELECT id FROM {table} WHERE {column} = ?", (value,)).fetchone()[0]
+
+
+class PytestSmokeCoverageRecorder:
+    """A plugin that records source lines under the rootdir covered by each test, and saves them to the coverage index
+
+    Lines executed during setup, call, and teardown of each test are recorded using sys.monitoring on Python 3.12+, or
+    sys.settrace on older versions. Only the main thread is traced.
+
+    This plugin will be dynamically registered when the --smoke-record-coverage option is given
+    """
+
+    name = "smoke-coverage-recorder"
+
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        self._tracer: _LineTracer
+        if sys.version_info >= (3, 12):
+            self._tracer = _MonitoringTracer(config.rootpath)
+        else:
+            self._tracer = _SetTraceTracer(config.rootpath)
+        self._coverage: dict[str, dict[str, set[int]]] = {}
+        self._num_recorded = 0
+        self._elapsed_time_write = 0.0
+
+    @cached_property
+    def index(self) -> CoverageIndex:
+        return CoverageIndex.from_config(self.config)
+
+    @hookimpl(wrapper=True)
+    def pytest_runtest_protocol(self, item: Item) -> Generator[None, Any, Any]:
+        self._tracer.start()
+        try:
+            return (yield)
+        finally:
+            self._coverage[item.nodeid] = self._tracer.stop()
+            self._num_recorded += 1
+            if len(self._coverage) >= FLUSH_INTERVAL:
+                self._flush()
+
+    @hookimpl
+    def pytest_sessionfinish(self) -> None:
+        self._flush()
+        self._tracer.close()
+
+    @hookimpl
+    def pytest_terminal_summary(self, terminalreporter: TerminalReporter) -> None:
+        if not self.index.exists():
+            return
+        terminalreporter.section("smoke coverage map")
+        if self._num_recorded:
+            terminalreporter.write_line(
+                f"Recorded {self._num_recorded} tests (index write time: {self._elapsed_time_write:.2f}s)"
+            )
+        num_tests = len(self.index.get_tests())
+        num_files = len(self.index.get_files())
+        terminalreporter.write_line(
+            f"Coverage index: {self.index.path} ({num_tests} tests, {num_files} files, "
+            f"{self.index.path.stat().st_size / 1024:.1f} KiB)"
+        )
+
+    def _flush(self) -> None:
+        if self._coverage:
+            start = time.perf_counter()
+            self.index.write(self._coverage)
+            self._elapsed_time_write += time.perf_counter() - start
+            self._coverage = {}
+
+
+class _LineTracer(ABC):
+    """Base class of line tracers that record executed lines of source files under the root directory"""
+
+    def __init__(self, rootpath: Path) -> None:
+        self._root = str(rootpath) + os.sep
+        self._relpaths: dict[str, str | None] = {}
+        self._lines: dict[str, set[int]] = {}
+
+    @abstractmethod
+    def start(self) -> None:
+        """Start recording executed lines"""
+
+    @abstractmethod
+    def stop(self) -> dict[str, set[int]]:
+        """Stop recording and return executed lines per source file path relative to the root directory"""
+
+    def close(self) -> None:
+        pass
+
+    def _get_lines(self, filename: str) -> set[int] | None:
+        """Return the set to record executed lines of the file in, or None if the file should not be traced"""
+        try:
+            relpath = self._relpaths[filename]
+        except KeyError:
+            relpath = self._relpaths[filename] = (
+                os.path.relpath(filename, self._root)
+                if filename.startswith(self._root) and "site-packages" not in filename
+                else None
+            )
+        if relpath is None:
+            return None
+        if (lines := self._lines.get(relpath)) is None:
+            lines = self._lines[relpath] = set()
+        return lines
+
+    def _collect(self) -> dict[str, set[int]]:
+        lines, self._lines = self._lines, {}
+        return lines
+
+
+class _MonitoringTracer(_LineTracer):
+    """Record executed lines using sys.monitoring (PEP 669)
+
+    Each line event is disabled after it is first recorded, and re-enabled when the next test starts. This way, a line
+    is reported only once per test regardless of how many times it is executed.
+    """
+
+    def __init__(self, rootpath: Path) -> None:
+        super().__init__(rootpath)
+        monitoring = sys.monitoring  # type: ignore[attr-defined]
+        try:
+            self._tool_id = next(x for x in range(6) if monitoring.get_tool(x) is None)
+        except StopIteration:
+            raise RuntimeError("No sys.monitoring tool ID is available")
+        monitoring.use_tool_id(self._tool_id, "pytest-smoke")
+        monitoring.register_callback(self._tool_id, monitoring.events.LINE, self._on_line)
+
+    def start(self) -> None:
+        monitoring = sys.monitoring  # type: ignore[attr-defined]
+        monitoring.set_events(self._tool_id, monitoring.events.LINE)
+        monitoring.restart_events()
+
+    def stop(self) -> dict[str, set[int]]:
+        sys.monitoring.set_events(self._tool_id, 0)  # type: ignore[attr-defined]
+        return self._collect()
+
+    def close(self) -> None:
+        monitoring = sys.monitoring  # type: ignore[attr-defined]
+        monitoring.register_callback(self._tool_id, monitoring.events.LINE, None)
+        monitoring.free_tool_id(self._tool_id)
+
+    def _on_line(self, code: CodeType, line_number: int) -> Any:
+        if (lines := self._get_lines(code.co_filename)) is not None:
+            lines.add(line_number)
+        return sys.monitoring.DISABLE  # type: ignore[attr-defined]
+
+
+class _SetTraceTracer(_LineTracer):
+    """Record executed lines using sys.settrace
+
+    The trace function set by others (eg. a debugger or coverage.py) is suspended while a test is recorded, and is
+    restored afterwards.
+    """
+
+    def __init__(self, rootpath: Path) -> None:
+        super().__init__(rootpath)
+        self._prev_trace: TraceFunction | None = None
+
+    def start(self) -> None:
+        self._prev_trace = sys.gettrace()
+        sys.settrace(self._trace)
+
+    def stop(self) -> dict[str, set[int]]:
+        sys.settrace(self._prev_trace)
+        self._prev_trace = None
+        return self._collect()
+
+    def _trace(self, frame: FrameType, event: str, arg: Any) -> Any:
+        if event != "call" or (lines := self._get_lines(frame.f_code.co_filename)) is None:
+            return None
+
+        def trace_lines(frame: FrameType, event: str, arg: Any) -> Any:
+            if event == "line":
+                lines.add(frame.f_lineno)
+            return trace_lines
+
+        return trace_lines
@@ -0,0 +1,99 @@
+from __future__ import annotations
+
+from functools import cached_property
+from typing import TYPE_CHECKING, Any
+
+from pytest import hookimpl
+
+from pytest_smoke import smoke
+from pytest_smoke.plugin import STASH_KEY_SMOKE_IS_MUSTPASS
+from pytest_smoke.types import SmokeCacheKey
+
+if smoke.is_xdist_installed:
+    from xdist import is_xdist_worker
+
+if TYPE_CHECKING:
+    from pytest import Cache, Config, Item, Session, TestReport
+
+
+# The weight of the latest duration in the exponential moving average of the duration of each test
+DURATION_SMOOTHING = 0.3
+
+
+class PytestSmokeCriticalOrder:
+    """A plugin that orders critical smoke tests so that a failure of a must-pass test is detected as early as possible
+
+    Must-pass tests run before other critical tests. Within each of them, tests are ordered by the ratio of their
+    historical duration to their estimated failure probability in ascending order, which minimizes the expected time
+    until the first failure. The failure probability is estimated from past outcomes with Laplace smoothing, and tests
+    without any history are treated as the cheapest ones. The history is recorded in the pytest cache. When the
+    cacheprovider plugin is disabled, critical tests other than must-pass ones are kept in the collection order.
+
+    This plugin will be dynamically registered when the smoke_marked_tests_as_critical INI option is enabled
+    """
+
+    name = "smoke-critical-order"
+
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        # nodeid: (total duration of all phases, whether any phase failed)
+        self._results: dict[str, tuple[float, bool]] = {}
+        self._skipped: set[str] = set()
+
+    @cached_property
+    def cache(self) -> Cache | None:
+        """The pytest cache, or None if the cacheprovider plugin is disabled"""
+        return getattr(self.config, "cache", None)
+
+    @cached_property
+    def stats(self) -> dict[str, dict[str, Any]]:
+        """Historical stats of critical tests"""
+        if self.cache is None:
+            return {}
+        return self.cache.get(SmokeCacheKey.CRITICAL, {})
+
+    def sort_items(self, items: list[Item]) -> list[Item]:
+        """Sort critical items in the execution order
+
+        :param items: Selected critical items
+        """
+
+        def sort_key(item: Item) -> tuple[bool, float]:
+            is_mustpass = item.stash.get(STASH_KEY_SMOKE_IS_MUSTPASS, False)
+            if (stats := self.stats.get(item.nodeid)) is None:
+                return not is_mustpass, 0.0
+            failure_probability = (stats["failures"] + 1) / (stats["runs"] + 2)
+            return not is_mustpass, stats["duration"] / failure_probability
+
+        return sorted(items, key=sort_key)
+
+    @hookimpl
+    def pytest_runtest_logreport(self, report: TestReport) -> None:
+        if not getattr(report, "_is_smoke_critical", False):
+            return
+        if report.skipped and not hasattr(report, "wasxfail"):
+            # Skipped tests tell nothing about their duration or outcome
+            self._skipped.add(report.nodeid)
+        duration, failed = self._results.get(report.nodeid, (0.0, False))
+        self._results[report.nodeid] = (duration + report.duration, failed or report.failed)
+
+    @hookimpl
+    def pytest_sessionfinish(self, session: Session) -> None:
+        if (
+            not self._results
+            or self.cache is None
+            or session.config.option.collectonly
+            or (smoke.is_xdist_installed and is_xdist_worker(session))
+        ):
+            return
+        stats = self.stats
+        for nodeid, (duration, failed) in self._results.items():
+            if nodeid in self._skipped:
+                continue
+            if (entry := stats.get(nodeid)) is None:
+                stats[nodeid] = {"duration": duration, "runs": 1, "failures": int(failed)}
+            else:
+                entry["duration"] += DURATION_SMOOTHING * (duration - entry["duration"])
+                entry["runs"] += 1
+                entry["failures"] += int(failed)
+        self.cache.set(SmokeCacheKey.CRITICAL, stats)
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import os
+import time
+from collections.abc import Generator
+from typing import TYPE_CHECKING
+
+import pytest
+from pytest import hookimpl
+
+from pytest_smoke.plugin import STASH_KEY_SMOKE_DEADLINE_EXCEEDED
+from pytest_smoke.types import SmokeEnvVar
+
+if TYPE_CHECKING:
+    from pytest import Item, TerminalReporter, TestReport
+
+
+class PytestSmokeDeadline:
+    """A plugin that skips all remaining tests once the wall-clock deadline from the start of the test session is
+    exceeded
+
+    The start time of the test session is shared between the pytest-xdist controller and workers through an environment
+    variable, so that the deadline applies to the entire session.
+
+    This plugin will be dynamically registered when the --smoke-deadline option is given
+    """
+
+    name = "smoke-deadline"
+
+    def __init__(self, deadline: float) -> None:
+        self.deadline = deadline
+        self._num_skipped = 0
+        self._num_executed = 0
+
+    @property
+    def elapsed_time(self) -> float:
+        return time.time() - float(os.environ[SmokeEnvVar.SMOKE_TEST_SESSION_START_TIME])
+
+    @property
+    def is_exceeded(self) -> bool:
+        return self.elapsed_time > self.deadline
+
+    @hookimpl(tryfirst=True)
+    def pytest_runtest_setup(self, item: Item) -> None:
+        if self.is_exceeded:
+            item.stash[STASH_KEY_SMOKE_DEADLINE_EXCEEDED] = True
+            pytest.skip(reason=f"The smoke deadline ({self.deadline:g}s) was exceeded")
+
+    @hookimpl(wrapper=True)
+    def pytest_runtest_makereport(self, item: Item) -> Generator[None, TestReport, TestReport]:
+        report = yield
+        if item.stash.get(STASH_KEY_SMOKE_DEADLINE_EXCEEDED, False):
+            setattr(report, "_is_smoke_deadline_exceeded", True)
+        return report
+
+    @hookimpl
+    def pytest_runtest_logreport(self, report: TestReport) -> None:
+        if report.when == "setup":
+            if getattr(report, "_is_smoke_deadline_exceeded", False):
+                self._num_skipped += 1
+            else:
+                self._num_executed += 1
+
+    @hookimpl
+    def pytest_terminal_summary(self, terminalreporter: TerminalReporter) -> None:
+        if self._num_skipped:
+            terminalreporter.section("smoke deadline")
+            terminalreporter.write_line(
+                f"The smoke deadline ({self.deadline:g}s) was exceeded. {self._num_skipped}/"
+                f"{self._num_skipped + self._num_executed} selected tests were skipped",
+                yellow=True,
+            )
@@ -0,0 +1,92 @@
+from __future__ import annotations
+
+from collections import Counter
+from collections.abc import Generator
+from typing import TYPE_CHECKING
+
+import pytest
+from pytest import hookimpl
+
+from pytest_smoke.plugin import STASH_KEY_SMOKE_TIER
+
+if TYPE_CHECKING:
+    from pytest import Item, TerminalReporter, TestReport
+
+
+class PytestSmokeEscalate:
+    """A plugin that runs smoke tests in escalating tiers within a single session
+
+    Each tier is selected with its own N on top of the previous tier in a single pass of the test selection, and the
+    selected tests are executed in the order of their tiers. Once a test in a tier fails, tests in all subsequent tiers
+    are skipped, so that a deeper smoke test reuses the interpreter, the collection, and higher-scoped fixtures of a
+    quick one without a second pytest invocation.
+
+    This plugin will be dynamically registered when the --smoke-escalate option is given
+    """
+
+    name = "smoke-escalate"
+
+    def __init__(self, tiers: list[int | float | str]) -> None:
+        self.tiers = tiers
+        self._failed_tiers: set[int] = set()
+        # nodeid: (tier, outcome)
+        self._results: dict[str, tuple[int, str]] = {}
+
+    def get_failed_tiers(self, item: Item) -> list[int]:
+        """Return failed tiers preceding the tier of the item
+
+        :param item: Pytest item
+        """
+        tier = item.stash.get(STASH_KEY_SMOKE_TIER, 0)
+        return sorted(x for x in self._failed_tiers if x < tier)
+
+    @hookimpl(tryfirst=True)
+    def pytest_runtest_setup(self, item: Item) -> None:
+        if failed_tiers := self.get_failed_tiers(item):
+            tier = item.stash.get(STASH_KEY_SMOKE_TIER, 0)
+            pytest.skip(reason=f"Smoke tier {failed_tiers[0] + 1} failed. Escalation to tier {tier + 1} was stopped")
+
+    @hookimpl(wrapper=True)
+    def pytest_runtest_makereport(self, item: Item) -> Generator[None, TestReport, TestReport]:
+        report = yield
+        tier = item.stash.get(STASH_KEY_SMOKE_TIER, 0)
+        setattr(report, "_smoke_tier", tier)
+        if report.failed:
+            self._failed_tiers.add(tier)
+        return report
+
+    @hookimpl
+    def pytest_runtest_logreport(self, report: TestReport) -> None:
+        if (tier := getattr(report, "_smoke_tier", None)) is None:
+            return
+        _, outcome = self._results.get(report.nodeid, (tier, "passed"))
+        if outcome == "passed":
+            if report.failed:
+                outcome = "failed"
+            elif report.skipped:
+                outcome = "stopped" if any(x < tier for x in self._failed_tiers) else "skipped"
+        self._results[report.nodeid] = (tier, outcome)
+
+    @hookimpl
+    def pytest_terminal_summary(self, terminalreporter: TerminalReporter) -> None:
+        if not self._results:
+            return
+
+        tr = terminalreporter
+        tr.section("smoke escalation")
+        outcomes_per_tier: dict[int, Counter[str]] = {}
+        for tier, outcome in self._results.values():
+            outcomes_per_tier.setdefault(tier, Counter())[outcome] += 1
+        for tier, n in enumerate(self.tiers):
+            outcomes = outcomes_per_tier.get(tier, Counter())
+            summary = ", ".join(
+                f"{outcomes[x]} {'not run' if x == 'stopped' else x}"
+                for x in ("passed", "failed", "skipped", "stopped")
+                if outcomes[x]
+            )
+            tr.write_line(
+                f"tier {tier + 1} (N={n}): {summary or 'no tests'}",
+                red=bool(outcomes["failed"]),
+                yellow=bool(outcomes["stopped"]) and not outcomes["failed"],
+                green=bool(outcomes["passed"]) and not (outcomes["failed"] or outcomes["stopped"]),
+            )
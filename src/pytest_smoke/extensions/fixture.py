@@ -0,0 +1,139 @@
+from __future__ import annotations
+
+import time
+from collections.abc import Generator
+from functools import cached_property
+from typing import TYPE_CHECKING, Any
+
+from pytest import hookimpl
+
+from pytest_smoke import smoke
+from pytest_smoke.types import SmokeCacheKey, SmokeIniOption, SmokeMarker
+from pytest_smoke.utils import get_cache, parse_ini_option, sort_items_by_marginal_cost
+
+if smoke.is_xdist_installed:
+    from xdist import is_xdist_worker
+
+if TYPE_CHECKING:
+    from pytest import Config, FixtureDef, FixtureRequest, Item, Session
+
+
+# The weight of the latest setup duration in the exponential moving average of the setup duration of each fixture
+DURATION_SMOOTHING = 0.3
+# The key of the xdist worker output that carries fixture setup durations measured in the worker
+WORKER_OUTPUT_KEY = "smoke_fixture_durations"
+
+# (fixture name, the scope node the fixture value is shared within)
+FixtureKey = tuple[str, str]
+
+
+class PytestSmokeFixtureCost:
+    """A plugin that implements the fixture select mode, which selects tests so that the total setup time of fixtures
+    across the smoke run is as low as possible
+
+    Setup durations of fixtures are recorded in the pytest cache. Tests are picked from each smoke scope group in rounds
+    (the first test of every group, then the second one, and so on), and in each round, the test with the lowest
+    marginal setup cost is picked from the group. The marginal cost of a test is the setup duration of its
+    higher-scoped fixtures that are not yet needed by tests picked earlier, plus the setup duration of its
+    function-scoped fixtures. Fixtures without a recorded duration are considered free, so the selection falls back to
+    the first N tests until durations are recorded.
+
+    This plugin will be dynamically registered when the fixture select mode is used
+    """
+
+    name = "smoke-fixture-cost"
+
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        # fixture name: (total setup duration, number of setups)
+        self._setups: dict[str, tuple[float, int]] = {}
+        self._nested_durations: list[float] = []
+        self._fixture_costs: dict[tuple[int, int], tuple[frozenset[FixtureKey], float]] = {}
+
+    @cached_property
+    def durations(self) -> dict[str, float]:
+        """Recorded setup durations of fixtures"""
+        return get_cache(self.config).get(SmokeCacheKey.FIXTURES, {})
+
+    def sort_items(self, items: list[Item], scope: str) -> list[Item]:
+        """Sort collected items so that the first N items of each smoke scope group minimize the fixture setup time
+
+        :param items: Collected Pytest items
+        :param scope: Smoke scope
+        """
+        enable_critical_tests = parse_ini_option(self.config, SmokeIniOption.SMOKE_MARKED_TESTS_AS_CRITICAL)
+        return sort_items_by_marginal_cost(
+            items,
+            scope,
+            self._get_fixture_costs,
+            lambda x: self.durations[x[0]],
+            # Fixtures needed by critical tests will be set up regardless of the selection
+            is_prepaid=lambda x: bool(
+                enable_critical_tests and (smoke_marker := SmokeMarker.from_item(x)) and smoke_marker.runif
+            ),
+        )
+
+    @hookimpl(wrapper=True)
+    def pytest_fixture_setup(self, fixturedef: FixtureDef[Any], request: FixtureRequest) -> Generator[None, Any, Any]:
+        # Fixtures the fixture depends on are set up within this hook. Exclude their durations
+        self._nested_durations.append(0.0)
+        start = time.perf_counter()
+        try:
+            return (yield)
+        finally:
+            elapsed = time.perf_counter() - start
+            duration = elapsed - self._nested_durations.pop()
+            if self._nested_durations:
+                self._nested_durations[-1] += elapsed
+            total, count = self._setups.get(fixturedef.argname, (0.0, 0))
+            self._setups[fixturedef.argname] = (total + duration, count + 1)
+
+    @hookimpl(optionalhook=True)
+    def pytest_testnodedown(self, node: Any, error: Any) -> None:
+        """Merge setup durations measured in a pytest-xdist worker"""
+        for name, (total, count) in getattr(node, "workeroutput", {}).get(WORKER_OUTPUT_KEY, {}).items():
+            total_, count_ = self._setups.get(name, (0.0, 0))
+            self._setups[name] = (total_ + total, count_ + count)
+
+    @hookimpl
+    def pytest_sessionfinish(self, session: Session) -> None:
+        if session.config.option.collectonly or not self._setups:
+            return
+        if smoke.is_xdist_installed and is_xdist_worker(session):
+            session.config.workeroutput[WORKER_OUTPUT_KEY] = self._setups
+            return
+        durations = self.durations
+        for name, (total, count) in self._setups.items():
+            duration = total / count
+            if name in durations:
+                durations[name] += DURATION_SMOOTHING * (duration - durations[name])
+            else:
+                durations[name] = duration
+        get_cache(session.config).set(SmokeCacheKey.FIXTURES, durations)
+
+    def _get_fixture_costs(self, item: Item) -> tuple[frozenset[FixtureKey], float]:
+        """Return keys of higher-scoped fixtures the item needs, and the setup cost of its function-scoped fixtures"""
+        if (fixtureinfo := getattr(item, "_fixtureinfo", None)) is None:
+            return frozenset(), 0.0
+        # Parametrized items of the same test function share the same fixture info and parent
+        cache_key = (id(fixtureinfo), id(item.parent))
+        if (costs := self._fixture_costs.get(cache_key)) is not None:
+            return costs
+
+        fixture_keys = set()
+        own_cost = 0.0
+        for name, fixturedefs in fixtureinfo.name2fixturedefs.items():
+            if not fixturedefs or name not in self.durations:
+                continue
+            fixturedef = fixturedefs[-1]
+            if fixturedef.scope == "function":
+                own_cost += self.durations[name]
+            elif fixturedef.scope == "class":
+                # The parent is either the class or the module of the test
+                fixture_keys.add((name, item.parent.nodeid if item.parent else item.nodeid))
+            elif fixturedef.scope == "module":
+                fixture_keys.add((name, str(item.path)))
+            else:
+                fixture_keys.add((name, fixturedef.baseid))
+        costs = self._fixture_costs[cache_key] = (frozenset(fixture_keys), own_cost)
+        return costs
@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import gc
+import os
+import signal
+import time
+from multiprocessing.connection import Connection, Pipe, wait
+from typing import TYPE_CHECKING, Any, cast
+
+from pytest import TestReport, hookimpl
+
+from pytest_smoke.plugin import (
+    STASH_KEY_SMOKE_COUNTER,
+    STASH_KEY_SMOKE_GROUP_ID,
+    STASH_KEY_SMOKE_IS_CRITICAL,
+    STASH_KEY_SMOKE_SHOULD_SKIP_RESET,
+)
+
+if TYPE_CHECKING:
+    from pytest import Config, Item, Session, TerminalReporter
+
+
+class PytestSmokeFork:
+    """A plugin that executes selected smoke tests in a pool of worker processes forked from the main process
+
+    Tests are collected, selected, and imported only once in the main process. Workers are forked after that and share
+    the imported modules copy-on-write, so starting a worker takes milliseconds instead of re-importing and
+    re-collecting the whole test suite. Smoke scope groups are handed to workers one at a time over pipes, and reports
+    of the tests are sent back and logged in the main process as they arrive. Critical smoke tests are executed in the
+    main process before workers are forked.
+
+    Workers execute tests with the regular runtest protocol without dispatching the pytest_runtest_protocol hook, so
+    options that wrap the hook (--smoke-memoize, --smoke-record-coverage) can not be used with this plugin.
+
+    This plugin will be dynamically registered when the --smoke-forks option is given
+    """
+
+    name = "smoke-fork"
+
+    def __init__(self, num_workers: int) -> None:
+        self.num_workers = num_workers
+        self._num_units = 0
+        self._startup_durations: list[float] = []
+        self._num_crashed = 0
+
+    @hookimpl(tryfirst=True)
+    def pytest_runtestloop(self, session: Session) -> bool | None:
+        if (session.testsfailed and not session.config.option.continue_on_collection_errors) or (
+            session.config.option.collectonly
+        ):
+            # Let pytest handle these as usual
+            return None
+
+        # Critical smoke tests run first in the main process, which also decides whether must-pass tests failed
+        items_critical = [x for x in session.items if x.stash.get(STASH_KEY_SMOKE_IS_CRITICAL, False)]
+        for i, item in enumerate(items_critical):
+            nextitem = items_critical[i + 1] if i + 1 < len(items_critical) else None
+            item.config.hook.pytest_runtest_protocol(item=item, nextitem=nextitem)
+            self._raise_if_should_stop(session)
+
+        units: dict[Any, list[Item]] = {}
+        for item in session.items:
+            if not item.stash.get(STASH_KEY_SMOKE_IS_CRITICAL, False):
+                units.setdefault(item.stash.get(STASH_KEY_SMOKE_GROUP_ID, None) or item.nodeid, []).append(item)
+        if units:
+            if items_critical and session.stash[STASH_KEY_SMOKE_COUNTER].mustpass.failed:
+                # The last critical test ran without the next item so that everything is torn down before forking. Set
+                # the flag the protocol wrapper would otherwise set, so that workers skip all regular tests
+                session.stash[STASH_KEY_SMOKE_SHOULD_SKIP_RESET] = True
+            self._run_workers(session, list(units.values()))
+            self._raise_if_should_stop(session)
+        return True
+
+    @hookimpl
+    def pytest_terminal_summary(self, terminalreporter: TerminalReporter) -> None:
+        if self._startup_durations:
+            terminalreporter.write_line(
+                f"smoke forks: {self._num_units} work units executed on {len(self._startup_durations)} forked "
+                f"workers (average startup: {sum(self._startup_durations) / len(self._startup_durations) * 1000:.1f}ms)"
+                + (f", {self._num_crashed} crashed" if self._num_crashed else ""),
+                red=bool(self._num_crashed),
+            )
+
+    def _run_workers(self, session: Session, units: list[list[Item]]) -> None:
+        config = session.config
+        items = {item.nodeid: item for unit in units for item in unit}
+        # Create the base temporary directory upfront so that workers share it instead of creating their own ones
+        if (tmp_path_factory := getattr(config, "_tmp_path_factory", None)) is not None:
+            tmp_path_factory.getbasetemp()
+
+        # Objects that exist at this point are shared with workers. Keep the garbage collector from touching them so
+        # that their memory pages are not copied in each worker
+        gc.freeze()
+        conns: dict[Connection, int] = {}
+        fork_times: dict[int, float] = {}
+        try:
+            for _ in range(min(self.num_workers, len(units))):
+                conn, child_conn = Pipe()
+                fork_time = time.perf_counter()
+                if (pid := os.fork()) == 0:
+                    conn.close()
+                    _run_worker(session, units, child_conn)
+                child_conn.close()
+                conns[conn] = pid
+                fork_times[pid] = fork_time
+        finally:
+            gc.unfreeze()
+
+        # pid: indices of units assigned to the worker
+        assigned_units: dict[int, list[int]] = {pid: [] for pid in conns.values()}
+        reported: set[str] = set()
+        next_unit = 0
+        try:
+            while conns:
+                for conn in cast(list[Connection], wait(list(conns))):
+                    pid = conns[conn]
+                    try:
+                        kind, data = conn.recv()
+                    except EOFError:
+                        # The worker exited
+                        del conns[conn]
+                        _, status = os.waitpid(pid, 0)
+                        items_not_run = [x for i in assigned_units[pid] for x in units[i] if x.nodeid not in reported]
+                        if status or items_not_run:
+                            self._report_crashed_worker(pid, items_not_run)
+                        continue
+                    if kind == "ready":
+                        if pid in fork_times:
+                            self._startup_durations.append(time.perf_counter() - fork_times.pop(pid))
+                        if next_unit < len(units) and not (session.shouldfail or session.shouldstop):
+                            assigned_units[pid].append(next_unit)
+                            conn.send(next_unit)
+                            next_unit += 1
+                            self._num_units += 1
+                        else:
+                            conn.send(None)
+                    elif kind == "reports":
+                        item = items[data["nodeid"]]
+                        reported.add(item.nodeid)
+                        self._log_reports(
+                            item,
+                            [
+                                config.hook.pytest_report_from_serializable(config=config, data=x)
+                                for x in data["reports"]
+                            ],
+                        )
+        finally:
+            for conn, pid in conns.items():
+                # Interrupted
+                os.kill(pid, signal.SIGTERM)
+                os.waitpid(pid, 0)
+                conn.close()
+
+    def _report_crashed_worker(self, pid: int, items: list[Item]) -> None:
+        self._num_crashed += 1
+        for item in items:
+            report = TestReport(
+                nodeid=item.nodeid,
+                location=item.location,
+                keywords=dict.fromkeys(item.keywords, 1),
+                outcome="failed",
+                longrepr=f"The smoke fork worker (pid={pid}) crashed before reporting this test",
+                when="call",
+            )
+            self._log_reports(item, [report])
+
+    @staticmethod
+    def _log_reports(item: Item, reports: list[TestReport]) -> None:
+        ihook = item.ihook
+        ihook.pytest_runtest_logstart(nodeid=item.nodeid, location=item.location)
+        for report in reports:
+            ihook.pytest_runtest_logreport(report=report)
+        ihook.pytest_runtest_logfinish(nodeid=item.nodeid, location=item.location)
+
+    @staticmethod
+    def _raise_if_should_stop(session: Session) -> None:
+        if session.shouldfail:
+            raise session.Failed(session.shouldfail)
+        if session.shouldstop:
+            raise session.Interrupted(session.shouldstop)
+
+
+def _run_worker(session: Session, units: list[list[Item]], conn: Connection) -> None:
+    """Run units of items received over the pipe in a forked worker process, and send their reports back"""
+    from _pytest.runner import runtestprotocol
+
+    try:
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        _restart_capturing(session.config)
+        pending_item: Item | None = None
+        while True:
+            conn.send(("ready", None))
+            unit_idx = conn.recv()
+            items = [pending_item] if pending_item else []
+            items.extend(units[unit_idx] if unit_idx is not None else [])
+            # The last item is kept until the next unit is received, so that fixtures shared with the next unit are not
+            # torn down in between
+            pending_item = items.pop() if unit_idx is not None and items else None
+            for i, item in enumerate(items):
+                nextitem = items[i + 1] if i + 1 < len(items) else pending_item
+                reports = runtestprotocol(item, log=False, nextitem=nextitem)
+                conn.send(
+                    (
+                        "reports",
+                        {
+                            "nodeid": item.nodeid,
+                            "reports": [
+                                session.config.hook.pytest_report_to_serializable(config=session.config, report=x)
+                                for x in reports
+                            ],
+                        },
+                    )
+                )
+            if unit_idx is None:
+                break
+        exit_code = 0
+    except BaseException:
+        exit_code = 1
+    finally:
+        # Exit without running any cleanup of the main process (atexit handlers, pytest session finish, etc.)
+        os._exit(exit_code)
+
+
+def _restart_capturing(config: Config) -> None:
+    """Replace the global capture inherited from the main process, whose temporary files are shared with other
+    workers
+    """
+    if (capman := config.pluginmanager.getplugin("capturemanager")) and capman.is_globally_capturing():
+        capman.stop_global_capturing()
+        capman.start_global_capturing()
+        capman.suspend_global_capture()
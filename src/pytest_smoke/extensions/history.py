@@ -0,0 +1,296 @@
+from __future__ import annotations
+
+import os
+import queue
+import sqlite3
+import threading
+import time
+from collections.abc import Generator, Iterable
+from contextlib import closing, contextmanager
+from functools import cached_property
+from pathlib import Path
+from typing import TYPE_CHECKING, cast
+
+from pytest import hookimpl
+
+from pytest_smoke.plugin import STASH_KEY_SMOKE_GROUP_ID
+from pytest_smoke.types import SmokeEnvVar, SmokeIniOption
+from pytest_smoke.utils import get_cache, parse_ini_option
+
+if TYPE_CHECKING:
+    from pytest import Config, Session, TestReport
+
+
+# The maximum number of results written in a single transaction
+BATCH_SIZE = 1000
+# The maximum number of seconds results are held before being written
+BATCH_INTERVAL = 1.0
+# The maximum number of host parameters in a single SQL statement for old SQLite versions
+SQLITE_MAX_VARIABLES = 999
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (id INTEGER PRIMARY KEY, uuid TEXT NOT NULL UNIQUE, started_at REAL NOT NULL);
+CREATE TABLE IF NOT EXISTS tests (id INTEGER PRIMARY KEY, nodeid TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS groups (id INTEGER PRIMARY KEY, group_id TEXT NOT NULL UNIQUE);
+CREATE TABLE IF NOT EXISTS results (
+    session_id INTEGER NOT NULL,
+    test_id INTEGER NOT NULL,
+    group_id INTEGER,
+    outcome TEXT NOT NULL,
+    setup_duration REAL NOT NULL,
+    call_duration REAL NOT NULL,
+    teardown_duration REAL NOT NULL,
+    finished_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_results_test_id ON results (test_id, finished_at);
+CREATE INDEX IF NOT EXISTS ix_results_group_id ON results (group_id, finished_at);
+CREATE INDEX IF NOT EXISTS ix_results_finished_at ON results (finished_at);
+"""
+
+# (nodeid, group ID, outcome, setup duration, call duration, teardown duration, finished at)
+HistoryRow = tuple[str, str | None, str, float, float, float, float]
+
+
+class HistoryStore:
+    """A local history of smoke test outcomes and phase durations, stored in SQLite
+
+    Node IDs and smoke scope group IDs are normalized into their own tables to keep the database compact with a large
+    number of tests.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self._row_ids: dict[str, dict[str, int]] = {}
+
+    @classmethod
+    def from_config(cls, config: Config) -> HistoryStore:
+        return cls(get_cache(config).mkdir("smoke") / "history.db")
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    @contextmanager
+    def connect(self) -> Generator[sqlite3.Connection, None, None]:
+        with closing(sqlite3.connect(self.path, timeout=60, check_same_thread=False)) as conn:
+            # auto_vacuum must be set before any table is created
+            conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute("PRAGMA synchronous = NORMAL")
+            with conn:
+                conn.executescript(SCHEMA)
+            yield conn
+
+    def add_session(self, conn: sqlite3.Connection, session_uuid: str, started_at: float) -> int:
+        """Add a test session and return its row ID"""
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO sessions (uuid, started_at) VALUES (?, ?)", (session_uuid, started_at))
+            return conn.execute("SELECT id FROM sessions WHERE uuid = ?", (session_uuid,)).fetchone()[0]
+
+    def add_results(self, conn: sqlite3.Connection, session_id: int, rows: Iterable[HistoryRow]) -> None:
+        """Add test results of the session in a single transaction"""
+        rows = list(rows)
+        with conn:
+            test_ids = self._get_or_create_ids(conn, "tests", "nodeid", {x[0] for x in rows})
+            group_ids = self._get_or_create_ids(conn, "groups", "group_id", {x[1] for x in rows if x[1] is not None})
+            conn.executemany(
+                "INSERT INTO results "
+                "(session_id, test_id, group_id, outcome, setup_duration, call_duration, teardown_duration, "
+                "finished_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (session_id, test_ids[nodeid], None if group_id is None else group_ids[group_id], *values)
+                    for nodeid, group_id, *values in rows
+                ],
+            )
+
+    def get_recent_call_durations(
+        self, conn: sqlite3.Connection, nodeids: Iterable[str], limit: int, exclude_session_uuid: str | None = None
+    ) -> dict[str, list[float]]:
+        """Return call durations of the most recent passed results of each test, newest first
+
+        :param conn: Database connection
+        :param nodeids: Node IDs of tests
+        :param limit: The maximum number of results per test
+        :param exclude_session_uuid: The UUID of the test session to exclude results of
+        """
+        durations: dict[str, list[float]] = {}
+        nodeids = list(nodeids)
+        for i in range(0, len(nodeids), SQLITE_MAX_VARIABLES - 2):
+            chunk = nodeids[i : i + SQLITE_MAX_VARIABLES - 2]
+            rows = conn.execute(
+                "SELECT nodeid, call_duration FROM ("
+                "SELECT tests.nodeid, results.call_duration, ROW_NUMBER() OVER ("
+                "PARTITION BY results.test_id ORDER BY results.finished_at DESC) AS n FROM tests "
+                "JOIN results ON results.test_id = tests.id JOIN sessions ON sessions.id = results.session_id "
+                f"WHERE tests.nodeid IN ({', '.join('?' * len(chunk))}) AND results.outcome = 'passed' "
+                "AND sessions.uuid IS NOT ?"
+                ") WHERE n <= ? ORDER BY nodeid, n",
+                [*chunk, exclude_session_uuid, limit],
+            )
+            for nodeid, call_duration in rows:
+                durations.setdefault(nodeid, []).append(call_duration)
+        return durations
+
+    def apply_retention(self, conn: sqlite3.Connection, retention_days: int) -> int:
+        """Delete results older than the retention period along with orphaned rows, and compact the database.
+
+        Return the number of deleted results
+        """
+        with conn:
+            num_deleted = conn.execute(
+                "DELETE FROM results WHERE finished_at < ?", (time.time() - retention_days * 86400,)
+            ).rowcount
+            if num_deleted:
+                conn.execute("DELETE FROM sessions WHERE id NOT IN (SELECT DISTINCT session_id FROM results)")
+                conn.execute("DELETE FROM tests WHERE id NOT IN (SELECT DISTINCT test_id FROM results)")
+                conn.execute(
+                    "DELETE FROM groups WHERE id NOT IN (SELECT DISTINCT group_id FROM results "
+                    "WHERE group_id IS NOT NULL)"
+                )
+        if num_deleted:
+            self._row_ids.clear()
+            conn.execute("PRAGMA incremental_vacuum")
+        return num_deleted
+
+    def _get_or_create_ids(self, conn: sqlite3.Connection, table: str, column: str, values: set[str]) -> dict[str, int]:
+        """Return row IDs of the values in the table, inserting missing ones"""
+        row_ids = self._row_ids.setdefault(table, {})
+        if missing := [x for x in values if x not in row_ids]:
+            conn.executemany(f"INSERT OR IGNORE INTO {table} ({column}) VALUES (?)", ((x,) for x in missing))
+            for i in range(0, len(missing), SQLITE_MAX_VARIABLES):
+                chunk = missing[i : i + SQLITE_MAX_VARIABLES]
+                row_ids.update(
+                    (value, row_id)
+                    for row_id, value in conn.execute(
+                        f"SELECT id, {column} FROM {table} WHERE {column} IN ({', '.join('?' * len(chunk))})", chunk
+                    )
+                )
+        return row_ids
+
+
+class PytestSmokeHistory:
+    """A plugin that records the outcome, phase durations, and smoke scope group ID of each executed test to the local
+    history store
+
+    Results are passed to a background thread that writes them in batches, so that no I/O happens while tests are
+    running. Results older than the smoke_history_retention_days INI option are deleted at the end of the session.
+
+    This plugin will be dynamically registered when the --smoke-history option is given
+    """
+
+    name = "smoke-history"
+
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        self._group_ids: dict[str, str] = {}
+        self._durations: dict[str, dict[str, float]] = {}
+        self._outcomes: dict[str, str] = {}
+        self._writer: _HistoryWriter | None = None
+
+    @cached_property
+    def store(self) -> HistoryStore:
+        return HistoryStore.from_config(self.config)
+
+    @cached_property
+    def retention_days(self) -> int:
+        return cast(int, parse_ini_option(self.config, SmokeIniOption.SMOKE_HISTORY_RETENTION_DAYS))
+
+    @hookimpl
+    def pytest_collection_finish(self, session: Session) -> None:
+        self._group_ids = {
+            item.nodeid: str(group_id)
+            for item in session.items
+            if (group_id := item.stash.get(STASH_KEY_SMOKE_GROUP_ID, None)) is not None
+        }
+        if session.items and not session.config.option.collectonly:
+            self._writer = _HistoryWriter(self.store, os.environ[SmokeEnvVar.SMOKE_TEST_SESSION_UUID])
+            self._writer.start()
+
+    @hookimpl
+    def pytest_runtest_logreport(self, report: TestReport) -> None:
+        if self._writer is None:
+            return
+        nodeid = report.nodeid
+        durations = self._durations.setdefault(nodeid, {})
+        durations[report.when] = report.duration
+        if nodeid not in self._outcomes:
+            if getattr(report, "_is_smoke_cached", False):
+                # Replayed by --smoke-memoize without running the test. Its zero durations must not be mistaken for
+                # real passed results
+                self._outcomes[nodeid] = "cached"
+            elif hasattr(report, "wasxfail"):
+                self._outcomes[nodeid] = "xfailed" if report.skipped else "xpassed"
+            elif report.failed:
+                self._outcomes[nodeid] = "failed" if report.when == "call" else "error"
+            elif report.skipped:
+                self._outcomes[nodeid] = "skipped"
+        if report.when == "teardown":
+            del self._durations[nodeid]
+            self._writer.put(
+                (
+                    nodeid,
+                    self._group_ids.get(nodeid),
+                    self._outcomes.pop(nodeid, "passed"),
+                    durations.get("setup", 0.0),
+                    durations.get("call", 0.0),
+                    durations.get("teardown", 0.0),
+                    time.time(),
+                )
+            )
+
+    @hookimpl
+    def pytest_sessionfinish(self) -> None:
+        if self._writer is not None:
+            self._writer.close()
+            with self.store.connect() as conn:
+                self.store.apply_retention(conn, self.retention_days)
+
+
+class _HistoryWriter(threading.Thread):
+    """A background thread that writes test results to the history store in batches"""
+
+    def __init__(self, store: HistoryStore, session_uuid: str) -> None:
+        super().__init__(name="pytest-smoke-history-writer", daemon=True)
+        self.store = store
+        self.session_uuid = session_uuid
+        self.started_at = time.time()
+        self._queue: queue.Queue[HistoryRow | None] = queue.Queue()
+        self._is_closed = False
+        self._error: BaseException | None = None
+
+    def put(self, row: HistoryRow) -> None:
+        self._queue.put(row)
+
+    def close(self) -> None:
+        """Write all remaining results and stop the thread"""
+        self._queue.put(None)
+        self.join()
+        if self._error is not None:
+            raise self._error
+
+    def run(self) -> None:
+        try:
+            with self.store.connect() as conn:
+                session_id = self.store.add_session(conn, self.session_uuid, self.started_at)
+                for rows in self._iter_batches():
+                    self.store.add_results(conn, session_id, rows)
+        except BaseException as e:
+            self._error = e
+            # Drain the queue until close() is called, unless it was already called
+            while not self._is_closed and self._queue.get() is not None:
+                pass
+
+    def _iter_batches(self) -> Generator[list[HistoryRow], None, None]:
+        while not self._is_closed:
+            rows: list[HistoryRow] = []
+            deadline = time.monotonic() + BATCH_INTERVAL
+            while len(rows) < BATCH_SIZE:
+                try:
+                    row = self._queue.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if row is None:
+                    self._is_closed = True
+                    break
+                rows.append(row)
+            if rows:
+                yield rows
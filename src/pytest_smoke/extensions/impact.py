@@ -0,0 +1,276 @@
+from __future__ import annotations
+
+import ast
+import re
+import subprocess
+from collections import Counter, deque
+from functools import cached_property
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, cast
+
+import pytest
+
+from pytest_smoke import smoke
+from pytest_smoke.extensions.coverage import CoverageIndex
+from pytest_smoke.types import SmokeCacheKey, SmokeIniOption, SmokeOption
+from pytest_smoke.utils import generate_group_id, get_cache, parse_ini_option, scale_down
+
+if smoke.is_xdist_installed:
+    from xdist import is_xdist_worker
+
+if TYPE_CHECKING:
+    from pytest import Config, Item, Session
+
+
+class PytestSmokeChangeImpact:
+    """A plugin that applies N only to smoke scope groups impacted by local changes since a git reference
+
+    A smoke scope group is impacted when any of its test files is changed, or imports a changed module directly or
+    transitively. The import graph is statically built from all Python files in the git repository using ast, and the
+    parsed imports of each file are cached in the pytest cache. Non-impacted groups only get a baseline N given with
+    the smoke_changed_baseline_n INI option.
+
+    When line-level impact is enabled, the coverage index recorded with the --smoke-record-coverage option is used
+    instead of the import graph for source files in the index. Only tests covering the changed lines of these files are
+    then selected from each impacted group, up to N. Tests not recorded in the index yet fall back to the import graph.
+
+    This plugin will be dynamically registered when the --smoke-changed-since option is given
+    """
+
+    name = "smoke-change-impact"
+
+    def __init__(self, config: Config, ref: str, line_level: bool = False) -> None:
+        self.config = config
+        self.ref = ref
+        self.line_level = line_level
+        self._impacted_groups: set[str] = set()
+        # Number of impacted tests per group. Used only with line-level impact
+        self._num_impacted_tests: Counter[str] | None = None
+        self._impacted_tests: set[str] = set()
+
+    @cached_property
+    def baseline_n(self) -> int | str:
+        return cast(int | str, parse_ini_option(self.config, SmokeIniOption.SMOKE_CHANGED_BASELINE_N))
+
+    def prepare(self, session: Session, items: list[Item]) -> None:
+        """Find smoke scope groups impacted by the changes
+
+        :param session: Pytest session
+        :param items: Collected Pytest items
+        """
+        index = CoverageIndex.from_config(self.config) if self.line_level else None
+        if index and not index.exists():
+            raise pytest.UsageError(
+                "The coverage map has not been recorded yet. Run tests with the --smoke-record-coverage option first"
+            )
+
+        git_root = Path(_run_git(self.config.rootpath, "rev-parse", "--show-toplevel"))
+        changed_files = {
+            git_root / x for x in _run_git(git_root, "diff", "--name-only", self.ref, "--").splitlines() if x
+        } | _get_untracked_files(git_root)
+        importers = self._get_importers(session, git_root)
+        impacted_files = _get_impacted_files(session, importers, changed_files)
+        scope = SmokeOption(self.config).scope
+        if index:
+            impacted_items = self._get_impacted_items_by_lines(
+                session, index, items, git_root, importers, impacted_files
+            )
+        else:
+            impacted_items = [item for item in items if item.path in impacted_files]
+        group_ids = [
+            str(group_id) for item in impacted_items if (group_id := generate_group_id(item, scope)) is not None
+        ]
+        self._impacted_groups = set(group_ids)
+        if self.line_level:
+            self._num_impacted_tests = Counter(group_ids)
+            self._impacted_tests = {item.nodeid for item in impacted_items}
+
+    def sort_items(self, items: list[Item]) -> list[Item]:
+        """Move impacted tests before other tests so that they are selected first within each smoke scope group
+
+        :param items: Sorted Pytest items
+        """
+        if not self.line_level:
+            return items
+        return sorted(items, key=lambda x: x.nodeid not in self._impacted_tests)
+
+    def get_threshold(self, group_id: Any, default: float, num_collected: int) -> float:
+        """Return the number of tests to select from the smoke scope group
+
+        :param group_id: Smoke scope group ID
+        :param default: The threshold calculated from N
+        :param num_collected: The number of collected tests in the smoke scope group
+        """
+        if str(group_id) in self._impacted_groups:
+            if self._num_impacted_tests is not None:
+                return min(default, self._num_impacted_tests[str(group_id)])
+            return default
+        baseline_n = self.baseline_n
+        if isinstance(baseline_n, str):
+            return scale_down(num_collected, float(baseline_n[:-1]))
+        return baseline_n
+
+    def _get_importers(self, session: Session, git_root: Path) -> dict[str, set[Path]]:
+        """Return Python files importing each module"""
+        cache = get_cache(self.config)
+        cached_imports: dict[str, list[Any]] = cache.get(SmokeCacheKey.IMPORTS, {})
+        new_cached_imports = {}
+        importers: dict[str, set[Path]] = {}
+        for path in _get_python_files(git_root):
+            stat = path.stat()
+            module_name = _get_module_name(path)
+            key = str(path)
+            if (entry := cached_imports.get(key)) and entry[:3] == [stat.st_mtime_ns, stat.st_size, module_name]:
+                imports = entry[3]
+            else:
+                imports = sorted(_parse_imports(path, module_name))
+            new_cached_imports[key] = [stat.st_mtime_ns, stat.st_size, module_name, imports]
+            for name in imports:
+                importers.setdefault(name, set()).add(path)
+        if new_cached_imports != cached_imports and not (smoke.is_xdist_installed and is_xdist_worker(session)):
+            cache.set(SmokeCacheKey.IMPORTS, new_cached_imports)
+        return importers
+
+    def _get_impacted_items_by_lines(
+        self,
+        session: Session,
+        index: CoverageIndex,
+        items: list[Item],
+        git_root: Path,
+        importers: dict[str, set[Path]],
+        impacted_files: set[Path],
+    ) -> list[Item]:
+        """Return items impacted by the changed lines, using the coverage index"""
+        rootpath = self.config.rootpath.resolve()
+        changed_lines: dict[str, set[int]] = {}
+        for path, lines in _get_changed_lines(git_root, self.ref).items():
+            if path.resolve().is_relative_to(rootpath):
+                changed_lines[str(path.resolve().relative_to(rootpath))] = lines
+        recorded_files = index.get_files()
+        recorded_tests = index.get_tests()
+        covering_tests: set[str] = set()
+        # Changed files that have never been executed by recorded tests fall back to the import graph
+        unrecorded_changed_files = {
+            x
+            for x in impacted_files
+            if not (x.resolve().is_relative_to(rootpath) and str(x.resolve().relative_to(rootpath)) in recorded_files)
+        }
+        for relpath, lines in changed_lines.items():
+            if relpath not in recorded_files:
+                continue
+            if tests := index.find_tests({relpath: lines}):
+                covering_tests.update(tests)
+            else:
+                # None of the changed lines are covered, e.g. module-level code executed when the module is imported,
+                # which is not recorded. Fall back to the import graph as well
+                unrecorded_changed_files.add(rootpath / relpath)
+        impacted_files_unrecorded = _get_impacted_files(session, importers, unrecorded_changed_files)
+        return [
+            item
+            for item in items
+            if item.nodeid in covering_tests
+            or item.path in impacted_files_unrecorded
+            or (item.nodeid not in recorded_tests and item.path in impacted_files)
+        ]
+
+
+def _get_impacted_files(session: Session, importers: dict[str, set[Path]], changed_files: set[Path]) -> set[Path]:
+    """Return Python files impacted by the changed files, including the changed files themselves"""
+    impacted_files = set()
+    queue = deque(x for x in changed_files if x.suffix == ".py")
+    while queue:
+        path = queue.popleft()
+        if path in impacted_files:
+            continue
+        impacted_files.add(path)
+        queue.extend(importers.get(_get_module_name(path), ()))
+
+    # Changes to a conftest.py impacts all tests under the directory
+    conftest_dirs = [x.parent for x in impacted_files if x.name == "conftest.py"]
+    if conftest_dirs:
+        impacted_files.update(
+            item.path for item in session.items if any(item.path.is_relative_to(d) for d in conftest_dirs)
+        )
+    return impacted_files
+
+
+def _run_git(cwd: Path, *args: str) -> str:
+    try:
+        proc = subprocess.run(["git", *args], cwd=cwd, capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError) as e:
+        stderr = getattr(e, "stderr", None) or str(e)
+        raise pytest.UsageError(f"Failed to get local changes with git: {stderr.strip()}")
+    return proc.stdout.strip()
+
+
+def _get_untracked_files(git_root: Path) -> set[Path]:
+    return {git_root / x for x in _run_git(git_root, "ls-files", "--others", "--exclude-standard").splitlines() if x}
+
+
+def _get_changed_lines(git_root: Path, ref: str) -> dict[Path, set[int]]:
+    """Return changed line numbers of each file changed since the git reference, based on the new version of the file.
+
+    For removed lines, the lines surrounding them are considered changed. All lines of untracked files are considered
+    changed
+    """
+    changed_lines: dict[Path, set[int]] = {}
+    lines: set[int] = set()
+    for line in _run_git(git_root, "diff", "-U0", "--no-color", "--no-ext-diff", ref, "--").splitlines():
+        if line.startswith("+++ "):
+            lines = changed_lines.setdefault(git_root / line[6:], set()) if line[4:6] == "b/" else set()
+        elif line.startswith("@@ ") and (m := re.match(r"@@ -\S+ \+(\d+)(?:,(\d+))? @@", line)):
+            start, count = int(m.group(1)), int(m.group(2) or 1)
+            if count:
+                lines.update(range(start, start + count))
+            else:
+                lines.update((start, start + 1))
+    for path in _get_untracked_files(git_root):
+        if path.suffix == ".py" and path.is_file():
+            changed_lines[path] = set(range(1, len(path.read_bytes().splitlines()) + 2))
+    return changed_lines
+
+
+def _get_python_files(git_root: Path) -> list[Path]:
+    files = _run_git(git_root, "ls-files", "--cached", "--others", "--exclude-standard", "--", "*.py").splitlines()
+    return [path for x in files if x and (path := git_root / x).is_file()]
+
+
+def _get_module_name(path: Path) -> str:
+    """Return the fully qualified module name of the Python file, based on the packages it belongs to"""
+    names = [] if path.name == "__init__.py" else [path.stem]
+    directory = path.parent
+    while (directory / "__init__.py").exists():
+        names.insert(0, directory.name)
+        directory = directory.parent
+    return ".".join(names)
+
+
+def _parse_imports(path: Path, module_name: str) -> set[str]:
+    """Return names of all modules imported by the Python file, including their parent packages"""
+    try:
+        tree = ast.parse(path.read_bytes(), filename=str(path))
+    except (SyntaxError, ValueError):
+        return set()
+
+    names: set[str] = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Import):
+            names.update(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom):
+            if node.level:
+                package_parts = module_name.split(".")
+                if path.name != "__init__.py":
+                    package_parts.pop()
+                if node.level > 1:
+                    package_parts = package_parts[: -(node.level - 1)]
+                base = ".".join(filter(None, [*package_parts, node.module or ""]))
+            else:
+                base = node.module or ""
+            if base:
+                names.add(base)
+            names.update(".".join(filter(None, [base, alias.name])) for alias in node.names if alias.name != "*")
+
+    for name in list(names):
+        parts = name.split(".")
+        names.update(".".join(parts[:i]) for i in range(1, len(parts)))
+    return names
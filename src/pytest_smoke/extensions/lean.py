@@ -0,0 +1,50 @@
+from __future__ import annotations
+
+import gc
+import time
+from typing import TYPE_CHECKING
+
+from pytest import hookimpl
+
+if TYPE_CHECKING:
+    from pytest import Session, TerminalReporter
+
+
+class PytestSmokeMemoryLean:
+    """A plugin that releases deselected items right after the collection, so that they do not stay in memory for the
+    whole session
+
+    The plugin itself only keeps references to selected items once the selection is done. The remaining reference is
+    the list of deselected items the terminal reporter keeps to count them, which is replaced with their node IDs.
+    Items form reference cycles with their keywords and fixture requests, so a full garbage collection is run once
+    afterwards to free them immediately.
+
+    This plugin will be dynamically registered when the --smoke-memory-lean option is given
+    """
+
+    name = "smoke-memory-lean"
+
+    def __init__(self) -> None:
+        self._num_released = 0
+        self._num_collected_objects = 0
+        self._gc_duration = 0.0
+
+    @hookimpl(tryfirst=True)
+    def pytest_collection_finish(self, session: Session) -> None:
+        tr: TerminalReporter | None = session.config.pluginmanager.get_plugin("terminalreporter")
+        if tr is not None and (deselected := tr.stats.get("deselected")):
+            # The terminal reporter only needs the number of deselected items
+            tr.stats["deselected"] = [getattr(x, "nodeid", x) for x in deselected]
+            self._num_released = len(deselected)
+            del deselected
+        start = time.perf_counter()
+        self._num_collected_objects = gc.collect()
+        self._gc_duration = time.perf_counter() - start
+
+    @hookimpl
+    def pytest_terminal_summary(self, terminalreporter: TerminalReporter) -> None:
+        if self._num_released:
+            terminalreporter.write_line(
+                f"smoke memory lean: released {self._num_released} deselected items "
+                f"({self._num_collected_objects} objects garbage collected in {self._gc_duration * 1000:.1f}ms)"
+            )
@@ -0,0 +1,169 @@
+from __future__ import annotations
+
+import glob
+import hashlib
+import time
+from collections.abc import Generator
+from functools import cached_property
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, cast
+
+from pytest import CallInfo, TestReport, hookimpl
+
+from pytest_smoke import smoke
+from pytest_smoke.compat import TestShortLogReport
+from pytest_smoke.plugin import STASH_KEY_SMOKE_SHOULD_SKIP_RESET
+from pytest_smoke.types import SmokeCacheKey, SmokeIniOption, SmokeMarker
+from pytest_smoke.utils import get_cache, parse_ini_option
+
+if smoke.is_xdist_installed:
+    from xdist import is_xdist_worker
+
+if TYPE_CHECKING:
+    from pytest import Config, Item, Session, TerminalReporter
+
+    from pytest_smoke.extensions.deadline import PytestSmokeDeadline
+    from pytest_smoke.extensions.escalate import PytestSmokeEscalate
+
+
+class PytestSmokeMemoize:
+    """A plugin that skips executing tests whose inputs have not changed since they last passed, and reports them as
+    cached passes
+
+    The inputs of a test are identified by a key generated from its node ID (including parametrize IDs), the source of
+    its test module, and the contents of dependency files declared with @pytest.mark.smoke(depends=...). Entries of
+    tests that fail or whose key changes are invalidated, and the least recently used entries are evicted when the
+    number of entries exceeds the smoke_memoize_max_entries INI option.
+
+    This plugin will be dynamically registered when the --smoke-memoize option is given
+    """
+
+    name = "smoke-memoize"
+
+    def __init__(self, config: Config) -> None:
+        self.config = config
+        self._file_hashes: dict[Path, str] = {}
+        self._keys: dict[str, str] = {}
+        self._failed: set[str] = set()
+        self._num_cached = 0
+
+    @cached_property
+    def max_entries(self) -> int:
+        return cast(int, parse_ini_option(self.config, SmokeIniOption.SMOKE_MEMOIZE_MAX_ENTRIES))
+
+    @cached_property
+    def entries(self) -> dict[str, dict[str, Any]]:
+        """Cached entries of passed tests"""
+        return get_cache(self.config).get(SmokeCacheKey.MEMOIZE, {})
+
+    @hookimpl(tryfirst=True)
+    def pytest_runtest_protocol(self, item: Item, nextitem: Item | None) -> bool | None:
+        key = self._keys[item.nodeid] = self._generate_key(item)
+        if (entry := self.entries.get(item.nodeid)) is None or entry["key"] != key:
+            return None
+        if item.session.stash.get(STASH_KEY_SMOKE_SHOULD_SKIP_RESET, False) or self._will_be_skipped(item):
+            # Let the test be skipped as usual
+            return None
+
+        ihook = item.ihook
+        ihook.pytest_runtest_logstart(nodeid=item.nodeid, location=item.location)
+        for when in ("setup", "call", "teardown"):
+            if when == "teardown":
+                # Tear down what the previously executed tests set up and the next item does not need, as the regular
+                # teardown phase does. An error here is reported for this test like any other teardown error
+                if item.session.shouldfail or item.session.shouldstop:
+                    nextitem = None
+                call: CallInfo[None] = CallInfo.from_call(
+                    lambda: item.session._setupstate.teardown_exact(nextitem), when="teardown"
+                )
+                report = TestReport.from_item_and_call(item, call)
+            else:
+                report = TestReport(
+                    nodeid=item.nodeid,
+                    location=item.location,
+                    keywords=dict.fromkeys(item.keywords, 1),
+                    outcome="passed",
+                    longrepr=None,
+                    when=when,
+                )
+            setattr(report, "_smoke_memoize_key", key)
+            setattr(report, "_is_smoke_cached", True)
+            ihook.pytest_runtest_logreport(report=report)
+        ihook.pytest_runtest_logfinish(nodeid=item.nodeid, location=item.location)
+        return True
+
+    @hookimpl(wrapper=True)
+    def pytest_runtest_makereport(self, item: Item) -> Generator[None, TestReport, TestReport]:
+        report = yield
+        if (key := self._keys.get(item.nodeid)) is not None:
+            setattr(report, "_smoke_memoize_key", key)
+        return report
+
+    @hookimpl
+    def pytest_runtest_logreport(self, report: TestReport) -> None:
+        if (key := getattr(report, "_smoke_memoize_key", None)) is None:
+            return
+        if not report.passed or hasattr(report, "wasxfail"):
+            self._failed.add(report.nodeid)
+            self.entries.pop(report.nodeid, None)
+        elif report.when == "teardown" and report.nodeid not in self._failed:
+            self.entries[report.nodeid] = {"key": key, "last_used": time.time()}
+            if getattr(report, "_is_smoke_cached", False):
+                self._num_cached += 1
+
+    @hookimpl(wrapper=True, trylast=True)
+    def pytest_report_teststatus(
+        self, report: TestReport
+    ) -> Generator[None, TestShortLogReport | tuple[str, str, Any], TestShortLogReport]:
+        status = yield
+        if not isinstance(status, TestShortLogReport):
+            status = TestShortLogReport(*status)
+        if status.word and getattr(report, "_is_smoke_cached", False):
+            annot = " (cached)"
+            if isinstance(status.word, str):
+                status = status._replace(word=status.word + annot)
+            elif isinstance(status.word, tuple):
+                status = status._replace(word=(status.word[0] + annot, *status.word[1:]))
+        return status
+
+    @hookimpl
+    def pytest_terminal_summary(self, terminalreporter: TerminalReporter) -> None:
+        if num_cached := self._num_cached:
+            terminalreporter.write_line(
+                f"smoke memoize: {num_cached} test{'s' if num_cached > 1 else ''} reported as cached passes without "
+                "being executed"
+            )
+
+    @hookimpl
+    def pytest_sessionfinish(self, session: Session) -> None:
+        if session.config.option.collectonly or (smoke.is_xdist_installed and is_xdist_worker(session)):
+            return
+        entries = self.entries
+        if len(entries) > self.max_entries:
+            # Evict the least recently used entries
+            entries = dict(sorted(entries.items(), key=lambda x: x[1]["last_used"])[-self.max_entries :])
+        get_cache(session.config).set(SmokeCacheKey.MEMOIZE, entries)
+
+    def _will_be_skipped(self, item: Item) -> bool:
+        """Return whether the test will be skipped by the --smoke-deadline or --smoke-escalate option"""
+        deadline: PytestSmokeDeadline | None = self.config.pluginmanager.get_plugin("smoke-deadline")
+        escalate: PytestSmokeEscalate | None = self.config.pluginmanager.get_plugin("smoke-escalate")
+        return bool((deadline and deadline.is_exceeded) or (escalate and escalate.get_failed_tiers(item)))
+
+    def _generate_key(self, item: Item) -> str:
+        h = hashlib.sha256()
+        h.update(item.nodeid.encode())
+        h.update(self._hash_file(item.path).encode())
+        if smoke_marker := SmokeMarker.from_item(item):
+            rootpath = item.config.rootpath
+            for pattern in smoke_marker.depends:
+                h.update(pattern.encode())
+                for path in sorted(glob.glob(pattern, root_dir=rootpath, recursive=True)):
+                    if (file_path := rootpath / path).is_file():
+                        h.update(f"{path}:{self._hash_file(file_path)}".encode())
+        return h.hexdigest()
+
+    def _hash_file(self, path: Path) -> str:
+        if (file_hash := self._file_hashes.get(path)) is None:
+            file_hash = self._file_hashes[path] = hashlib.sha256(path.read_bytes()).hexdigest()
+        return file_hash
@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import os
+from dataclasses import dataclass
+from functools import cached_property
+from statistics import median
+from typing import TYPE_CHECKING, cast
+
+from pytest import ExitCode, hookimpl
+
+from pytest_smoke.extensions.history import HistoryStore
+from pytest_smoke.types import SmokeEnvVar, SmokeIniOption
+from pytest_smoke.utils import parse_ini_option
+
+if TYPE_CHECKING:
+    from pytest import Config, Session, TerminalReporter, TestReport
+
+
+# The minimum number of past results required to compare a test against its baseline
+MIN_SAMPLES = 3
+# A slowdown is considered significant when the duration exceeds the baseline median by this many robust deviations
+Z_THRESHOLD = 3.5
+# The scale factor that makes MAD a consistent estimator of the standard deviation for normally distributed data
+MAD_SCALE = 1.4826
+# Lower bounds of the deviation to avoid flagging tiny fluctuations of very stable or very fast tests
+MIN_DEVIATION_RATIO = 0.05
+MIN_DEVIATION_SECONDS = 0.001
+
+
+@dataclass
+class SmokePerfRegression:
+    nodeid: str
+    duration: float
+    median: float
+    z_score: float
+
+    @property
+    def ratio(self) -> float:
+        return self.duration / self.median if self.median else float("inf")
+
+
+class PytestSmokePerfBaseline:
+    """A plugin that compares the call duration of each selected test against a robust baseline of recent runs kept in
+    the history store, and reports statistically significant slowdowns
+
+    The baseline of a test is the median and the median absolute deviation (MAD) of the call durations of its recent
+    passed results. The baseline is loaded once after the collection, and the comparison is done once at the end of the
+    session, so that the per-test hooks only record the call duration.
+
+    This plugin will be dynamically registered when the --smoke-perf-baseline option is given
+    """
+
+    name = "smoke-perf-baseline"
+
+    def __init__(self, config: Config, fail_ratio: float | None = None) -> None:
+        self.config = config
+        self.fail_ratio = fail_ratio
+        self._baselines: dict[str, list[float]] = {}
+        self._durations: dict[str, float] = {}
+        self._regressions: list[SmokePerfRegression] = []
+
+    @cached_property
+    def num_runs(self) -> int:
+        return cast(int, parse_ini_option(self.config, SmokeIniOption.SMOKE_PERF_BASELINE_RUNS))
+
+    @hookimpl
+    def pytest_collection_finish(self, session: Session) -> None:
+        if not session.items or session.config.option.collectonly:
+            return
+        store = HistoryStore.from_config(self.config)
+        if store.exists():
+            with store.connect() as conn:
+                self._baselines = store.get_recent_call_durations(
+                    conn,
+                    (item.nodeid for item in session.items),
+                    self.num_runs,
+                    exclude_session_uuid=os.environ[SmokeEnvVar.SMOKE_TEST_SESSION_UUID],
+                )
+
+    @hookimpl
+    def pytest_runtest_logreport(self, report: TestReport) -> None:
+        if (
+            report.when == "call"
+            and report.passed
+            and not hasattr(report, "wasxfail")
+            and not getattr(report, "_is_smoke_cached", False)
+        ):
+            self._durations[report.nodeid] = report.duration
+
+    @hookimpl(tryfirst=True)
+    def pytest_sessionfinish(self, session: Session) -> None:
+        for nodeid, duration in self._durations.items():
+            baseline = self._baselines.get(nodeid, [])
+            if len(baseline) < MIN_SAMPLES:
+                continue
+            baseline_median = median(baseline)
+            deviation = max(
+                MAD_SCALE * median(abs(x - baseline_median) for x in baseline),
+                MIN_DEVIATION_RATIO * baseline_median,
+                MIN_DEVIATION_SECONDS,
+            )
+            if (z_score := (duration - baseline_median) / deviation) > Z_THRESHOLD:
+                self._regressions.append(SmokePerfRegression(nodeid, duration, baseline_median, z_score))
+        self._regressions.sort(key=lambda x: x.ratio, reverse=True)
+
+        if (
+            self.fail_ratio is not None
+            and session.exitstatus == ExitCode.OK
+            and any(x.ratio > self.fail_ratio for x in self._regressions)
+        ):
+            session.exitstatus = ExitCode.TESTS_FAILED
+
+    @hookimpl
+    def pytest_terminal_summary(self, terminalreporter: TerminalReporter) -> None:
+        if not self._durations:
+            return
+
+        tr = terminalreporter
+        tr.section("smoke performance")
+        num_compared = sum(len(self._baselines.get(x, [])) >= MIN_SAMPLES for x in self._durations)
+        tr.write_line(
+            f"{num_compared}/{len(self._durations)} passed tests compared against the baseline of up to "
+            f"{self.num_runs} recent runs, {len(self._regressions)} significant slowdowns detected"
+        )
+        if self._regressions:
+            tr.write_line(f"{'duration':>10} {'median':>10} {'ratio':>8} {'z-score':>8}  test")
+            for x in self._regressions:
+                exceeded = self.fail_ratio is not None and x.ratio > self.fail_ratio
+                tr.write_line(
+                    f"{x.duration:>9.3f}s {x.median:>9.3f}s {x.ratio:>7.1f}x {x.z_score:>8.1f}  {x.nodeid}",
+                    red=exceeded,
+                    yellow=not exceeded,
+                )
+        if self.fail_ratio is not None and any(x.ratio > self.fail_ratio for x in self._regressions):
+            tr.write_line(f"Failing the run as slowdowns exceed the threshold ({self.fail_ratio}x)", red=True)
@@ -0,0 +1,232 @@
+from __future__ import annotations
+
+import inspect
+import marshal
+import os
+import signal
+import threading
+import time
+from collections import Counter
+from collections.abc import Generator
+from types import CodeType, FrameType
+from typing import TYPE_CHECKING, Any
+
+from pytest import hookimpl
+
+from pytest_smoke import smoke
+from pytest_smoke.plugin import STASH_KEY_SMOKE_GROUP_ID
+
+if smoke.is_xdist_installed:
+    from xdist import is_xdist_worker
+
+if TYPE_CHECKING:
+    from pytest import Item, Session, TerminalReporter
+
+
+# The interval of CPU time between two samples, in seconds. The actual interval depends on the resolution of the kernel
+# timer, so the time of each sample is estimated from the CPU time consumed by profiled tests
+SAMPLING_INTERVAL = 0.001
+# The number of functions shown in the terminal summary
+NUM_TOP_FUNCTIONS = 10
+# The key of the xdist worker output that carries samples taken in the worker
+WORKER_OUTPUT_KEY = "smoke_profile_samples"
+
+# (file name, first line number, function name), which matches the function key of pstats
+FrameKey = tuple[str, int, str]
+
+
+class PytestSmokeProfiler:
+    """A plugin that profiles the call phase of each test with a statistical CPU profiler
+
+    The call stack of the test is sampled every SAMPLING_INTERVAL of CPU time with a SIGPROF interval timer, so the
+    overhead stays low regardless of the number of function calls in the test. Samples are aggregated per smoke scope
+    group and for the whole run, and written to the output directory as:
+    - profile.collapsed: Collapsed stacks of the whole run, which can be rendered as a flame graph
+    - profile-by-group.collapsed: Collapsed stacks with the smoke scope group as the root frame
+    - profile.pstats: A pstats dump of the whole run, where call counts are sample counts
+
+    Only the main thread is sampled. Stacks are cut at the test function, and samples taken outside of the test
+    function (e.g. in pytest hooks) are discarded. When pytest-xdist is used, samples are aggregated in the controller.
+
+    This plugin will be dynamically registered when the --smoke-profile-tests option is given
+    """
+
+    name = "smoke-profile"
+
+    def __init__(self, output_dir: str) -> None:
+        self.output_dir = output_dir
+        # (group ID, stack from the test function to the leaf): number of samples
+        self._samples: Counter[tuple[str, tuple[FrameKey, ...]]] = Counter()
+        self._num_tests = 0
+        self._profiled_time = 0.0
+        self._cpu_time = 0.0
+        self._overhead = 0.0
+        # Stacks of code objects sampled in the current test. Code objects are not used as keys, since identical
+        # functions defined in different files compare equal
+        self._current_samples: list[tuple[CodeType, ...]] = []
+        self._current_test_code: CodeType | None = None
+
+    @hookimpl(wrapper=True)
+    def pytest_runtest_call(self, item: Item) -> Generator[None, None, None]:
+        if threading.current_thread() is not threading.main_thread():
+            # Signal handlers can be set only in the main thread
+            return (yield)
+
+        func = getattr(item, "obj", None)
+        self._current_test_code = getattr(inspect.unwrap(func), "__code__", None) if func else None
+        orig_handler = signal.signal(signal.SIGPROF, self._sample)
+        signal.setitimer(signal.ITIMER_PROF, SAMPLING_INTERVAL, SAMPLING_INTERVAL)
+        start = time.perf_counter()
+        cpu_start = time.process_time()
+        try:
+            return (yield)
+        finally:
+            signal.setitimer(signal.ITIMER_PROF, 0)
+            signal.signal(signal.SIGPROF, orig_handler)
+            self._cpu_time += time.process_time() - cpu_start
+            self._profiled_time += time.perf_counter() - start
+            self._num_tests += 1
+            self._flush_samples(str(item.stash.get(STASH_KEY_SMOKE_GROUP_ID, None) or item.nodeid))
+
+    @hookimpl(optionalhook=True)
+    def pytest_testnodedown(self, node: Any, error: Any) -> None:
+        """Merge samples taken in a pytest-xdist worker"""
+        worker_output = getattr(node, "workeroutput", {}).get(WORKER_OUTPUT_KEY)
+        if not worker_output:
+            return
+        for group_id, stack, count in worker_output["samples"]:
+            self._samples[(group_id, tuple(tuple(x) for x in stack))] += count
+        self._num_tests += worker_output["num_tests"]
+        self._profiled_time += worker_output["profiled_time"]
+        self._cpu_time += worker_output["cpu_time"]
+        self._overhead += worker_output["overhead"]
+
+    @hookimpl
+    def pytest_sessionfinish(self, session: Session) -> None:
+        if session.config.option.collectonly or not self._num_tests:
+            return
+        if smoke.is_xdist_installed and is_xdist_worker(session):
+            session.config.workeroutput[WORKER_OUTPUT_KEY] = {
+                "samples": [
+                    [group_id, [list(x) for x in stack], count] for (group_id, stack), count in self._samples.items()
+                ],
+                "num_tests": self._num_tests,
+                "profiled_time": self._profiled_time,
+                "cpu_time": self._cpu_time,
+                "overhead": self._overhead,
+            }
+            return
+
+        os.makedirs(self.output_dir, exist_ok=True)
+        rootdir = str(session.config.rootpath)
+        labels = {x: _format_frame(x, rootdir) for x in {x for _, stack in self._samples for x in stack}}
+
+        samples_per_stack: Counter[tuple[FrameKey, ...]] = Counter()
+        with open(os.path.join(self.output_dir, "profile-by-group.collapsed"), "w") as f:
+            for (group_id, stack), count in sorted(self._samples.items()):
+                samples_per_stack[stack] += count
+                f.write(";".join([group_id.replace(";", ":"), *(labels[x] for x in stack)]) + f" {count}\n")
+        with open(os.path.join(self.output_dir, "profile.collapsed"), "w") as f:
+            for stack, count in sorted(samples_per_stack.items()):
+                f.write(";".join(labels[x] for x in stack) + f" {count}\n")
+        with open(os.path.join(self.output_dir, "profile.pstats"), "wb") as f:
+            marshal.dump(_to_pstats(samples_per_stack, self._cpu_time / max(sum(self._samples.values()), 1)), f)
+
+    @hookimpl
+    def pytest_terminal_summary(self, terminalreporter: TerminalReporter) -> None:
+        if not self._num_tests:
+            return
+        tr = terminalreporter
+        num_samples = sum(self._samples.values())
+        tr.section("smoke profile")
+        tr.write_line(
+            f"{num_samples} samples from {self._num_tests} tests in "
+            f"{len({group_id for group_id, _ in self._samples})} groups over {self._cpu_time:.2f}s of CPU time"
+            + (f" (effective sampling interval: {self._cpu_time / num_samples * 1000:.1f}ms)" if num_samples else "")
+        )
+        tr.write_line(
+            f"profiler overhead: {self._overhead * 1000:.1f}ms "
+            f"({self._overhead / self._profiled_time if self._profiled_time else 0:.2%} of the profiled call time)"
+        )
+        if num_samples:
+            self_samples: Counter[FrameKey] = Counter()
+            for (_, stack), count in self._samples.items():
+                self_samples[stack[-1]] += count
+            tr.write_line("")
+            tr.write_line(f"Top {min(NUM_TOP_FUNCTIONS, len(self_samples))} functions by self samples:")
+            tr.write_line(f"{'samples':>10} {'share':>7}  function")
+            rootdir = str(tr.config.rootpath)
+            for frame_key, count in self_samples.most_common(NUM_TOP_FUNCTIONS):
+                tr.write_line(f"{count:>10} {count / num_samples:>7.1%}  {_format_frame(frame_key, rootdir)}")
+        tr.write_line("")
+        tr.write_line(f"Collapsed stacks and a pstats dump were written to {self.output_dir}")
+
+    def _sample(self, signum: int, frame: FrameType | None) -> None:
+        start = time.perf_counter()
+        stack = []
+        while frame is not None:
+            stack.append(frame.f_code)
+            if frame.f_code is self._current_test_code:
+                self._current_samples.append(tuple(reversed(stack)))
+                break
+            frame = frame.f_back
+        else:
+            if self._current_test_code is None and stack:
+                self._current_samples.append(tuple(reversed(stack)))
+        self._overhead += time.perf_counter() - start
+
+    def _flush_samples(self, group_id: str) -> None:
+        start = time.perf_counter()
+        frame_keys: dict[int, FrameKey] = {}
+        for codes in self._current_samples:
+            stack = []
+            for code in codes:
+                if (frame_key := frame_keys.get(id(code))) is None:
+                    frame_key = frame_keys[id(code)] = (
+                        code.co_filename,
+                        code.co_firstlineno,
+                        getattr(code, "co_qualname", code.co_name),
+                    )
+                stack.append(frame_key)
+            self._samples[(group_id, tuple(stack))] += 1
+        self._current_samples.clear()
+        self._overhead += time.perf_counter() - start
+
+
+def _format_frame(frame_key: FrameKey, rootdir: str) -> str:
+    """Format a frame as a label of collapsed stacks"""
+    filename, lineno, func_name = frame_key
+    if filename.startswith(rootdir + os.sep):
+        filename = os.path.relpath(filename, rootdir)
+    return f"{func_name} ({filename}:{lineno})".replace(";", ":")
+
+
+def _to_pstats(samples_per_stack: Counter[tuple[FrameKey, ...]], sample_duration: float) -> dict[FrameKey, Any]:
+    """Convert sampled stacks to the stats format of pstats, where time is estimated from the number of samples
+
+    :param samples_per_stack: The number of samples per stack
+    :param sample_duration: The estimated CPU time of each sample
+    """
+    # function: [call count, primitive call count, self time, cumulative time, {caller: [the same 4 values]}]
+    stats: dict[FrameKey, list[Any]] = {}
+    for stack, count in samples_per_stack.items():
+        duration = count * sample_duration
+        seen = set()
+        for i, frame_key in enumerate(stack):
+            entry = stats.setdefault(frame_key, [0, 0, 0.0, 0.0, {}])
+            is_leaf = i == len(stack) - 1
+            if frame_key not in seen:
+                # Count recursive calls only once per stack
+                seen.add(frame_key)
+                entry[0] += count
+                entry[1] += count
+                entry[3] += duration
+            if is_leaf:
+                entry[2] += duration
+            if i > 0:
+                caller = entry[4].setdefault(stack[i - 1], [0, 0, 0.0, 0.0])
+                caller[0] += count
+                caller[1] += count
+                caller[2] += duration if is_leaf else 0.0
+                caller[3] += duration
+    return {k: (*v[:4], {c: tuple(x) for c, x in v[4].items()}) for k, v in stats.items()}
@@ -0,0 +1,176 @@
+from __future__ import annotations
+
+import json
+import math
+import time
+from collections import Counter
+from collections.abc import Callable
+from typing import TYPE_CHECKING
+
+from pytest import hookimpl
+
+from pytest_smoke.plugin import STASH_KEY_SMOKE_COUNTER, STASH_KEY_SMOKE_GROUP_ID
+from pytest_smoke.types import SmokeGroupStats, SmokeOption
+
+if TYPE_CHECKING:
+    from pytest import Session, TerminalReporter, TestReport
+
+
+HISTOGRAM_BAR_WIDTH = 40
+DURATION_BUCKETS = ((0.01, "< 10ms"), (0.1, "< 100ms"), (1, "< 1s"), (10, "< 10s"), (60, "< 1m"), (math.inf, ">= 1m"))
+
+
+class PytestSmokeReport:
+    """A plugin that reports statistics of smoke scope groups in the terminal summary
+
+    Setup, call, and teardown durations are aggregated per group from test reports as the run progresses. When
+    pytest-xdist is used, the reports are aggregated in the controller.
+
+    This plugin will be dynamically registered when the --smoke-report, --smoke-report-json, or --smoke-durations
+    option is given
+    """
+
+    name = "smoke-report"
+
+    def __init__(self, top_k: int | None = None, json_path: str | None = None, durations_k: int | None = None) -> None:
+        self.top_k = top_k
+        self.json_path = json_path
+        self.durations_k = durations_k
+        self._group_ids: dict[str, str] = {}
+        self._stats: dict[str, SmokeGroupStats] = {}
+        self._start_time = 0.0
+        self._wall_time = 0.0
+
+    @hookimpl
+    def pytest_collection_finish(self, session: Session) -> None:
+        if (counter := session.stash.get(STASH_KEY_SMOKE_COUNTER, None)) is None:
+            return
+        self._stats = {str(group_id): SmokeGroupStats(collected=n) for group_id, n in counter.collected.items()}
+        for item in session.items:
+            group_id = str(item.stash[STASH_KEY_SMOKE_GROUP_ID])
+            self._group_ids[item.nodeid] = group_id
+            group_stats = self._stats.setdefault(group_id, SmokeGroupStats())
+            group_stats.selected += 1
+            # The collected count is not available when the selection is replayed from a manifest
+            group_stats.collected = max(group_stats.collected, group_stats.selected)
+        self._start_time = time.perf_counter()
+
+    @hookimpl
+    def pytest_runtest_logreport(self, report: TestReport) -> None:
+        if (group_id := self._group_ids.get(report.nodeid)) is not None:
+            stats = self._stats[group_id]
+            if report.when == "setup":
+                stats.setup_duration += report.duration
+            elif report.when == "call":
+                stats.call_duration += report.duration
+            else:
+                stats.teardown_duration += report.duration
+                stats.executed += 1
+
+    @hookimpl
+    def pytest_sessionfinish(self, session: Session) -> None:
+        self._wall_time = time.perf_counter() - self._start_time
+        if self.json_path and self._stats:
+            with open(self.json_path, "w") as f:
+                json.dump(
+                    {
+                        group_id: {
+                            "collected": stats.collected,
+                            "selected": stats.selected,
+                            "deselected": stats.deselected,
+                            "duration": stats.duration,
+                            "setup_duration": stats.setup_duration,
+                            "call_duration": stats.call_duration,
+                            "teardown_duration": stats.teardown_duration,
+                        }
+                        for group_id, stats in self._stats.items()
+                    },
+                    f,
+                    indent=2,
+                )
+
+    @hookimpl
+    def pytest_terminal_summary(self, terminalreporter: TerminalReporter) -> None:
+        if not self._stats:
+            return
+        if self.top_k:
+            self._write_report(terminalreporter, self.top_k)
+        if self.durations_k:
+            self._write_durations(terminalreporter, self.durations_k)
+
+    def _write_report(self, terminalreporter: TerminalReporter, top_k: int) -> None:
+        tr = terminalreporter
+        opt = SmokeOption(tr.config)
+        all_stats = list(self._stats.items())
+        num_collected = sum(x.collected for _, x in all_stats)
+        num_selected = sum(x.selected for _, x in all_stats)
+        tr.section("smoke report")
+        tr.write_line(f"scope: {opt.scope}, select mode: {opt.select_mode}, N: {opt.n}")
+        tr.write_line(
+            f"{len(all_stats)} groups, {num_collected} collected, {num_selected} selected "
+            f"({num_selected / num_collected:.1%}), {num_collected - num_selected} deselected, "
+            f"{sum(x.duration for _, x in all_stats):.2f}s total duration"
+        )
+        for title, key in (
+            ("duration", lambda x: x[1].duration),
+            ("size", lambda x: x[1].collected),
+        ):
+            top_stats = sorted(all_stats, key=key, reverse=True)[:top_k]
+            tr.write_line("")
+            tr.write_line(f"Top {len(top_stats)} groups by {title}:")
+            tr.write_line(f"{'duration':>10} {'collected':>10} {'selected':>10} {'deselected':>10}  group")
+            for group_id, stats in top_stats:
+                tr.write_line(
+                    f"{stats.duration:>9.2f}s {stats.collected:>10} {stats.selected:>10} {stats.deselected:>10}  "
+                    f"{group_id}"
+                )
+
+        tr.write_line("")
+        self._write_histogram(tr, "Group sizes (collected):", [x.collected for _, x in all_stats], _size_bucket)
+        tr.write_line("")
+        self._write_histogram(tr, "Group durations:", [x.duration for _, x in all_stats], _duration_bucket)
+        if self.json_path:
+            tr.write_line("")
+            tr.write_line(f"Full smoke report of all groups was written to {self.json_path}")
+
+    def _write_durations(self, terminalreporter: TerminalReporter, top_k: int) -> None:
+        tr = terminalreporter
+        all_stats = [x for x in self._stats.items() if x[1].executed]
+        total_duration = sum(x.duration for _, x in all_stats)
+        top_stats = sorted(all_stats, key=lambda x: x[1].duration, reverse=True)[:top_k]
+        tr.section("smoke durations")
+        tr.write_line(
+            f"Top {len(top_stats)} slowest groups out of {len(all_stats)} "
+            f"(total test time: {total_duration:.2f}s, wall time: {self._wall_time:.2f}s):"
+        )
+        tr.write_line(
+            f"{'total':>10} {'share':>7} {'setup':>10} {'call':>10} {'teardown':>10} {'tests':>6} {'avg/test':>10}  "
+            "group"
+        )
+        for group_id, stats in top_stats:
+            share = stats.duration / total_duration if total_duration else 0.0
+            tr.write_line(
+                f"{stats.duration:>9.2f}s {share:>7.1%} {stats.setup_duration:>9.2f}s {stats.call_duration:>9.2f}s "
+                f"{stats.teardown_duration:>9.2f}s {stats.executed:>6} {stats.average_duration:>9.3f}s  {group_id}"
+            )
+
+    @staticmethod
+    def _write_histogram(
+        tr: TerminalReporter, title: str, values: list[float], bucket: Callable[[float], tuple[float, str]]
+    ) -> None:
+        histogram = Counter(bucket(v) for v in values)
+        max_count = max(histogram.values())
+        tr.write_line(title)
+        for (_, label), count in sorted(histogram.items()):
+            bar = "#" * max(1, round(count / max_count * HISTOGRAM_BAR_WIDTH))
+            tr.write_line(f"{label:>14} {count:>8} {bar}")
+
+
+def _size_bucket(size: float) -> tuple[float, str]:
+    lower = 2 ** int(math.log2(max(size, 1)))
+    upper = lower * 2 - 1
+    return lower, str(lower) if lower == upper else f"{lower}-{upper}"
+
+
+def _duration_bucket(duration: float) -> tuple[float, str]:
+    return next((limit, label) for limit, label in DURATION_BUCKETS if duration < limit)
@@ -0,0 +1,142 @@
+from __future__ import annotations
+
+import resource
+import sys
+import tracemalloc
+from collections.abc import Generator
+from dataclasses import asdict
+from typing import TYPE_CHECKING, Any
+
+from pytest import hookimpl
+
+from pytest_smoke.plugin import STASH_KEY_SMOKE_GROUP_ID
+from pytest_smoke.types import SmokeResourceUsage
+from pytest_smoke.utils import format_size
+
+if TYPE_CHECKING:
+    from pytest import CallInfo, Item, Session, TerminalReporter, TestReport
+
+
+# ru_maxrss is in bytes on macOS, and in kilobytes on other platforms
+MAX_RSS_UNIT = 1 if sys.platform == "darwin" else 1024
+
+
+class PytestSmokeResources:
+    """A plugin that records resource usage of each test
+
+    Deltas of the CPU time (user/sys) and the peak RSS of the process are measured with getrusage() around setup, call,
+    and teardown of each test, and optionally the peak size of memory allocated during each phase is measured with
+    tracemalloc. The usage of each phase is attached to its test report, so that it is aggregated per test and per
+    smoke scope group from reports. When pytest-xdist is used, the reports are aggregated in the controller.
+
+    This plugin will be dynamically registered when the --smoke-resources option is given
+    """
+
+    name = "smoke-resources"
+
+    def __init__(self, top_k: int, trace_allocations: bool = False) -> None:
+        self.top_k = top_k
+        self.trace_allocations = trace_allocations
+        self._is_tracing_started = False
+        self._group_ids: dict[str, str] = {}
+        # (nodeid, when): usage of the phase
+        self._phase_usages: dict[tuple[str, str], SmokeResourceUsage] = {}
+        self._test_usages: dict[str, SmokeResourceUsage] = {}
+        self._group_usages: dict[str, SmokeResourceUsage] = {}
+
+    @hookimpl
+    def pytest_sessionstart(self, session: Session) -> None:
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._is_tracing_started = True
+
+    @hookimpl
+    def pytest_collection_finish(self, session: Session) -> None:
+        self._group_ids = {
+            item.nodeid: str(item.stash.get(STASH_KEY_SMOKE_GROUP_ID, None) or item.nodeid) for item in session.items
+        }
+
+    @hookimpl(wrapper=True)
+    def pytest_runtest_setup(self, item: Item) -> Generator[None, None, None]:
+        return (yield from self._measure(item, "setup"))
+
+    @hookimpl(wrapper=True)
+    def pytest_runtest_call(self, item: Item) -> Generator[None, None, None]:
+        return (yield from self._measure(item, "call"))
+
+    @hookimpl(wrapper=True)
+    def pytest_runtest_teardown(self, item: Item) -> Generator[None, None, None]:
+        return (yield from self._measure(item, "teardown"))
+
+    @hookimpl(wrapper=True)
+    def pytest_runtest_makereport(self, item: Item, call: CallInfo[None]) -> Generator[None, TestReport, TestReport]:
+        report = yield
+        if (usage := self._phase_usages.pop((item.nodeid, call.when), None)) is not None:
+            setattr(report, "_smoke_resources", asdict(usage))
+        return report
+
+    @hookimpl
+    def pytest_runtest_logreport(self, report: TestReport) -> None:
+        if (usage_dict := getattr(report, "_smoke_resources", None)) is None:
+            return
+        usage = SmokeResourceUsage(**usage_dict)
+        self._test_usages.setdefault(report.nodeid, SmokeResourceUsage()).add(usage)
+        group_id = self._group_ids.get(report.nodeid, report.nodeid)
+        self._group_usages.setdefault(group_id, SmokeResourceUsage()).add(usage)
+
+    @hookimpl
+    def pytest_sessionfinish(self, session: Session) -> None:
+        if self._is_tracing_started:
+            tracemalloc.stop()
+            self._is_tracing_started = False
+
+    @hookimpl
+    def pytest_terminal_summary(self, terminalreporter: TerminalReporter) -> None:
+        if not self._test_usages:
+            return
+
+        tr = terminalreporter
+        tr.section("smoke resources")
+        memory_title = "peak allocation" if self.trace_allocations else "max RSS growth"
+        for kind, usages in (("tests", self._test_usages), ("groups", self._group_usages)):
+            for title, key in (
+                ("CPU time", lambda x: x.cpu_time),
+                (memory_title, lambda x: (x.alloc_peak or 0) if self.trace_allocations else x.max_rss_growth),
+            ):
+                top_usages = sorted(usages.items(), key=lambda x: key(x[1]), reverse=True)[: self.top_k]
+                if (kind, title) != ("tests", "CPU time"):
+                    tr.write_line("")
+                tr.write_line(f"Top {len(top_usages)} {kind} by {title}:")
+                tr.write_line(
+                    f"{'user':>9} {'sys':>9} {'RSS growth':>11}"
+                    + (f" {'alloc peak':>11}" if self.trace_allocations else "")
+                    + f"  {kind[:-1]}"
+                )
+                for name, usage in top_usages:
+                    tr.write_line(
+                        f"{usage.cpu_user:>8.2f}s {usage.cpu_sys:>8.2f}s {format_size(usage.max_rss_growth):>11}"
+                        + (f" {format_size(usage.alloc_peak or 0):>11}" if self.trace_allocations else "")
+                        + f"  {name}"
+                    )
+
+    def _measure(self, item: Item, when: str) -> Generator[None, Any, Any]:
+        if self.trace_allocations and tracemalloc.is_tracing():
+            tracemalloc.reset_peak()
+            traced_start, _ = tracemalloc.get_traced_memory()
+        else:
+            traced_start = None
+        start = resource.getrusage(resource.RUSAGE_SELF)
+        try:
+            return (yield)
+        finally:
+            end = resource.getrusage(resource.RUSAGE_SELF)
+            self._phase_usages[(item.nodeid, when)] = SmokeResourceUsage(
+                cpu_user=end.ru_utime - start.ru_utime,
+                cpu_sys=end.ru_stime - start.ru_stime,
+                max_rss_growth=(end.ru_maxrss - start.ru_maxrss) * MAX_RSS_UNIT,
+                alloc_peak=(
+                    max(0, tracemalloc.get_traced_memory()[1] - traced_start)
+                    if traced_start is not None and tracemalloc.is_tracing()
+                    else None
+                ),
+            )
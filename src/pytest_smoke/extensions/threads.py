@@ -0,0 +1,174 @@
+from __future__ import annotations
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Any
+
+import pytest
+from pytest import CallInfo, ExceptionInfo, Function, hookimpl
+
+from pytest_smoke.compat import call_and_report, init_fixture_request, release_fixture_request
+from pytest_smoke.plugin import STASH_KEY_SMOKE_IS_CRITICAL
+from pytest_smoke.types import SmokeMarker
+
+if TYPE_CHECKING:
+    from pytest import Item, Session, TerminalReporter, TestReport
+
+
+class PytestSmokeThreads:
+    """A plugin that executes the call phase of thread-safe smoke tests concurrently on a thread pool inside the main
+    process
+
+    A test is eligible when it is marked with @pytest.mark.smoke(threadsafe=True), is not a critical smoke test, and
+    does not use any function-scoped fixtures. Consecutive eligible tests under the same parent (module or class) are
+    executed as a batch: setup and teardown run in the main thread through the regular hooks, and only the test
+    functions run concurrently. Reports of the batch are logged in the original order of the tests after all of them
+    have finished.
+
+    Note that the pytest_runtest_call hook and per-test output capturing are bypassed for the tests in a batch. Output
+    written during a batch is attached to the reports of all tests in the batch. Other plugins wrapping the
+    pytest_runtest_protocol hook only see the first test of a batch.
+
+    This plugin will be dynamically registered when the --smoke-threads option is given
+    """
+
+    name = "smoke-threads"
+
+    def __init__(self, num_threads: int) -> None:
+        self.num_threads = num_threads
+        # nodeid of the first item of a batch: (items of the batch, the item after the batch)
+        self._batches: dict[str, tuple[list[Function], Item | None]] = {}
+        self._batched: set[str] = set()
+        self._num_batched = 0
+        self._time_saved = 0.0
+
+    @hookimpl
+    def pytest_collection_finish(self, session: Session) -> None:
+        if session.config.option.collectonly or session.config.option.setuponly:
+            return
+        batch: list[Function] = []
+        for item in [*session.items, None]:
+            if item is not None and self._is_eligible(item):
+                assert isinstance(item, Function)
+                if not batch or batch[-1].parent is item.parent:
+                    batch.append(item)
+                    continue
+            if len(batch) > 1:
+                self._batches[batch[0].nodeid] = (batch, item)
+                self._batched.update(x.nodeid for x in batch)
+            batch = [item] if item is not None and self._is_eligible(item) else []
+
+    @hookimpl(tryfirst=True)
+    def pytest_runtest_protocol(self, item: Item, nextitem: Item | None) -> bool | None:
+        if (batch_info := self._batches.pop(item.nodeid, None)) is not None:
+            self._run_batch(*batch_info)
+            return True
+        if item.nodeid in self._batched:
+            # Already executed as part of a batch
+            return True
+        return None
+
+    @hookimpl
+    def pytest_terminal_summary(self, terminalreporter: TerminalReporter) -> None:
+        if self._num_batched:
+            terminalreporter.write_line(
+                f"smoke threads: {self._num_batched} thread-safe tests executed concurrently on {self.num_threads} "
+                f"threads (estimated time saved: {self._time_saved:.2f}s)"
+            )
+
+    def _run_batch(self, batch: list[Function], nextitem: Item | None) -> None:
+        # Set up each item in the main thread. Since the items share the same parent and do not use function-scoped
+        # fixtures, tearing down the item node right away keeps all fixtures the test functions need
+        reports: dict[str, list[TestReport]] = {}
+        runnable: list[Function] = []
+        for i, item in enumerate(batch):
+            init_fixture_request(item)
+            reports[item.nodeid] = [call_and_report(item, "setup")]
+            if reports[item.nodeid][0].passed:
+                runnable.append(item)
+            if i < len(batch) - 1:
+                reports[item.nodeid].append(call_and_report(item, "teardown", nextitem=batch[i + 1]))
+
+        capman = batch[0].config.pluginmanager.getplugin("capturemanager")
+        if capman:
+            capman.resume_global_capture()
+        start = time.perf_counter()
+        try:
+            with ThreadPoolExecutor(max_workers=self.num_threads, thread_name_prefix="pytest-smoke") as executor:
+                calls = list(executor.map(_call_runtest, runnable))
+        finally:
+            elapsed = time.perf_counter() - start
+            out = err = ""
+            if capman:
+                capman.suspend_global_capture(in_=False)
+                out, err = capman.read_global_capture()
+
+        for call in calls:
+            if call.excinfo is not None and isinstance(call.excinfo.value, (pytest.exit.Exception, KeyboardInterrupt)):
+                raise call.excinfo.value
+        self._num_batched += len(batch)
+        self._time_saved += max(0.0, sum(x.duration for x in calls) - elapsed)
+
+        calls_per_item = dict(zip((x.nodeid for x in runnable), calls))
+        for i, item in enumerate(batch):
+            ihook = item.ihook
+            ihook.pytest_runtest_logstart(nodeid=item.nodeid, location=item.location)
+            setup_report, *teardown_reports = reports[item.nodeid]
+            item_reports = [setup_report]
+            if (call := calls_per_item.get(item.nodeid)) is not None:
+                call_report: TestReport = ihook.pytest_runtest_makereport(item=item, call=call)
+                for name, content in (("stdout", out), ("stderr", err)):
+                    if content:
+                        call_report.sections.append((f"Captured {name} call (concurrent batch)", content))
+                item_reports.append(call_report)
+            if i == len(batch) - 1:
+                if item.session.shouldfail or item.session.shouldstop:
+                    nextitem = None
+                teardown_reports = [call_and_report(item, "teardown", nextitem=nextitem)]
+            for report in item_reports + teardown_reports:
+                ihook.pytest_runtest_logreport(report=report)
+            ihook.pytest_runtest_logfinish(nodeid=item.nodeid, location=item.location)
+            release_fixture_request(item)
+
+    @staticmethod
+    def _is_eligible(item: Item) -> bool:
+        if not isinstance(item, Function) or item.stash.get(STASH_KEY_SMOKE_IS_CRITICAL, False):
+            return False
+        if not ((smoke_marker := SmokeMarker.from_item(item)) and smoke_marker.threadsafe):
+            return False
+        direct_params = _get_direct_param_names(item)
+        return not any(
+            fixturedefs[-1].scope == "function"
+            # Ignore pseudo fixtures of direct parametrization
+            and name not in direct_params
+            for name, fixturedefs in item._fixtureinfo.name2fixturedefs.items()
+            if fixturedefs
+        )
+
+
+def _get_direct_param_names(item: Function) -> set[str]:
+    """Return argument names the test function is directly (not indirectly) parametrized with"""
+    if (callspec := getattr(item, "callspec", None)) is None:
+        return set()
+    names: set[str] = set()
+    for mark in item.iter_markers("parametrize"):
+        argnames = mark.args[0] if mark.args else mark.kwargs.get("argnames", ())
+        if isinstance(argnames, str):
+            argnames = [x.strip() for x in argnames.split(",") if x.strip()]
+        indirect = mark.kwargs.get("indirect", False)
+        if indirect is True:
+            continue
+        names.update(x for x in argnames if not (indirect and x in indirect))
+    return names & callspec.params.keys()
+
+
+def _call_runtest(item: Function) -> CallInfo[Any]:
+    start = time.time()
+    precise_start = time.perf_counter()
+    excinfo = None
+    try:
+        item.runtest()
+    except BaseException:
+        excinfo = ExceptionInfo.from_current()
+    duration = time.perf_counter() - precise_start
+    return CallInfo(None, excinfo, start=start, stop=time.time(), duration=duration, when="call", _ispytest=True)
@@ -1,8 +1,11 @@
 from __future__ import annotations
 
+import math
+from collections import Counter
+from dataclasses import dataclass
 from typing import Any
 
-from pytest import Config, Item, Session, hookimpl
+from pytest import Config, Item, Session, TerminalReporter, hookimpl
 
 from pytest_smoke import smoke
 from pytest_smoke.types import SmokeIniOption, SmokeOption
@@ -24,6 +27,28 @@ if smoke.is_xdist_installed:
             item = self._nodes[nodeid]
             return generate_group_id(item, self.smoke_option.scope)
 
+    class SmokeAffinityScheduling(SmokeScopeScheduling):
+        """A custom pytest-xdist scheduler that distributes workloads by clusters of smoke scope groups sharing
+        session or package-scoped fixtures, so that each of these fixtures is set up on as few workers as possible
+
+        A cluster larger than the fair share of a worker is split into multiple work units to keep the load balanced
+        """
+
+        def __init__(self, config: Config, log: Any, *, nodes: dict[str, Item]) -> None:
+            super().__init__(config, log, nodes=nodes)
+            self.affinity: SmokeAffinity | None = None
+
+        def _split_scope(self, nodeid: str) -> str:
+            if self.affinity is None:
+                self.affinity = SmokeAffinity.from_items(
+                    list(self._nodes.values()), self.smoke_option.scope, num_workers=self.numnodes
+                )
+                self.log(
+                    f"{len(set(self.affinity.units.values()))} work units, estimated fixture setups: "
+                    f"{self.affinity.num_setups_by_scope} -> {self.affinity.num_setups}"
+                )
+            return self.affinity.units[nodeid]
+
     class PytestSmokeXdist:
         """A plugin that extends pytest-smoke to seamlesslly support pytest-xdist
 
@@ -34,6 +59,7 @@ if smoke.is_xdist_installed:
 
         def __init__(self) -> None:
             self._nodes: dict[str, Item] = {}
+            self._scheduler: SmokeScopeScheduling | None = None
 
         @hookimpl(tryfirst=True)
         def pytest_collection(self, session: Session) -> bool | None:
@@ -45,13 +71,112 @@ if smoke.is_xdist_installed:
         def pytest_xdist_make_scheduler(self, config: Config, log: Any) -> SmokeScopeScheduling | None:
             """Replace the pytest-xdist default scheduler (load) with our custom scheduler (smoke scope) when the
             following conditions match:
-            - The INI option value is set to true
-            - No dist option (--dist or -d) is explicitly given
+            - The INI option value is set to true, or the --smoke-xdist-affinity option is given
+            - No dist option (--dist or -d) is explicitly given. This is rejected upfront for --smoke-xdist-affinity
             """
-            if (
-                config.known_args_namespace.dist == "no"
-                and not config.known_args_namespace.distload
-                and parse_ini_option(config, SmokeIniOption.SMOKE_DEFAULT_XDIST_DIST_BY_SCOPE)
-            ):
-                return SmokeScopeScheduling(config, log, nodes=self._nodes)
-            return None
+            if config.known_args_namespace.dist == "no" and not config.known_args_namespace.distload:
+                if config.option.smoke_xdist_affinity:
+                    self._scheduler = SmokeAffinityScheduling(config, log, nodes=self._nodes)
+                elif parse_ini_option(config, SmokeIniOption.SMOKE_DEFAULT_XDIST_DIST_BY_SCOPE):
+                    self._scheduler = SmokeScopeScheduling(config, log, nodes=self._nodes)
+            return self._scheduler
+
+        def pytest_terminal_summary(self, terminalreporter: TerminalReporter) -> None:
+            if isinstance(self._scheduler, SmokeAffinityScheduling) and (affinity := self._scheduler.affinity):
+                terminalreporter.write_line(
+                    f"smoke xdist affinity: {affinity.num_groups} smoke scope groups distributed in "
+                    f"{len(set(affinity.units.values()))} work units, estimated fixture setups saved: "
+                    f"{max(0, affinity.num_setups_by_scope - affinity.num_setups)} "
+                    f"({affinity.num_setups_by_scope} -> {affinity.num_setups})"
+                )
+
+
+@dataclass
+class SmokeAffinity:
+    # nodeid: work unit
+    units: dict[str, str]
+    num_groups: int
+    # Estimated number of setups of session/package-scoped fixtures across workers
+    num_setups: int
+    num_setups_by_scope: int
+
+    @classmethod
+    def from_items(cls, items: list[Item], scope: str, num_workers: int) -> SmokeAffinity:
+        """Cluster smoke scope groups of the items by their shared session/package-scoped fixtures, and split clusters
+        into work units of up to the fair share of a worker
+
+        :param items: Selected Pytest items
+        :param scope: Smoke scope
+        :param num_workers: The number of pytest-xdist workers
+        """
+        nodeids_per_group: dict[str, list[str]] = {}
+        fixture_keys_per_group: dict[str, set[tuple[str, str]]] = {}
+        for item in items:
+            group_id = str(generate_group_id(item, scope))
+            nodeids_per_group.setdefault(group_id, []).append(item.nodeid)
+            fixture_keys_per_group.setdefault(group_id, set()).update(_get_shared_fixture_keys(item))
+
+        # Union-find over groups that share fixtures
+        parents = {group_id: group_id for group_id in nodeids_per_group}
+
+        def find(group_id: str) -> str:
+            while parents[group_id] != group_id:
+                parents[group_id] = group_id = parents[parents[group_id]]
+            return group_id
+
+        first_group_per_fixture_key: dict[tuple[str, str], str] = {}
+        for group_id, fixture_keys in fixture_keys_per_group.items():
+            for fixture_key in fixture_keys:
+                if (other_group_id := first_group_per_fixture_key.setdefault(fixture_key, group_id)) != group_id:
+                    parents[find(group_id)] = find(other_group_id)
+
+        groups_per_cluster: dict[str, list[str]] = {}
+        for group_id in nodeids_per_group:
+            groups_per_cluster.setdefault(find(group_id), []).append(group_id)
+
+        capacity = math.ceil(len(items) / max(num_workers, 1))
+        units: dict[str, str] = {}
+        groups_per_unit: dict[str, list[str]] = {}
+        for group_ids in groups_per_cluster.values():
+            # Keep groups that need the same fixtures next to each other so that they are likely to stay in one unit
+            group_ids.sort(key=lambda x: sorted(fixture_keys_per_group[x]))
+            unit_id = None
+            unit_size = 0
+            for group_id in group_ids:
+                group_size = len(nodeids_per_group[group_id])
+                if unit_id is None or unit_size + group_size > capacity:
+                    unit_id = group_id
+                    unit_size = 0
+                unit_size += group_size
+                groups_per_unit.setdefault(unit_id, []).append(group_id)
+                units.update(dict.fromkeys(nodeids_per_group[group_id], unit_id))
+
+        num_groups_per_fixture_key: Counter[tuple[str, str]] = Counter()
+        units_per_fixture_key: dict[tuple[str, str], set[str]] = {}
+        for unit_id, group_ids in groups_per_unit.items():
+            for group_id in group_ids:
+                num_groups_per_fixture_key.update(fixture_keys_per_group[group_id])
+                for fixture_key in fixture_keys_per_group[group_id]:
+                    units_per_fixture_key.setdefault(fixture_key, set()).add(unit_id)
+        num_setups = sum(min(len(x), num_workers) for x in units_per_fixture_key.values())
+        # The expected number of distinct workers that receive at least one of the groups needing the fixture
+        num_setups_by_scope = sum(
+            round(num_workers * (1 - (1 - 1 / num_workers) ** n)) for n in num_groups_per_fixture_key.values()
+        )
+        return cls(
+            units=units,
+            num_groups=len(nodeids_per_group),
+            num_setups=num_setups,
+            num_setups_by_scope=num_setups_by_scope,
+        )
+
+
+def _get_shared_fixture_keys(item: Item) -> set[tuple[str, str]]:
+    """Return (name, base ID) of session/package-scoped fixtures the item needs"""
+    if (fixtureinfo := getattr(item, "_fixtureinfo", None)) is None:
+        return set()
+    return {
+        (name, fixturedefs[-1].baseid)
+        for name, fixturedefs in fixtureinfo.name2fixturedefs.items()
+        if fixturedefs and fixturedefs[-1].scope in ("session", "package")
+    }
@@ -47,3 +47,21 @@ def pytest_smoke_sort_by_select_mode(items: list[Item], scope: str, select_mode:
         - This hook does not affect the test execution order
 
     """
+
+
+@hookspec(firstresult=True)
+def pytest_smoke_select_from_group(
+    group_id: str, items: list[Item], n: int, scope: str, select_mode: str
+) -> list[Item] | None:
+    """Return up to N items selected from the smoke scope group to implement a test selection logic for the custom
+    select mode, without sorting the items of the whole test suite.
+    The hook is called once per smoke scope group with the items of the group that can be counted towards N, in the
+    collected order. The returned items are final, and the other items of the group are deselected even if fewer
+    than N items are returned. Return None to fall back to the pytest_smoke_sort_by_select_mode hook.
+
+    Note:
+        - The hook is called only for custom select modes, and takes precedence over pytest_smoke_sort_by_select_mode
+        - The hook is not called for groups where no tests or all tests are to be selected
+        - This hook does not affect the test execution order
+
+    """
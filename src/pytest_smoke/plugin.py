@@ -1,8 +1,13 @@
 from __future__ import annotations
 
 import os
+import signal
+import sys
+import time
+from bisect import bisect_right
 from collections import Counter
 from collections.abc import Generator, Mapping
+from itertools import accumulate
 from typing import TYPE_CHECKING, Any, cast
 from uuid import uuid4
 
@@ -10,12 +15,14 @@ import pytest
 from pytest import StashKey
 
 from pytest_smoke import smoke
-from pytest_smoke.compat import TestShortLogReport
+from pytest_smoke.compat import IS_RUNTEST_PHASE_API_SUPPORTED, TestShortLogReport
 from pytest_smoke.types import (
     SmokeCounter,
     SmokeDefaultN,
     SmokeEnvVar,
     SmokeIniOption,
+    SmokeManifest,
+    SmokeManifestItem,
     SmokeMarker,
     SmokeOption,
     SmokeScope,
@@ -23,13 +30,26 @@ from pytest_smoke.types import (
 )
 from pytest_smoke.utils import (
     Cache,
+    apply_quotas,
+    calculate_threshold,
     generate_group_id,
+    load_manifest,
+    load_node_matcher,
+    parse_duration,
+    parse_escalation,
     parse_ini_option,
     parse_n,
+    parse_positive_int,
+    parse_ratio,
     parse_scope,
     parse_select_mode,
+    save_rotation_state,
     scale_down,
+    select_items_per_group,
     sort_items,
+    sort_items_breadth_first,
+    update_rotation_state,
+    write_manifest,
 )
 
 if smoke.is_xdist_installed:
@@ -40,12 +60,27 @@ if smoke.is_xdist_installed:
 if TYPE_CHECKING:
     from pytest import Config, Item, Parser, PytestPluginManager, Session, StashKey, TestReport
 
+    from pytest_smoke.extensions.adaptive import PytestSmokeAdaptive
+    from pytest_smoke.extensions.critical import PytestSmokeCriticalOrder
+    from pytest_smoke.extensions.impact import PytestSmokeChangeImpact
+
 
 STASH_KEY_SMOKE_COUNTER = StashKey[SmokeCounter]()
+STASH_KEY_SMOKE_GROUP_ID = StashKey[Any]()
 STASH_KEY_SMOKE_IS_CRITICAL = StashKey[bool]()
 STASH_KEY_SMOKE_IS_MUSTPASS = StashKey[bool]()
+STASH_KEY_SMOKE_IS_INCLUDED = StashKey[bool]()
 STASH_KEY_SMOKE_SHOULD_SKIP_RESET = StashKey[bool]()
+STASH_KEY_SMOKE_ROTATION_STATE = StashKey[dict[str, list[str]]]()
+STASH_KEY_SMOKE_DEADLINE_EXCEEDED = StashKey[bool]()
+STASH_KEY_SMOKE_TIER = StashKey[int]()
 DEFAULT_N = SmokeDefaultN(1)
+DEFAULT_SMOKE_REPORT_K = 10
+DEFAULT_SMOKE_ADAPTIVE_MAX_N = 10
+DEFAULT_SMOKE_MEMOIZE_MAX_ENTRIES = 10000
+DEFAULT_SMOKE_HISTORY_RETENTION_DAYS = 30
+DEFAULT_SMOKE_PERF_BASELINE_RUNS = 10
+DEFAULT_SMOKE_PROFILE_DIR = "smoke-profile"
 
 
 @pytest.hookimpl(trylast=True)
@@ -98,9 +133,245 @@ def pytest_addoption(parser: Parser) -> None:
             "The plugin provides the following predefined values, as well as custom user-defined values via a hook:\n"
             f"- {SmokeSelectMode.FIRST}: The first N tests (default)\n"
             f"- {SmokeSelectMode.LAST}: The last N tests\n"
-            f"- {SmokeSelectMode.RANDOM}: N randomly selected tests"
+            f"- {SmokeSelectMode.RANDOM}: N randomly selected tests\n"
+            f"- {SmokeSelectMode.ROTATE}: The next N tests that were not selected in previous runs. Each scope "
+            "cycles through all of its tests across successive runs\n"
+            f"- {SmokeSelectMode.FIXTURE}: N tests that minimize the total fixture setup time, preferring tests whose "
+            "expensive higher-scoped fixtures are already needed by other selected tests. Setup durations of fixtures "
+            "are recorded in previous runs\n"
+            f"- {SmokeSelectMode.COLLECTION}: N tests that minimize the collection time of their test modules and "
+            "directories plus their own durations, preferring tests in modules that are cheap to collect or already "
+            "needed by other selected tests. Collection times and test durations are recorded in previous runs"
         ),
     )
+    group.addoption(
+        "--smoke-adaptive",
+        dest="smoke_adaptive",
+        metavar="MAX",
+        const=DEFAULT_SMOKE_ADAPTIVE_MAX_N,
+        type=parse_positive_int,
+        nargs="?",
+        help="Adapt N of each smoke scope group based on its pass/fail history kept in the pytest cache.\n"
+        "New, changed, or recently failed groups get up to MAX tests, and the number decreases by one with every run "
+        "where the group passed, down to 1. The regular N is used only on the first run.\n"
+        f"If not provided, the default value of MAX is {DEFAULT_SMOKE_ADAPTIVE_MAX_N}.",
+    )
+    group.addoption(
+        "--smoke-changed-since",
+        dest="smoke_changed_since",
+        metavar="REF",
+        help="Apply N only to smoke scope groups impacted by local changes since the git reference REF. A group is "
+        "impacted when its test files are changed or import changed modules directly or transitively. Other groups "
+        f"get the baseline N given with the {SmokeIniOption.SMOKE_CHANGED_BASELINE_N} INI option",
+    )
+    group.addoption(
+        "--smoke-changed-lines",
+        dest="smoke_changed_lines",
+        action="store_true",
+        default=None,
+        help="Use with --smoke-changed-since. Select only tests covering the changed lines from each impacted smoke "
+        "scope group, up to N, based on the coverage map recorded with --smoke-record-coverage",
+    )
+    group.addoption(
+        "--smoke-record-coverage",
+        dest="smoke_record_coverage",
+        action="store_true",
+        default=None,
+        help="Record source lines covered by each executed test to the coverage map stored in the pytest cache. "
+        "Use this with a full run (e.g. --smoke 100%%)",
+    )
+    group.addoption(
+        "--smoke-memoize",
+        dest="smoke_memoize",
+        action="store_true",
+        default=None,
+        help="Report tests whose inputs have not changed since they last passed as cached passes without executing "
+        "them. The inputs of a test are its node ID, the source of its test module, and dependency files declared with "
+        "@pytest.mark.smoke(depends=...)",
+    )
+    group.addoption(
+        "--smoke-history",
+        dest="smoke_history",
+        action="store_true",
+        default=None,
+        help="Record the outcome, phase durations, and smoke scope group of each executed test to the history store "
+        "(SQLite) in the pytest cache",
+    )
+    group.addoption(
+        "--smoke-perf-baseline",
+        dest="smoke_perf_baseline",
+        action="store_true",
+        default=None,
+        help="Compare the call duration of each selected test to the median and MAD of its recent passed results in "
+        "the history store, and report statistically significant slowdowns. This also enables --smoke-history",
+    )
+    group.addoption(
+        "--smoke-perf-fail-ratio",
+        dest="smoke_perf_fail_ratio",
+        metavar="RATIO",
+        type=parse_ratio,
+        help="Use with --smoke-perf-baseline. Fail the run when any significant slowdown exceeds RATIO times the "
+        "baseline median (e.g. 2)",
+    )
+    group.addoption(
+        "--smoke-profile-tests",
+        dest="smoke_profile_tests",
+        metavar="DIR",
+        const=DEFAULT_SMOKE_PROFILE_DIR,
+        nargs="?",
+        help="Profile the call phase of each test with a sampling CPU profiler, and write collapsed stacks (for flame "
+        "graphs) of the whole run and per smoke scope group, and a pstats dump of the whole run, to DIR. The profiler "
+        "overhead is reported in the terminal summary.\n"
+        f"If not provided, the default value of DIR is {DEFAULT_SMOKE_PROFILE_DIR}.",
+    )
+    group.addoption(
+        "--smoke-resources",
+        dest="smoke_resources",
+        metavar="K",
+        const=DEFAULT_SMOKE_REPORT_K,
+        type=parse_positive_int,
+        nargs="?",
+        help="Record the CPU time (user/sys) and the growth of the peak RSS of the process during setup, call, and "
+        "teardown of each test, and show the top K heaviest tests and smoke scope groups in the terminal summary.\n"
+        f"If not provided, the default value of K is {DEFAULT_SMOKE_REPORT_K}.",
+    )
+    group.addoption(
+        "--smoke-resources-tracemalloc",
+        dest="smoke_resources_tracemalloc",
+        action="store_true",
+        default=None,
+        help="Use with --smoke-resources. Also record the peak size of memory allocated during each phase with "
+        "tracemalloc. This slows down tests",
+    )
+    group.addoption(
+        "--smoke-collect-profile",
+        dest="smoke_collect_profile",
+        metavar="K",
+        const=DEFAULT_SMOKE_REPORT_K,
+        type=parse_positive_int,
+        nargs="?",
+        help="Measure the wall time and memory for collecting each test module (including its import) and directory "
+        "(including its conftest.py), and show the top K of them and the share of the collection time spent on test "
+        "modules with no selected smoke tests in the terminal summary. The costs are recorded in the pytest cache.\n"
+        f"If not provided, the default value of K is {DEFAULT_SMOKE_REPORT_K}.",
+    )
+    group.addoption(
+        "--smoke-deadline",
+        dest="smoke_deadline",
+        metavar="DURATION",
+        type=parse_duration,
+        help="Skip all remaining tests once DURATION has elapsed since the start of the test session. DURATION can be "
+        "given in seconds (e.g. 90), or with a unit suffix (e.g. 30s, 10m, 1h).\n"
+        "Selected tests are reordered round-robin over smoke scope groups so that every group is touched first",
+    )
+    group.addoption(
+        "--smoke-escalate",
+        dest="smoke_escalate",
+        metavar="N1,N2,...",
+        type=parse_escalation,
+        help="Run smoke tests in escalating tiers within a single session (e.g. 1,5,20%%). Each tier selects tests "
+        "with its N on top of the previous tier, and runs only when all tests in the previous tiers passed. This "
+        "overrides N given to the --smoke option",
+    )
+    group.addoption(
+        "--smoke-xdist-affinity",
+        dest="smoke_xdist_affinity",
+        action="store_true",
+        default=None,
+        help="When using pytest-xdist, distribute tests by clusters of smoke scope groups that share session or "
+        "package-scoped fixtures, so that each of these fixtures is set up on as few workers as the load balance "
+        "allows. This can not be used with an explicit dist option (--dist or -d)",
+    )
+    group.addoption(
+        "--smoke-threads",
+        dest="smoke_threads",
+        metavar="NUM",
+        type=parse_positive_int,
+        help="Run test functions marked with @pytest.mark.smoke(threadsafe=True) concurrently on NUM threads in the "
+        "main process. Only tests that do not use function-scoped fixtures are executed concurrently, in batches of "
+        "consecutive tests sharing the same module or class",
+    )
+    group.addoption(
+        "--smoke-forks",
+        dest="smoke_forks",
+        metavar="NUM",
+        type=parse_positive_int,
+        help="(Linux only) Run selected smoke tests on NUM worker processes forked from the main process after the "
+        "collection, sharing imported test modules copy-on-write. Smoke scope groups are distributed to workers one at "
+        "a time, and critical smoke tests run in the main process first",
+    )
+    group.addoption(
+        "--smoke-memory-lean",
+        dest="smoke_memory_lean",
+        action="store_true",
+        default=None,
+        help="Release deselected tests right after the collection to reduce the memory held during the session. "
+        "Deselected tests are still counted in the terminal output, but hooks called after the collection can not "
+        "access them",
+    )
+    group.addoption(
+        "--smoke-max-per-file",
+        dest="smoke_max_per_file",
+        metavar="K",
+        type=parse_positive_int,
+        help="Limit the number of tests selected as part of N to at most K per test file",
+    )
+    group.addoption(
+        "--smoke-max-per-dir",
+        dest="smoke_max_per_dir",
+        metavar="K",
+        type=parse_positive_int,
+        help="Limit the number of tests selected as part of N to at most K per directory",
+    )
+    group.addoption(
+        "--smoke-max-total",
+        dest="smoke_max_total",
+        metavar="K",
+        type=parse_positive_int,
+        help="Limit the number of tests selected as part of N to at most K in total.\n"
+        "When any of the --smoke-max-* limits apply, tests are picked round-robin over smoke scope groups so that "
+        "every group gets its first test before any group gets its second one",
+    )
+    group.addoption(
+        "--smoke-manifest",
+        dest="smoke_manifest",
+        metavar="PATH",
+        help="Write the selected smoke tests to a manifest file, along with the smoke options used",
+    )
+    group.addoption(
+        "--smoke-from-manifest",
+        dest="smoke_from_manifest",
+        metavar="PATH",
+        help="Replay the smoke test selection recorded in a manifest file written by --smoke-manifest.\n"
+        "The selection logic (including all pytest-smoke hooks) is skipped, and only the recorded tests, their smoke "
+        "scope groups, and critical/must-pass flags are restored. The smoke scope, select mode, and N recorded in the "
+        "manifest are for reference only",
+    )
+    group.addoption(
+        "--smoke-report",
+        dest="smoke_report",
+        metavar="K",
+        const=DEFAULT_SMOKE_REPORT_K,
+        type=parse_positive_int,
+        nargs="?",
+        help="Show a smoke report in the terminal summary, including the top K smoke scope groups by duration and by "
+        "size, and histograms of all groups.\n"
+        f"If not provided, the default value of K is {DEFAULT_SMOKE_REPORT_K}.",
+    )
+    group.addoption(
+        "--smoke-report-json",
+        dest="smoke_report_json",
+        metavar="PATH",
+        help="Write the smoke report of all smoke scope groups to a JSON file",
+    )
+    group.addoption(
+        "--smoke-durations",
+        dest="smoke_durations",
+        metavar="K",
+        type=parse_positive_int,
+        help="Show the K slowest smoke scope groups in the terminal summary, with their setup, call, and teardown "
+        "durations, their share of the total test time, and the average duration per test",
+    )
 
     parser.addini(
         SmokeIniOption.SMOKE_DEFAULT_N,
@@ -133,30 +404,288 @@ def pytest_addoption(parser: Parser) -> None:
         default=False,
         help="[pytest-smoke] Treat tests marked with @pytest.mark.smoke as 'critical' smoke tests",
     )
+    parser.addini(
+        SmokeIniOption.SMOKE_CHANGED_BASELINE_N,
+        type="string",
+        default="1",
+        help="[pytest-smoke] The value of N applied to smoke scope groups not impacted by the changes when the "
+        "--smoke-changed-since option is given. Set 0 to deselect all tests in these groups",
+    )
+    parser.addini(
+        SmokeIniOption.SMOKE_MEMOIZE_MAX_ENTRIES,
+        type="string",
+        default=str(DEFAULT_SMOKE_MEMOIZE_MAX_ENTRIES),
+        help="[pytest-smoke] The maximum number of cached test results kept for the --smoke-memoize option. The least "
+        "recently used entries are evicted first",
+    )
+    parser.addini(
+        SmokeIniOption.SMOKE_HISTORY_RETENTION_DAYS,
+        type="string",
+        default=str(DEFAULT_SMOKE_HISTORY_RETENTION_DAYS),
+        help="[pytest-smoke] The number of days test results are kept in the history store for the --smoke-history "
+        "option",
+    )
+    parser.addini(
+        SmokeIniOption.SMOKE_PERF_BASELINE_RUNS,
+        type="string",
+        default=str(DEFAULT_SMOKE_PERF_BASELINE_RUNS),
+        help="[pytest-smoke] The maximum number of recent passed results of each test used as the baseline for the "
+        "--smoke-perf-baseline option",
+    )
+    parser.addini(
+        SmokeIniOption.SMOKE_EXCLUDE,
+        type="linelist",
+        default=[],
+        help="[pytest-smoke] Rules for tests that should not be selected, one per line: node IDs or node ID patterns "
+        "with * and ? wildcards (matching the node or any of its children), or marker:NAME for tests with the marker. "
+        "Evaluated before the pytest_smoke_exclude hook",
+    )
+    parser.addini(
+        SmokeIniOption.SMOKE_INCLUDE_FROM,
+        type="paths",
+        default=[],
+        help="[pytest-smoke] Files of rules for tests that should be included as additional smoke tests, in the same "
+        "format as smoke_exclude. Evaluated before the pytest_smoke_include hook",
+    )
 
 
 @pytest.hookimpl(tryfirst=True)
 def pytest_configure(config: Config) -> None:
     config.addinivalue_line(
         "markers",
-        "smoke(*, mustpass=False, runif=True): [pytest-smoke] When running smoke tests using the pytest-smoke plugin, "
-        "and the feature is explicitly enabled via an INI option, the marked test is considered a 'critical' smoke "
-        "test. Additionally, if the optional mustpass keyword argument is set to True, the test is considered a "
-        "'must-pass' critical smoke test. Critical smoke tests with runif=True are automatically included and executed "
-        "first, before regular smoke tests. If any 'must-pass' test fails, all subsequent regular smoke tests will be "
-        "skipped.\n"
+        "smoke(*, mustpass=False, runif=True, depends=(), threadsafe=False): [pytest-smoke] When running smoke tests "
+        "using the pytest-smoke plugin, and the feature is explicitly enabled via an INI option, the marked test is "
+        "considered a 'critical' smoke test. Additionally, if the optional mustpass keyword argument is set to True, "
+        "the test is considered a 'must-pass' critical smoke test. Critical smoke tests with runif=True are "
+        "automatically included and executed first, before regular smoke tests. If any 'must-pass' test fails, all "
+        "subsequent regular smoke tests will be skipped. The optional depends keyword argument takes glob patterns "
+        "of files (relative to the rootdir) the test depends on, which are used to detect input changes with the "
+        "--smoke-memoize option. The optional threadsafe keyword argument allows the test to run concurrently with "
+        "the --smoke-threads option.\n"
         "Note: The marker will have no effect on the plugin until the feature has been enabled",
     )
 
     if config.option.smoke:
+        # The report is generated only in the xdist controller when pytest-xdist is used
+        if (
+            config.option.smoke_report or config.option.smoke_report_json or config.option.smoke_durations
+        ) and not hasattr(config, "workerinput"):
+            from pytest_smoke.extensions.report import PytestSmokeReport
+
+            config.pluginmanager.register(
+                PytestSmokeReport(
+                    config.option.smoke_report or (DEFAULT_SMOKE_REPORT_K if config.option.smoke_report_json else None),
+                    json_path=config.option.smoke_report_json,
+                    durations_k=config.option.smoke_durations,
+                ),
+                name=PytestSmokeReport.name,
+            )
+
+        # The history is recorded and compared only in the xdist controller when pytest-xdist is used
+        if (config.option.smoke_history or config.option.smoke_perf_baseline) and not hasattr(config, "workerinput"):
+            from pytest_smoke.extensions.history import PytestSmokeHistory
+
+            config.pluginmanager.register(PytestSmokeHistory(config), name=PytestSmokeHistory.name)
+
+            if config.option.smoke_perf_baseline:
+                from pytest_smoke.extensions.perf import PytestSmokePerfBaseline
+
+                config.pluginmanager.register(
+                    PytestSmokePerfBaseline(config, fail_ratio=config.option.smoke_perf_fail_ratio),
+                    name=PytestSmokePerfBaseline.name,
+                )
+        if config.option.smoke_perf_fail_ratio is not None and not config.option.smoke_perf_baseline:
+            raise pytest.UsageError("The --smoke-perf-fail-ratio option requires the --smoke-perf-baseline option")
+
+        for ini_option in SmokeIniOption:
+            # Validate INI options upfront
+            parse_ini_option(config, ini_option)
+
+        if parse_ini_option(config, SmokeIniOption.SMOKE_MARKED_TESTS_AS_CRITICAL):
+            from pytest_smoke.extensions.critical import PytestSmokeCriticalOrder
+
+            config.pluginmanager.register(PytestSmokeCriticalOrder(config), name=PytestSmokeCriticalOrder.name)
+
+        if SmokeOption(config).select_mode == SmokeSelectMode.FIXTURE:
+            from pytest_smoke.extensions.fixture import PytestSmokeFixtureCost
+
+            config.pluginmanager.register(PytestSmokeFixtureCost(config), name=PytestSmokeFixtureCost.name)
+        elif SmokeOption(config).select_mode == SmokeSelectMode.COLLECTION:
+            from pytest_smoke.extensions.collection import PytestSmokeCollectionCost
+
+            config.pluginmanager.register(PytestSmokeCollectionCost(config), name=PytestSmokeCollectionCost.name)
+
+        if config.option.smoke_adaptive:
+            from pytest_smoke.extensions.adaptive import PytestSmokeAdaptive
+
+            config.pluginmanager.register(
+                PytestSmokeAdaptive(config, config.option.smoke_adaptive), name=PytestSmokeAdaptive.name
+            )
+
+        if config.option.smoke_changed_since:
+            from pytest_smoke.extensions.impact import PytestSmokeChangeImpact
+
+            config.pluginmanager.register(
+                PytestSmokeChangeImpact(
+                    config, config.option.smoke_changed_since, line_level=bool(config.option.smoke_changed_lines)
+                ),
+                name=PytestSmokeChangeImpact.name,
+            )
+        elif config.option.smoke_changed_lines:
+            raise pytest.UsageError("The --smoke-changed-lines option requires the --smoke-changed-since option")
+
+        if config.option.smoke_record_coverage:
+            from pytest_smoke.extensions.coverage import PytestSmokeCoverageRecorder
+
+            config.pluginmanager.register(PytestSmokeCoverageRecorder(config), name=PytestSmokeCoverageRecorder.name)
+
+        if config.option.smoke_profile_tests:
+            if not hasattr(signal, "setitimer"):
+                raise pytest.UsageError("The --smoke-profile-tests option is not supported on this platform")
+            from pytest_smoke.extensions.profile import PytestSmokeProfiler
+
+            config.pluginmanager.register(
+                PytestSmokeProfiler(config.option.smoke_profile_tests), name=PytestSmokeProfiler.name
+            )
+
+        if config.option.smoke_resources:
+            if sys.platform == "win32":
+                raise pytest.UsageError("The --smoke-resources option is not supported on this platform")
+            from pytest_smoke.extensions.resources import PytestSmokeResources
+
+            config.pluginmanager.register(
+                PytestSmokeResources(
+                    config.option.smoke_resources, trace_allocations=bool(config.option.smoke_resources_tracemalloc)
+                ),
+                name=PytestSmokeResources.name,
+            )
+        elif config.option.smoke_resources_tracemalloc:
+            raise pytest.UsageError("The --smoke-resources-tracemalloc option requires the --smoke-resources option")
+
+        if config.option.smoke_collect_profile or SmokeOption(config).select_mode == SmokeSelectMode.COLLECTION:
+            # The collection select mode relies on collection costs recorded by this plugin
+            from pytest_smoke.extensions.collection import PytestSmokeCollectionProfile
+
+            config.pluginmanager.register(
+                PytestSmokeCollectionProfile(config, config.option.smoke_collect_profile),
+                name=PytestSmokeCollectionProfile.name,
+            )
+
+        if config.option.smoke_deadline:
+            from pytest_smoke.extensions.deadline import PytestSmokeDeadline
+
+            config.pluginmanager.register(
+                PytestSmokeDeadline(config.option.smoke_deadline), name=PytestSmokeDeadline.name
+            )
+
+        if config.option.smoke_escalate:
+            for incompatible_option, opt in [
+                # Failed tiers are tracked per process
+                ("-n/--numprocesses", config.getoption("numprocesses", default=None)),
+                ("--smoke-from-manifest", config.option.smoke_from_manifest),
+            ]:
+                if opt:
+                    raise pytest.UsageError(
+                        f"The --smoke-escalate option cannot be used with the {incompatible_option} option"
+                    )
+            from pytest_smoke.extensions.escalate import PytestSmokeEscalate
+
+            config.pluginmanager.register(
+                PytestSmokeEscalate(config.option.smoke_escalate), name=PytestSmokeEscalate.name
+            )
+
+        if config.option.smoke_memoize:
+            from pytest_smoke.extensions.memoize import PytestSmokeMemoize
+
+            config.pluginmanager.register(PytestSmokeMemoize(config), name=PytestSmokeMemoize.name)
+
+        if config.option.smoke_threads:
+            if not IS_RUNTEST_PHASE_API_SUPPORTED:
+                raise pytest.UsageError(f"The --smoke-threads option is not supported with pytest {pytest.__version__}")
+            for incompatible_option, opt in [
+                ("-n/--numprocesses", config.getoption("numprocesses", default=None)),
+                # Tests in a batch do not go through the runtest protocol of their own
+                ("--smoke-memoize", config.option.smoke_memoize),
+            ]:
+                if opt:
+                    raise pytest.UsageError(
+                        f"The --smoke-threads option cannot be used with the {incompatible_option} option"
+                    )
+            from pytest_smoke.extensions.threads import PytestSmokeThreads
+
+            config.pluginmanager.register(PytestSmokeThreads(config.option.smoke_threads), name=PytestSmokeThreads.name)
+
+        if config.option.smoke_forks:
+            if not sys.platform.startswith("linux"):
+                raise pytest.UsageError("The --smoke-forks option is supported only on Linux")
+            for incompatible_option, opt in [
+                ("-n/--numprocesses", config.getoption("numprocesses", default=None)),
+                ("--smoke-threads", config.option.smoke_threads),
+                ("--smoke-escalate", config.option.smoke_escalate),
+                ("--smoke-memoize", config.option.smoke_memoize),
+                ("--smoke-record-coverage", config.option.smoke_record_coverage),
+                # Samples would be taken in the workers and never merged
+                ("--smoke-profile-tests", config.option.smoke_profile_tests),
+            ]:
+                if opt:
+                    raise pytest.UsageError(
+                        f"The --smoke-forks option cannot be used with the {incompatible_option} option"
+                    )
+            from pytest_smoke.extensions.fork import PytestSmokeFork
+
+            config.pluginmanager.register(PytestSmokeFork(config.option.smoke_forks), name=PytestSmokeFork.name)
+
+        if config.option.smoke_memory_lean:
+            from pytest_smoke.extensions.lean import PytestSmokeMemoryLean
+
+            config.pluginmanager.register(PytestSmokeMemoryLean(), name=PytestSmokeMemoryLean.name)
+
         if smoke.is_xdist_installed:
             if config.pluginmanager.has_plugin("xdist"):
+                if config.option.smoke_xdist_affinity and (
+                    config.known_args_namespace.dist != "no" or config.known_args_namespace.distload
+                ):
+                    raise pytest.UsageError(
+                        "The --smoke-xdist-affinity option cannot be used with an explicit dist option (--dist or -d)"
+                    )
                 # Register the smoke-xdist plugin if -n/--numprocesses option is given.
                 if config.getoption("numprocesses", default=None):
                     config.pluginmanager.register(PytestSmokeXdist(), name=PytestSmokeXdist.name)
             else:
                 smoke.is_xdist_installed = False
-    elif config.option.smoke_scope or config.option.smoke_select_mode:
+    elif any(
+        config.getoption(x) is not None
+        for x in (
+            "smoke_scope",
+            "smoke_select_mode",
+            "smoke_adaptive",
+            "smoke_changed_since",
+            "smoke_changed_lines",
+            "smoke_record_coverage",
+            "smoke_memoize",
+            "smoke_history",
+            "smoke_perf_baseline",
+            "smoke_perf_fail_ratio",
+            "smoke_profile_tests",
+            "smoke_resources",
+            "smoke_resources_tracemalloc",
+            "smoke_collect_profile",
+            "smoke_deadline",
+            "smoke_escalate",
+            "smoke_xdist_affinity",
+            "smoke_threads",
+            "smoke_forks",
+            "smoke_memory_lean",
+            "smoke_max_per_file",
+            "smoke_max_per_dir",
+            "smoke_max_total",
+            "smoke_manifest",
+            "smoke_from_manifest",
+            "smoke_report",
+            "smoke_report_json",
+            "smoke_durations",
+        )
+    ):
         raise pytest.UsageError("The --smoke option is required to use the pytest-smoke functionality")
 
 
@@ -164,6 +693,7 @@ def pytest_configure(config: Config) -> None:
 def pytest_sessionstart(session: Session) -> Generator[None, Any, Any]:
     if not smoke.is_xdist_installed or not is_xdist_worker(session):
         os.environ[SmokeEnvVar.SMOKE_TEST_SESSION_UUID] = str(uuid4())
+        os.environ[SmokeEnvVar.SMOKE_TEST_SESSION_START_TIME] = str(time.time())
     return (yield)
 
 
@@ -176,66 +706,205 @@ def pytest_collection_modifyitems(session: Session, config: Config, items: list[
             opt = SmokeOption(config)
             if opt.n:
                 with Cache.manage():
-                    selected_items_regular = []
-                    selected_items_critical = []
-                    deselected_items = []
-                    smoke_groups_reached_threshold = set()
-                    counter = SmokeCounter(
-                        collected=Counter(filter(None, (generate_group_id(item, opt.scope) for item in items)))
-                    )
-                    session.stash[STASH_KEY_SMOKE_COUNTER] = counter
-                    enable_critical_tests = parse_ini_option(config, SmokeIniOption.SMOKE_MARKED_TESTS_AS_CRITICAL)
-
-                    for item in sort_items(items, session, opt):
-                        group_id = generate_group_id(item, opt.scope)
-                        if group_id is None:
-                            deselected_items.append(item)
-                            continue
-
-                        # Tests that match the below conditions will not be counted towards the calculation of N
-                        if enable_critical_tests and (smoke_marker := SmokeMarker.from_item(item)):
-                            if smoke_marker.runif:
-                                selected_items_critical.append(item)
-                                if smoke_marker.mustpass:
-                                    counter.mustpass.selected.add(item)
-                                item.stash[STASH_KEY_SMOKE_IS_CRITICAL] = True
-                                item.stash[STASH_KEY_SMOKE_IS_MUSTPASS] = smoke_marker.mustpass
+                    is_worker = smoke.is_xdist_installed and is_xdist_worker(session)
+                    if manifest_path := config.option.smoke_from_manifest:
+                        manifest = load_manifest(manifest_path)
+                        selected_items_critical, selected_items_regular, deselected_items = _select_from_manifest(
+                            session, items, manifest
+                        )
+                    else:
+                        manifest = SmokeManifest(
+                            scope=opt.scope,
+                            select_mode=opt.select_mode,
+                            n=opt.n,
+                            seed=opt.seed if opt.select_mode == SmokeSelectMode.RANDOM else None,
+                        )
+                        selected_items_regular = []
+                        selected_items_critical = []
+                        deselected_items = []
+                        # Regular items selected as part of N
+                        selected_items_n: list[Item] = []
+                        smoke_groups_reached_threshold = set()
+                        counter = SmokeCounter(
+                            collected=Counter(filter(None, (generate_group_id(item, opt.scope) for item in items)))
+                        )
+                        session.stash[STASH_KEY_SMOKE_COUNTER] = counter
+                        enable_critical_tests = parse_ini_option(config, SmokeIniOption.SMOKE_MARKED_TESTS_AS_CRITICAL)
+                        include = load_node_matcher(config, SmokeIniOption.SMOKE_INCLUDE_FROM)
+                        tiers = config.option.smoke_escalate
+                        tier_thresholds_per_group: dict[Any, list[float]] = {}
+                        adaptive: PytestSmokeAdaptive | None = config.pluginmanager.get_plugin("smoke-adaptive")
+                        if adaptive:
+                            adaptive.prepare(items)
+                        impact: PytestSmokeChangeImpact | None = config.pluginmanager.get_plugin("smoke-change-impact")
+                        if impact:
+                            impact.prepare(session, items)
+
+                        def get_threshold(group_id: Any) -> float:
+                            """Return the number of tests to select from the smoke scope group"""
+                            if tiers:
+                                # Thresholds of later tiers never go below earlier ones so that the tiers are nested
+                                if (tier_thresholds := tier_thresholds_per_group.get(group_id)) is None:
+                                    tier_thresholds = tier_thresholds_per_group[group_id] = list(
+                                        accumulate(
+                                            (calculate_threshold(x, counter.collected[group_id]) for x in tiers), max
+                                        )
+                                    )
+                                threshold = tier_thresholds[-1]
+                            elif opt.is_scale:
+                                threshold = scale_down(counter.collected[group_id], float(cast(str, opt.n)[:-1]))
+                            else:
+                                threshold = cast(int, opt.n)
+                            if adaptive:
+                                threshold = adaptive.get_threshold(group_id, threshold)
+                            if impact:
+                                threshold = impact.get_threshold(group_id, threshold, counter.collected[group_id])
+                            return threshold
+
+                        included: dict[Item, bool] = {}
+
+                        def is_included(item: Item) -> bool:
+                            """Return whether the item is included as an additional smoke test"""
+                            if (is_included_ := included.get(item)) is None:
+                                is_included_ = included[item] = bool(
+                                    (include and include.matches(item))
+                                    or config.hook.pytest_smoke_include(item=item, scope=opt.scope)
+                                )
+                            return is_included_
+
+                        sorted_items = None
+                        # Candidates the pytest_smoke_select_from_group hook did not choose
+                        rejected_items: set[Item] = set()
+                        if opt.select_mode not in [str(x) for x in SmokeSelectMode] and (
+                            config.hook.pytest_smoke_select_from_group.get_hookimpls()
+                        ):
+                            if selection := select_items_per_group(
+                                items,
+                                config,
+                                opt,
+                                get_threshold,
+                                # Critical and included tests are not counted towards N
+                                is_candidate=lambda x: (
+                                    not ((enable_critical_tests and SmokeMarker.from_item(x)) or is_included(x))
+                                ),
+                            ):
+                                sorted_items, rejected_items = selection
+                        if sorted_items is None:
+                            sorted_items = sort_items(items, session, opt)
+                        if impact:
+                            sorted_items = impact.sort_items(sorted_items)
+
+                        for item in sorted_items:
+                            group_id = generate_group_id(item, opt.scope)
+                            if group_id is None:
+                                deselected_items.append(item)
+                                continue
+
+                            # Tests that match the below conditions will not be counted towards the calculation of N
+                            if enable_critical_tests and (smoke_marker := SmokeMarker.from_item(item)):
+                                if smoke_marker.runif:
+                                    selected_items_critical.append(item)
+                                    if smoke_marker.mustpass:
+                                        counter.mustpass.selected.add(item)
+                                    item.stash[STASH_KEY_SMOKE_IS_CRITICAL] = True
+                                    item.stash[STASH_KEY_SMOKE_IS_MUSTPASS] = smoke_marker.mustpass
+                                    item.stash[STASH_KEY_SMOKE_GROUP_ID] = group_id
+                                else:
+                                    deselected_items.append(item)
+                                continue
+                            elif is_included(item):
+                                selected_items_regular.append(item)
+                                item.stash[STASH_KEY_SMOKE_IS_INCLUDED] = True
+                                item.stash[STASH_KEY_SMOKE_GROUP_ID] = group_id
+                                continue
+
+                            if group_id in smoke_groups_reached_threshold or item in rejected_items:
+                                deselected_items.append(item)
+                                continue
+
+                            if counter.selected[group_id] < get_threshold(group_id):
+                                if tiers:
+                                    item.stash[STASH_KEY_SMOKE_TIER] = min(
+                                        bisect_right(tier_thresholds_per_group[group_id], counter.selected[group_id]),
+                                        len(tiers) - 1,
+                                    )
+                                counter.selected.update([group_id])
+                                selected_items_regular.append(item)
+                                selected_items_n.append(item)
+                                item.stash[STASH_KEY_SMOKE_GROUP_ID] = group_id
                             else:
+                                smoke_groups_reached_threshold.add(group_id)
                                 deselected_items.append(item)
-                            continue
-                        elif config.hook.pytest_smoke_include(item=item, scope=opt.scope):
-                            selected_items_regular.append(item)
-                            continue
-
-                        if group_id in smoke_groups_reached_threshold:
-                            deselected_items.append(item)
-                            continue
-
-                        if opt.is_scale:
-                            threshold = scale_down(counter.collected[group_id], float(cast(str, opt.n)[:-1]))
-                        else:
-                            threshold = cast(int, opt.n)
-                        if counter.selected[group_id] < threshold:
-                            counter.selected.update([group_id])
-                            selected_items_regular.append(item)
-                        else:
-                            smoke_groups_reached_threshold.add(group_id)
-                            deselected_items.append(item)
+
+                        if opt.has_quotas and (
+                            items_over_quotas := apply_quotas(
+                                selected_items_n,
+                                opt.scope,
+                                max_per_file=config.option.smoke_max_per_file,
+                                max_per_dir=config.option.smoke_max_per_dir,
+                                max_total=config.option.smoke_max_total,
+                            )
+                        ):
+                            selected_items_regular = [x for x in selected_items_regular if x not in items_over_quotas]
+                            deselected_items.extend(items_over_quotas)
+                            counter.selected.subtract(x.stash[STASH_KEY_SMOKE_GROUP_ID] for x in items_over_quotas)
+
+                        if opt.select_mode == SmokeSelectMode.ROTATE and not (config.option.collectonly or is_worker):
+                            session.stash[STASH_KEY_SMOKE_ROTATION_STATE] = update_rotation_state(
+                                config, opt.scope, items, selected_items_critical + selected_items_regular
+                            )
 
                     assert len(items) == len(selected_items_critical + selected_items_regular + deselected_items)
                     if selected_items_critical or deselected_items:
                         if deselected_items:
                             config.hook.pytest_deselected(items=deselected_items)
 
-                        if opt.select_mode != SmokeSelectMode.FIRST:
+                        if not config.option.smoke_from_manifest and (
+                            opt.select_mode != SmokeSelectMode.FIRST or config.option.smoke_changed_lines
+                        ):
                             # retain the original test order
                             for smoke_items in (selected_items_critical, selected_items_regular):
                                 if smoke_items:
                                     smoke_items.sort(key=items.index)
 
+                        critical_order: PytestSmokeCriticalOrder | None = config.pluginmanager.get_plugin(
+                            "smoke-critical-order"
+                        )
+                        if critical_order and selected_items_critical and not config.option.smoke_from_manifest:
+                            selected_items_critical = critical_order.sort_items(selected_items_critical)
+
                         items.clear()
                         items.extend(selected_items_critical + selected_items_regular)
 
+                    if config.option.smoke_deadline:
+                        # Run the first test of every group before the second test of any group, so that every group is
+                        # touched before the deadline
+                        items[len(selected_items_critical) :] = sort_items_breadth_first(
+                            items[len(selected_items_critical) :], key=lambda x: x.stash[STASH_KEY_SMOKE_GROUP_ID]
+                        )
+
+                    if config.option.smoke_escalate:
+                        # Run tiers in order. Critical tests and tests included via the hook belong to the first tier
+                        items.sort(key=lambda x: x.stash.get(STASH_KEY_SMOKE_TIER, 0))
+
+                    if (manifest_path := config.option.smoke_manifest) and not is_worker:
+                        manifest.items = [
+                            SmokeManifestItem(
+                                nodeid=item.nodeid,
+                                group_id=str(item.stash[STASH_KEY_SMOKE_GROUP_ID]),
+                                critical=item.stash.get(STASH_KEY_SMOKE_IS_CRITICAL, False),
+                                mustpass=item.stash.get(STASH_KEY_SMOKE_IS_MUSTPASS, False),
+                                included=item.stash.get(STASH_KEY_SMOKE_IS_INCLUDED, False),
+                            )
+                            for item in items
+                        ]
+                        write_manifest(manifest_path, manifest)
+
+
+def pytest_sessionfinish(session: Session) -> None:
+    if (rotation_state := session.stash.get(STASH_KEY_SMOKE_ROTATION_STATE, None)) is not None:
+        save_rotation_state(session.config, SmokeOption(session.config).scope, rotation_state)
+
 
 @pytest.hookimpl(wrapper=True)
 def pytest_runtest_protocol(item: Item, nextitem: Item | None) -> Generator[None, Any, None]:
@@ -262,6 +931,8 @@ def pytest_runtest_setup(item: Item) -> None:
 @pytest.hookimpl(wrapper=True)
 def pytest_runtest_makereport(item: Item) -> Generator[None, TestReport, TestReport]:
     report = yield
+    if item.stash.get(STASH_KEY_SMOKE_IS_CRITICAL, False):
+        setattr(report, "_is_smoke_critical", True)
     if item.stash.get(STASH_KEY_SMOKE_IS_MUSTPASS, False):
         setattr(report, "_is_smoke_must_pass", True)
         if report.failed:
@@ -283,3 +954,38 @@ def pytest_report_teststatus(
         elif isinstance(status.word, tuple):
             status = status._replace(word=(status.word[0] + annot, *status.word[1:]))
     return status
+
+
+def _select_from_manifest(
+    session: Session, items: list[Item], manifest: SmokeManifest
+) -> tuple[list[Item], list[Item], list[Item]]:
+    """Select items recorded in the manifest, without computing scope group IDs"""
+    selected_items_regular = []
+    selected_items_critical = []
+    deselected_items = []
+    manifest_items = {x.nodeid: x for x in manifest.items}
+    counter = SmokeCounter()
+    session.stash[STASH_KEY_SMOKE_COUNTER] = counter
+    for item in items:
+        if (manifest_item := manifest_items.get(item.nodeid)) is None:
+            deselected_items.append(item)
+            continue
+
+        item.stash[STASH_KEY_SMOKE_GROUP_ID] = manifest_item.group_id
+        if manifest_item.critical:
+            selected_items_critical.append(item)
+            if manifest_item.mustpass:
+                counter.mustpass.selected.add(item)
+            item.stash[STASH_KEY_SMOKE_IS_CRITICAL] = True
+            item.stash[STASH_KEY_SMOKE_IS_MUSTPASS] = manifest_item.mustpass
+        else:
+            selected_items_regular.append(item)
+            if manifest_item.included:
+                # Included tests are not counted towards N
+                item.stash[STASH_KEY_SMOKE_IS_INCLUDED] = True
+            else:
+                counter.selected.update([manifest_item.group_id])
+    # Critical items may have been reordered when recording the manifest
+    manifest_positions = {nodeid: i for i, nodeid in enumerate(manifest_items)}
+    selected_items_critical.sort(key=lambda x: manifest_positions[x.nodeid])
+    return selected_items_critical, selected_items_regular, deselected_items
@@ -1,10 +1,14 @@
 from __future__ import annotations
 
+import os
+import re
 from collections import Counter
+from collections.abc import Iterable, Sequence
 from dataclasses import dataclass, field
 from enum import auto
 from functools import cached_property
 from typing import TYPE_CHECKING, Any
+from uuid import UUID
 
 from pytest_smoke.compat import StrEnum
 
@@ -14,6 +18,18 @@ if TYPE_CHECKING:
 
 class SmokeEnvVar:
     SMOKE_TEST_SESSION_UUID = "SMOKE_TEST_SESSION_UUID"
+    SMOKE_TEST_SESSION_START_TIME = "SMOKE_TEST_SESSION_START_TIME"
+
+
+class SmokeCacheKey:
+    ROTATE = "smoke/rotate"
+    ADAPTIVE = "smoke/adaptive"
+    IMPORTS = "smoke/imports"
+    MEMOIZE = "smoke/memoize"
+    CRITICAL = "smoke/critical"
+    FIXTURES = "smoke/fixtures"
+    COLLECTION = "smoke/collection"
+    DURATIONS = "smoke/durations"
 
 
 class SmokeScope(StrEnum):
@@ -29,6 +45,9 @@ class SmokeSelectMode(StrEnum):
     FIRST = auto()
     LAST = auto()
     RANDOM = auto()
+    ROTATE = auto()
+    FIXTURE = auto()
+    COLLECTION = auto()
 
 
 class SmokeIniOption(StrEnum):
@@ -37,6 +56,12 @@ class SmokeIniOption(StrEnum):
     SMOKE_DEFAULT_SELECT_MODE = auto()
     SMOKE_DEFAULT_XDIST_DIST_BY_SCOPE = auto()
     SMOKE_MARKED_TESTS_AS_CRITICAL = auto()
+    SMOKE_CHANGED_BASELINE_N = auto()
+    SMOKE_MEMOIZE_MAX_ENTRIES = auto()
+    SMOKE_HISTORY_RETENTION_DAYS = auto()
+    SMOKE_PERF_BASELINE_RUNS = auto()
+    SMOKE_EXCLUDE = auto()
+    SMOKE_INCLUDE_FROM = auto()
 
 
 class SmokeDefaultN(int): ...
@@ -67,20 +92,42 @@ class SmokeOption:
         assert mode and isinstance(mode, str)
         return mode
 
+    @cached_property
+    def seed(self) -> int:
+        """A random seed shared between the pytest-xdist controller and workers within the same test session"""
+        return UUID(os.environ[SmokeEnvVar.SMOKE_TEST_SESSION_UUID]).time
+
+    @cached_property
+    def has_quotas(self) -> bool:
+        return any(
+            getattr(self.config.option, x) is not None
+            for x in ("smoke_max_per_file", "smoke_max_per_dir", "smoke_max_total")
+        )
+
     @cached_property
     def is_scale(self) -> bool:
         return isinstance(self.n, str) and self.n.endswith("%")
 
-    def _parse_ini_option(self, option: SmokeIniOption) -> str | int | float | bool:
+    def _parse_ini_option(self, option: SmokeIniOption) -> str | int | float | bool | list[str]:
         from pytest_smoke.utils import parse_ini_option
 
         return parse_ini_option(self.config, option)
 
 
 class SmokeMarker:
-    def __init__(self, *args: Any, mustpass: bool = False, runif: bool = True, **kwargs: Any) -> None:
+    def __init__(
+        self,
+        *args: Any,
+        mustpass: bool = False,
+        runif: bool = True,
+        depends: str | Sequence[str] = (),
+        threadsafe: bool = False,
+        **kwargs: Any,
+    ) -> None:
         self.mustpass = bool(mustpass)
         self.runif = bool(runif)
+        self.depends = (depends,) if isinstance(depends, str) else tuple(depends)
+        self.threadsafe = bool(threadsafe)
 
     @classmethod
     def from_item(cls, item: Item) -> SmokeMarker | None:
@@ -89,6 +136,85 @@ class SmokeMarker:
         return None
 
 
+@dataclass(frozen=True)
+class SmokeNodeMatcher:
+    """Declarative rules for matching tests, compiled into a hash set of node IDs, a single regular expression of node
+    ID patterns, and a hash set of marker names
+
+    Each rule is one of:
+    - marker:NAME: Tests marked with the NAME marker
+    - A node ID or a node ID pattern with * and ? wildcards: Tests whose node ID or any of its parent node IDs (test
+      classes, test modules, and directories) matches the rule. A test function matches all of its parametrized tests
+    """
+
+    nodeids: frozenset[str] = frozenset()
+    pattern: re.Pattern[str] | None = None
+    markers: frozenset[str] = frozenset()
+
+    MARKER_PREFIX = "marker:"
+
+    @classmethod
+    def compile(cls, rules: Iterable[str]) -> SmokeNodeMatcher:
+        nodeids = set()
+        patterns = []
+        markers = set()
+        for rule in (x.strip() for x in rules):
+            if not rule or rule.startswith("#"):
+                continue
+            if rule.startswith(cls.MARKER_PREFIX):
+                markers.add(rule[len(cls.MARKER_PREFIX) :].strip())
+            elif "*" in rule or "?" in rule:
+                # Brackets are kept as literals, as they appear in node IDs of parametrized tests
+                patterns.append(re.escape(rule).replace(r"\*", ".*").replace(r"\?", "."))
+            else:
+                nodeids.add(rule.rstrip("/"))
+        return cls(
+            nodeids=frozenset(nodeids),
+            # Patterns also match children of the matched nodes
+            pattern=re.compile(rf"(?:{'|'.join(patterns)})(?:(?:::|/).*|\[.*\])?", re.DOTALL) if patterns else None,
+            markers=frozenset(markers),
+        )
+
+    def __bool__(self) -> bool:
+        return bool(self.nodeids or self.pattern or self.markers)
+
+    def matches(self, item: Item) -> bool:
+        nodeid = item.nodeid
+        if self.nodeids:
+            if (i := nodeid.find("[")) != -1 and nodeid[:i] in self.nodeids:
+                # The test function of a parametrized test
+                return True
+            path, *names = nodeid.split("::")
+            if path in self.nodeids or any(
+                "::".join([path, *names[:i]]) in self.nodeids for i in range(1, len(names) + 1)
+            ):
+                return True
+            parts = path.split("/")
+            if any("/".join(parts[:i]) in self.nodeids for i in range(1, len(parts))):
+                return True
+        if self.pattern and self.pattern.fullmatch(nodeid):
+            return True
+        return bool(self.markers) and any(x.name in self.markers for x in item.iter_markers())
+
+
+@dataclass
+class SmokeManifestItem:
+    nodeid: str
+    group_id: str
+    critical: bool = False
+    mustpass: bool = False
+    included: bool = False
+
+
+@dataclass
+class SmokeManifest:
+    scope: str
+    select_mode: str
+    n: int | str
+    seed: int | None
+    items: list[SmokeManifestItem] = field(default_factory=list)
+
+
 @dataclass
 class MustpassCounter:
     selected: set[Item] = field(default_factory=set)
@@ -100,3 +226,46 @@ class SmokeCounter:
     collected: Counter[str] = field(default_factory=Counter)
     selected: Counter[str] = field(default_factory=Counter)
     mustpass: MustpassCounter = field(default_factory=MustpassCounter)
+
+
+@dataclass
+class SmokeGroupStats:
+    collected: int = 0
+    selected: int = 0
+    executed: int = 0
+    setup_duration: float = 0.0
+    call_duration: float = 0.0
+    teardown_duration: float = 0.0
+
+    @property
+    def duration(self) -> float:
+        return self.setup_duration + self.call_duration + self.teardown_duration
+
+    @property
+    def average_duration(self) -> float:
+        return self.duration / self.executed if self.executed else 0.0
+
+    @property
+    def deselected(self) -> int:
+        return self.collected - self.selected
+
+
+@dataclass
+class SmokeResourceUsage:
+    cpu_user: float = 0.0
+    cpu_sys: float = 0.0
+    # Growth of the peak resident set size of the process, in bytes
+    max_rss_growth: int = 0
+    # Peak size of memory blocks allocated on top of the ones traced at the start, in bytes
+    alloc_peak: int | None = None
+
+    @property
+    def cpu_time(self) -> float:
+        return self.cpu_user + self.cpu_sys
+
+    def add(self, other: SmokeResourceUsage) -> None:
+        self.cpu_user += other.cpu_user
+        self.cpu_sys += other.cpu_sys
+        self.max_rss_growth += other.max_rss_growth
+        if other.alloc_peak is not None:
+            self.alloc_peak = max(self.alloc_peak or 0, other.alloc_peak)
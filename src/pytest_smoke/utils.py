@@ -1,28 +1,46 @@
 from __future__ import annotations
 
-import os
+import heapq
+import json
+import math
 import random
-from collections.abc import Callable, Generator
+from collections import Counter
+from collections.abc import Callable, Generator, Hashable, Iterable
 from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
 from decimal import ROUND_HALF_UP, Decimal
 from functools import cache, update_wrapper
-from types import ModuleType
-from typing import TYPE_CHECKING, Any, ClassVar, cast
-from uuid import UUID
+from typing import TYPE_CHECKING, Any, ClassVar, Generic, TypeVar, cast
 
 import pytest
 from pytest import Class, Function
 
-from pytest_smoke import smoke
-from pytest_smoke.types import SmokeEnvVar, SmokeIniOption, SmokeOption, SmokeScope, SmokeSelectMode
-
-if smoke.is_xdist_installed:
-    from xdist import is_xdist_controller, is_xdist_worker
+from pytest_smoke.types import (
+    SmokeCacheKey,
+    SmokeIniOption,
+    SmokeManifest,
+    SmokeManifestItem,
+    SmokeNodeMatcher,
+    SmokeOption,
+    SmokeScope,
+    SmokeSelectMode,
+)
 
 if TYPE_CHECKING:
+    from pathlib import Path
+
     from _pytest.nodes import Node
+    from pytest import Cache as PytestCache
     from pytest import Config, Item, Session
 
+    from pytest_smoke.extensions.collection import PytestSmokeCollectionCost
+    from pytest_smoke.extensions.fixture import PytestSmokeFixtureCost
+
+DURATION_UNITS = {"s": 1, "m": 60, "h": 3600}
+
+# The key of a resource shared between items
+K = TypeVar("K", bound=Hashable)
+
 
 class Cache:
     """Custom functools.cache decorator that provides an easy way to clear cache while allowing unlimited cache size"""
@@ -74,6 +92,9 @@ def generate_group_id(item: Item, scope: str) -> str | None:
     :param scope: Smoke scope
     """
     assert scope
+    # Declarative rules are evaluated before dispatching the hook
+    if (exclude := load_node_matcher(item.config, SmokeIniOption.SMOKE_EXCLUDE)) and exclude.matches(item):
+        return None
     if item.config.hook.pytest_smoke_exclude(item=item, scope=scope):
         return None
 
@@ -108,13 +129,20 @@ def sort_items(items: list[Item], session: Session, smoke_option: SmokeOption) -
     elif smoke_option.select_mode == SmokeSelectMode.LAST:
         sorted_items = items[::-1]
     elif smoke_option.select_mode == SmokeSelectMode.RANDOM:
-        random_: random.Random | ModuleType
-        if smoke.is_xdist_installed and (is_xdist_controller(session) or is_xdist_worker(session)):
-            # Set the seed to ensure XDIST controller and workers collect the same items
-            random_ = random.Random(UUID(os.environ[SmokeEnvVar.SMOKE_TEST_SESSION_UUID]).time)
-        else:
-            random_ = random
-        sorted_items = random_.sample(items, len(items))
+        # Use the session seed to ensure XDIST controller and workers collect the same items
+        sorted_items = random.Random(smoke_option.seed).sample(items, len(items))
+    elif smoke_option.select_mode == SmokeSelectMode.ROTATE:
+        # Tests not yet selected in the current rotation cycle come first
+        covered = load_rotation_state(session.config, smoke_option.scope)
+        sorted_items = sorted(
+            items, key=lambda x: x.nodeid in covered.get(str(generate_group_id(x, smoke_option.scope)), ())
+        )
+    elif smoke_option.select_mode == SmokeSelectMode.FIXTURE:
+        fixture_cost: PytestSmokeFixtureCost = session.config.pluginmanager.get_plugin("smoke-fixture-cost")
+        sorted_items = fixture_cost.sort_items(items, smoke_option.scope)
+    elif smoke_option.select_mode == SmokeSelectMode.COLLECTION:
+        collection_cost: PytestSmokeCollectionCost = session.config.pluginmanager.get_plugin("smoke-collection-cost")
+        sorted_items = collection_cost.sort_items(items, smoke_option.scope)
     else:
         sorted_items = session.config.hook.pytest_smoke_sort_by_select_mode(
             items=items.copy(), scope=smoke_option.scope, select_mode=smoke_option.select_mode
@@ -127,6 +155,320 @@ def sort_items(items: list[Item], session: Session, smoke_option: SmokeOption) -
     return sorted_items
 
 
+def select_items_per_group(
+    items: list[Item],
+    config: Config,
+    smoke_option: SmokeOption,
+    get_n: Callable[[Any], float],
+    is_candidate: Callable[[Item], bool],
+) -> tuple[list[Item], set[Item]] | None:
+    """Select items of each smoke scope group for a custom select mode using the pytest_smoke_select_from_group hook.
+    Return all items sorted so that the selected ones come first, and candidates that were not selected. Return None
+    when the hook does not handle the select mode
+
+    :param items: Collected Pytest items
+    :param config: Pytest config
+    :param smoke_option: Smoke option
+    :param get_n: A function that returns the number of items to select from a smoke scope group
+    :param is_candidate: A function that returns whether an item can be counted towards N
+    """
+    items_per_group: dict[Any, list[Item]] = {}
+    for item in items:
+        if (group_id := generate_group_id(item, smoke_option.scope)) is not None and is_candidate(item):
+            items_per_group.setdefault(group_id, []).append(item)
+
+    selected_items: list[Item] = []
+    rejected_items: set[Item] = set()
+    for group_id, group_items in items_per_group.items():
+        if (n := min(math.ceil(get_n(group_id)), len(group_items))) <= 0:
+            continue
+        if n == len(group_items):
+            # Nothing to choose from
+            selected_items.extend(group_items)
+            continue
+        chosen = config.hook.pytest_smoke_select_from_group(
+            group_id=str(group_id),
+            items=group_items.copy(),
+            n=n,
+            scope=smoke_option.scope,
+            select_mode=smoke_option.select_mode,
+        )
+        if chosen is None:
+            return None
+        if not set(chosen).issubset(group_items):
+            raise pytest.UsageError(
+                f"The pytest_smoke_select_from_group hook returned items that do not belong to the smoke scope group "
+                f"'{group_id}'"
+            )
+        chosen = list(dict.fromkeys(chosen))[:n]
+        selected_items.extend(chosen)
+        # The selection is final even if fewer than N items are returned
+        rejected_items.update(set(group_items).difference(chosen))
+
+    selected = set(selected_items)
+    return selected_items + [x for x in items if x not in selected], rejected_items
+
+
+def apply_quotas(
+    items: list[Item],
+    scope: str,
+    max_per_file: int | None = None,
+    max_per_dir: int | None = None,
+    max_total: int | None = None,
+) -> set[Item]:
+    """Apply per-file, per-directory, and total quotas on top of N, and return items that exceed them
+
+    Items are picked round-robin over smoke scope groups (the first item of every group, then the second one, and so
+    on), so that the quotas are distributed fairly across groups instead of on a first-come basis.
+
+    :param items: Items selected as part of N, in the selection order
+    :param scope: Smoke scope
+    :param max_per_file: The maximum number of items per test file
+    :param max_per_dir: The maximum number of items per directory
+    :param max_total: The maximum number of items in total
+    """
+    items_per_group: dict[Any, list[Item]] = {}
+    for item in items:
+        items_per_group.setdefault(generate_group_id(item, scope), []).append(item)
+
+    num_per_file: Counter[Path] = Counter()
+    num_per_dir: Counter[Path] = Counter()
+    within_quotas: set[Item] = set()
+    group_items = list(items_per_group.values())
+    for rank in range(max(map(len, group_items), default=0)):
+        for items_ in group_items:
+            if max_total is not None and len(within_quotas) >= max_total:
+                break
+            if rank >= len(items_):
+                continue
+            item = items_[rank]
+            file_path = item.path
+            dir_path = file_path.parent
+            if (max_per_file is None or num_per_file[file_path] < max_per_file) and (
+                max_per_dir is None or num_per_dir[dir_path] < max_per_dir
+            ):
+                num_per_file[file_path] += 1
+                num_per_dir[dir_path] += 1
+                within_quotas.add(item)
+    return set(items) - within_quotas
+
+
+def sort_items_breadth_first(items: list[Item], key: Callable[[Item], Any]) -> list[Item]:
+    """Sort items round-robin over smoke scope groups (the first item of every group, then the second one, and so on)
+
+    :param items: Pytest items
+    :param key: A function that returns the smoke scope group ID of an item
+    """
+    items_per_group: dict[Any, list[Item]] = {}
+    for item in items:
+        items_per_group.setdefault(key(item), []).append(item)
+    group_items = list(items_per_group.values())
+    return [
+        items_[rank]
+        for rank in range(max(map(len, group_items), default=0))
+        for items_ in group_items
+        if rank < len(items_)
+    ]
+
+
+def sort_items_by_marginal_cost(
+    items: list[Item],
+    scope: str,
+    get_costs: Callable[[Item], tuple[frozenset[K], float]],
+    get_shared_cost: Callable[[K], float],
+    is_prepaid: Callable[[Item], bool] = lambda _: False,
+) -> list[Item]:
+    """Sort items so that the first N items of each smoke scope group minimize the total cost, where resources (eg.
+    fixtures, modules) shared between items are paid for only once
+
+    Items are picked from each group in rounds (the first item of every group, then the second one, and so on), and in
+    each round, the item with the lowest marginal cost is picked from the group. The marginal cost of an item is the
+    cost of its shared resources not yet paid for by items picked earlier, plus its own cost. Ties are broken by the
+    original order of the items.
+
+    :param items: Pytest items
+    :param scope: Smoke scope
+    :param get_costs: A function that returns keys of the shared resources an item needs, and the own cost of the item
+    :param get_shared_cost: A function that returns the cost of a shared resource
+    :param is_prepaid: A function that returns whether the shared resources of an item are paid for regardless of the
+                       selection (eg. critical tests)
+    """
+    prepaid_keys: set[K] = set()
+
+    # Items in each group are bucketed by the set of their shared resources, as items that share the same set always
+    # have the same marginal cost of those resources
+    group_indices: dict[Any, int] = {}
+    bucket_ids_per_group: dict[Any, dict[frozenset[K], int]] = {}
+    buckets: list[_CostBucket[K]] = []
+    bucket_ids_per_key: dict[K, list[int]] = {}
+    items_without_group = []
+    for i, item in enumerate(items):
+        keys, own_cost = get_costs(item)
+        if is_prepaid(item):
+            prepaid_keys.update(keys)
+        if (group_id := generate_group_id(item, scope)) is None:
+            items_without_group.append(item)
+            continue
+        group_idx = group_indices.setdefault(group_id, len(group_indices))
+        bucket_ids = bucket_ids_per_group.setdefault(group_id, {})
+        if (bucket_id := bucket_ids.get(keys)) is None:
+            bucket_id = bucket_ids[keys] = len(buckets)
+            buckets.append(_CostBucket(group_idx, keys, unpaid_cost=sum(map(get_shared_cost, keys))))
+            for key in keys:
+                bucket_ids_per_key.setdefault(key, []).append(bucket_id)
+        buckets[bucket_id].items.append((own_cost, i, item))
+
+    # The marginal cost of a bucket only decreases as resources are paid for. Each group keeps a heap of its buckets,
+    # where outdated entries are discarded lazily
+    heaps: list[list[tuple[float, int, int]]] = [[] for _ in group_indices]
+
+    def push(bucket_id: int) -> None:
+        if (entry := buckets[bucket_id].heap_entry) is not None:
+            heapq.heappush(heaps[buckets[bucket_id].group_idx], (*entry, bucket_id))
+
+    def pay(keys: Iterable[K]) -> None:
+        for key in keys:
+            for bucket_id in bucket_ids_per_key.pop(key, ()):
+                buckets[bucket_id].unpaid_cost -= get_shared_cost(key)
+                push(bucket_id)
+
+    for bucket_id, bucket in enumerate(buckets):
+        # Pop items from the end
+        bucket.items.sort(reverse=True)
+        push(bucket_id)
+    pay(prepaid_keys)
+
+    sorted_items: list[Item] = []
+    active_heaps = heaps
+    while active_heaps:
+        for heap in active_heaps:
+            while heap:
+                *entry, bucket_id = heapq.heappop(heap)
+                bucket = buckets[bucket_id]
+                if bucket.heap_entry == tuple(entry):
+                    sorted_items.append(bucket.items.pop()[2])
+                    push(bucket_id)
+                    pay(bucket.keys)
+                    break
+        active_heaps = [x for x in active_heaps if x]
+    return sorted_items + items_without_group
+
+
+@Cache
+def load_rotation_state(config: Config, scope: str) -> dict[str, frozenset[str]]:
+    """Load node IDs of tests already selected in the current rotation cycle, per smoke scope group
+
+    :param config: Pytest config
+    :param scope: Smoke scope
+    """
+    state = get_cache(config).get(SmokeCacheKey.ROTATE, {}).get(scope, {})
+    return {group_id: frozenset(nodeids) for group_id, nodeids in state.items()}
+
+
+def update_rotation_state(
+    config: Config, scope: str, items: list[Item], selected_items: list[Item]
+) -> dict[str, list[str]]:
+    """Advance the rotation cursor of each smoke scope group with the selected items, and return the new state
+
+    Only node IDs that still exist are retained, so tests added to or removed from a group are handled naturally.
+    Once every test in a group has been covered, a new cycle starts with the tests that have wrapped around.
+
+    :param config: Pytest config
+    :param scope: Smoke scope
+    :param items: Collected Pytest items
+    :param selected_items: Selected Pytest items
+    """
+    nodeids_per_group: dict[str, set[str]] = {}
+    selected_nodeids_per_group: dict[str, set[str]] = {}
+    for nodeids_map, items_ in ((nodeids_per_group, items), (selected_nodeids_per_group, selected_items)):
+        for item in items_:
+            if (group_id := generate_group_id(item, scope)) is not None:
+                nodeids_map.setdefault(str(group_id), set()).add(item.nodeid)
+
+    state = {group_id: set(nodeids) for group_id, nodeids in load_rotation_state(config, scope).items()}
+    for group_id, nodeids in nodeids_per_group.items():
+        covered = state.get(group_id, set()) & nodeids
+        selected = selected_nodeids_per_group.get(group_id, set())
+        if covered | selected >= nodeids:
+            state[group_id] = selected & covered
+        else:
+            state[group_id] = covered | selected
+    return {group_id: sorted(nodeids) for group_id, nodeids in state.items() if nodeids}
+
+
+def save_rotation_state(config: Config, scope: str, state: dict[str, list[str]]) -> None:
+    """Save the rotation state of the smoke scope to the pytest cache
+
+    :param config: Pytest config
+    :param scope: Smoke scope
+    :param state: Rotation state returned by update_rotation_state()
+    """
+    cache = get_cache(config)
+    cache.set(SmokeCacheKey.ROTATE, {**cache.get(SmokeCacheKey.ROTATE, {}), scope: state})
+
+
+@Cache
+def load_node_matcher(config: Config, option: SmokeIniOption) -> SmokeNodeMatcher:
+    """Load and compile the rules of the smoke_exclude or smoke_include_from INI option
+
+    :param config: Pytest config
+    :param option: The INI option
+    """
+    if option == SmokeIniOption.SMOKE_INCLUDE_FROM:
+        rules = []
+        for path in cast(list[str], parse_ini_option(config, option)):
+            with open(path, encoding="utf-8") as f:
+                rules.extend(f.read().splitlines())
+    else:
+        rules = cast(list[str], parse_ini_option(config, option))
+    return SmokeNodeMatcher.compile(rules)
+
+
+def write_manifest(path: str, manifest: SmokeManifest) -> None:
+    """Write the smoke test selection to a manifest file
+
+    :param path: The manifest file path
+    :param manifest: Smoke manifest
+    """
+    with open(path, "w") as f:
+        json.dump(asdict(manifest), f, indent=2)
+
+
+def load_manifest(path: str) -> SmokeManifest:
+    """Load the smoke test selection from a manifest file
+
+    :param path: The manifest file path
+    """
+    try:
+        with open(path) as f:
+            data = json.load(f)
+        return SmokeManifest(**{**data, "items": [SmokeManifestItem(**x) for x in data["items"]]})
+    except (OSError, ValueError, KeyError, TypeError) as e:
+        raise pytest.UsageError(f"Unable to load the smoke manifest file '{path}': {type(e).__name__}: {e}")
+
+
+def get_cache(config: Config) -> PytestCache:
+    """Return the pytest cache
+
+    :param config: Pytest config
+    """
+    if (cache := getattr(config, "cache", None)) is None:
+        raise pytest.UsageError("The cacheprovider plugin must be enabled to use this pytest-smoke functionality")
+    return cast("PytestCache", cache)
+
+
+def format_size(num_bytes: float) -> str:
+    """Format a size in bytes with a binary unit
+
+    :param num_bytes: Size in bytes
+    """
+    for unit in ("B", "KiB", "MiB"):
+        if abs(num_bytes) < 1024:
+            return f"{num_bytes:.0f}{unit}" if unit == "B" else f"{num_bytes:.1f}{unit}"
+        num_bytes /= 1024
+    return f"{num_bytes:.1f}GiB"
+
+
 def parse_n(value: str) -> int | float | str:
     v = value.strip()
     try:
@@ -148,6 +490,61 @@ def parse_n(value: str) -> int | float | str:
         )
 
 
+def parse_escalation(value: str) -> list[int | float | str]:
+    """Parse a comma-separated list of smoke N values for escalation tiers"""
+    tiers = value.split(",")
+    if len(tiers) < 2:
+        raise pytest.UsageError(
+            f"The value must be a comma-separated list of at least two smoke N values (e.g. 1,5,20%). '{value}' was "
+            "given."
+        )
+    return [parse_n(x) for x in tiers]
+
+
+def calculate_threshold(n: int | float | str, num_collected: int) -> float:
+    """Calculate the number of tests to select from a smoke scope group for the smoke N value
+
+    :param n: Smoke N value
+    :param num_collected: The number of collected tests in the smoke scope group
+    """
+    if isinstance(n, str) and n.endswith("%"):
+        return scale_down(num_collected, float(n[:-1]))
+    return cast(int, n)
+
+
+def parse_duration(value: str) -> float:
+    """Parse a duration given in seconds, or with a unit suffix (s, m, or h)"""
+    v = value.strip().lower()
+    try:
+        if (unit := v[-1:]) in DURATION_UNITS:
+            seconds = float(v[:-1]) * DURATION_UNITS[unit]
+        else:
+            seconds = float(v)
+        if not seconds > 0:
+            raise ValueError
+        return seconds
+    except ValueError:
+        raise pytest.UsageError(f"The value must be a positive duration (e.g. 90, 30s, 10m, 1h). '{value}' was given.")
+
+
+def parse_positive_int(value: str) -> int:
+    try:
+        if (v := int(value.strip())) < 1:
+            raise ValueError
+        return v
+    except ValueError:
+        raise pytest.UsageError(f"The value must be a positive integer. '{value}' was given.")
+
+
+def parse_ratio(value: str) -> float:
+    try:
+        if not (v := float(value.strip())) > 1:
+            raise ValueError
+        return v
+    except ValueError:
+        raise pytest.UsageError(f"The value must be a number greater than 1. '{value}' was given.")
+
+
 def parse_select_mode(value: str) -> str:
     if (v := value.strip()) == "":
         raise pytest.UsageError(f"Invalid select mode: '{value}'")
@@ -160,7 +557,7 @@ def parse_scope(value: str) -> str:
     return v
 
 
-def parse_ini_option(config: Config, option: SmokeIniOption) -> str | int | float | bool:
+def parse_ini_option(config: Config, option: SmokeIniOption) -> str | int | float | bool | list[str]:
     try:
         v = config.getini(option)
         if option == SmokeIniOption.SMOKE_DEFAULT_N:
@@ -169,6 +566,19 @@ def parse_ini_option(config: Config, option: SmokeIniOption) -> str | int | floa
             return parse_select_mode(v)
         elif option == SmokeIniOption.SMOKE_DEFAULT_SCOPE:
             return parse_scope(v)
+        elif option == SmokeIniOption.SMOKE_CHANGED_BASELINE_N:
+            return 0 if v.strip() == "0" else parse_n(v)
+        elif option in (
+            SmokeIniOption.SMOKE_MEMOIZE_MAX_ENTRIES,
+            SmokeIniOption.SMOKE_HISTORY_RETENTION_DAYS,
+            SmokeIniOption.SMOKE_PERF_BASELINE_RUNS,
+        ):
+            return parse_positive_int(v)
+        elif option == SmokeIniOption.SMOKE_INCLUDE_FROM:
+            for path in v:
+                if not path.is_file():
+                    raise ValueError(f"The file '{path}' does not exist")
+            return [str(x) for x in v]
         else:
             return v
     except ValueError as e:
@@ -179,6 +589,23 @@ def _round_half_up(x: float, precision: int) -> float:
     return float(Decimal(str(x)).quantize(Decimal("10") ** -precision, rounding=ROUND_HALF_UP))
 
 
+@dataclass
+class _CostBucket(Generic[K]):
+    group_idx: int
+    keys: frozenset[K]
+    # (own cost, original index, item), in the reverse order
+    items: list[tuple[float, int, Item]] = field(default_factory=list)
+    # The cost of the shared resources not yet paid for
+    unpaid_cost: float = 0.0
+
+    @property
+    def heap_entry(self) -> tuple[float, int] | None:
+        if self.items:
+            own_cost, i, _ = self.items[-1]
+            return self.unpaid_cost + own_cost, i
+        return None
+
+
 def _generate_scope_group_id(item: Item, scope: str) -> str | None:
     def generate_class_group_id(current_item: Node, class_id: str = "") -> str:
         parent = current_item.parent
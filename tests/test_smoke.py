@@ -1,12 +1,17 @@
 from __future__ import annotations
 
+import json
+import pstats
 import re
+import sqlite3
+import sys
+from contextlib import closing
 
 import pytest
 from pytest import ExitCode, Pytester
 
 from pytest_smoke import smoke
-from pytest_smoke.types import SmokeIniOption, SmokeScope, SmokeSelectMode
+from pytest_smoke.types import SmokeCacheKey, SmokeIniOption, SmokeScope, SmokeSelectMode
 from tests.helper import (
     TEST_NAME_BASE,
     TestFileSpec,
@@ -45,7 +50,9 @@ def test_smoke_show_markers(pytester: Pytester) -> None:
     """Test the custom marker information provided by the plugin"""
     result = pytester.runpytest("--markers")
     assert result.ret == ExitCode.OK
-    result.stdout.re_match_lines([r"@pytest\.mark\.smoke\(\*, mustpass=False, runif=True\): .+"])
+    result.stdout.re_match_lines(
+        [r"@pytest\.mark\.smoke\(\*, mustpass=False, runif=True, depends=\(\), threadsafe=False\): .+"]
+    )
 
 
 @pytest.mark.parametrize("with_xdist", [False, pytest.param(True, marks=pytest.mark.xdist)])
@@ -114,6 +121,1199 @@ def test_smoke_select_mode(pytester: Pytester, select_mode: str | None) -> None:
             prev_test_nums = test_nums
 
 
+def test_smoke_select_mode_fixture(pytester: Pytester) -> None:
+    """Test the fixture select mode prefers tests whose expensive higher-scoped fixtures are already needed by other
+    selected tests, based on fixture setup durations recorded in previous runs
+    """
+    pytester.makepyfile("""
+    import time
+    import pytest
+
+    @pytest.fixture(scope="session")
+    def expensive_a():
+        time.sleep(0.1)
+
+    @pytest.fixture(scope="session")
+    def expensive_b():
+        time.sleep(0.2)
+
+    def test_1(expensive_a):
+        pass
+
+    def test_2(expensive_b):
+        pass
+
+    def test_3(expensive_a):
+        pass
+
+    def test_4():
+        pass
+    """)
+    args = ["--smoke", "3", "--smoke-scope", SmokeScope.FILE, "--smoke-select-mode", SmokeSelectMode.FIXTURE, "-v"]
+
+    # No durations recorded yet
+    result = pytester.runpytest(*args)
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=3, deselected=1)
+    assert re.findall(r"test_.+\.py::(test_\d)", str(result.stdout)) == ["test_1", "test_2", "test_3"]
+
+    result = pytester.runpytest(*args)
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=3, deselected=1)
+    assert re.findall(r"test_.+\.py::(test_\d)", str(result.stdout)) == ["test_1", "test_3", "test_4"]
+
+
+@pytest.mark.parametrize("with_xdist", [False, pytest.param(True, marks=pytest.mark.xdist)])
+def test_smoke_select_mode_collection(pytester: Pytester, with_xdist: bool) -> None:
+    """Test the collection select mode prefers tests in test modules that are cheap to collect or already needed by
+    other selected tests, based on collection times recorded in previous runs
+    """
+    pytester.makepyfile(
+        **{
+            "tests/test_a": "import time\n\ntime.sleep(0.3)\n\n\ndef test_1():\n    pass\n",
+            "tests/test_b": "def test_1():\n    pass\n\n\ndef test_2():\n    pass\n",
+        }
+    )
+    args = ["--smoke", "2", "--smoke-scope", SmokeScope.DIRECTORY, "--smoke-select-mode", SmokeSelectMode.COLLECTION]
+    if with_xdist:
+        args.extend(["-n", "2"])
+
+    def run_and_get_selected_tests() -> list[str]:
+        result = pytester.runpytest(*args, "-v")
+        assert result.ret == ExitCode.OK
+        result.assert_outcomes(passed=2, deselected=1)
+        return sorted(set(re.findall(r"tests/(test_\w\.py::test_\d)", str(result.stdout))))
+
+    # No costs recorded yet
+    assert run_and_get_selected_tests() == ["test_a.py::test_1", "test_b.py::test_1"]
+    assert run_and_get_selected_tests() == ["test_b.py::test_1", "test_b.py::test_2"]
+    durations = json.loads((pytester.path / ".pytest_cache" / "v" / SmokeCacheKey.DURATIONS).read_text())
+    assert set(durations) == {"tests/test_a.py::test_1", "tests/test_b.py::test_1", "tests/test_b.py::test_2"}
+
+
+def test_smoke_select_mode_rotate(pytester: Pytester) -> None:
+    """Test the rotate select mode cycles through all tests across successive runs, and the rotation state follows
+    changes to the collected tests
+    """
+    smoke_n = 3
+    num_tests = 10
+    pytester.makepyfile(test_rotate=generate_test_code(TestFuncSpec(num_params=num_tests)))
+    args = ["--smoke", str(smoke_n), "--smoke-select-mode", SmokeSelectMode.ROTATE, "-v"]
+
+    def run_and_get_test_nums() -> list[int]:
+        result = pytester.runpytest(*args)
+        assert result.ret == ExitCode.OK
+        return [int(n) for n in re.findall(rf"test_.+\.py::{TEST_NAME_BASE}\[(\d+)\] PASSED", str(result.stdout))]
+
+    # collect-only runs should not advance the rotation
+    result = pytester.runpytest(*args, "--co")
+    assert result.ret == ExitCode.OK
+    assert run_and_get_test_nums() == [0, 1, 2]
+    assert run_and_get_test_nums() == [3, 4, 5]
+    assert run_and_get_test_nums() == [6, 7, 8]
+    # wrap around
+    assert run_and_get_test_nums() == [0, 1, 9]
+    assert run_and_get_test_nums() == [2, 3, 4]
+
+    # Tests added to the group are picked up in the current cycle
+    pytester.makepyfile(test_rotate=generate_test_code(TestFuncSpec(num_params=num_tests + 2)))
+    assert run_and_get_test_nums() == [5, 6, 7]
+    assert run_and_get_test_nums() == [8, 9, 10]
+    assert run_and_get_test_nums() == [0, 1, 11]
+
+
+def test_smoke_adaptive(pytester: Pytester) -> None:
+    """Test --smoke-adaptive option.
+
+    N of each smoke scope group should grow to the maximum value when the group fails or changes, and should
+    decrease by one with every run where the group passed
+    """
+    smoke_n = 3
+    max_n = 5
+    num_tests = 10
+
+    def make_test_file(with_failure: bool) -> None:
+        func_body = f"assert {TestFuncSpec.param_arg_name} != 0" if with_failure else None
+        test_file_spec = TestFileSpec(
+            [TestFuncSpec(num_params=num_tests), TestFuncSpec(num_params=num_tests, func_body=func_body)]
+        )
+        pytester.makepyfile(test_adaptive=generate_test_code(test_file_spec))
+
+    def run(expected_num_passed: int, expected_num_failed: int) -> None:
+        result = pytester.runpytest("--smoke", str(smoke_n), "--smoke-adaptive", str(max_n))
+        num_selected = expected_num_passed + expected_num_failed
+        result.assert_outcomes(
+            passed=expected_num_passed, failed=expected_num_failed, deselected=num_tests * 2 - num_selected
+        )
+
+    make_test_file(with_failure=True)
+    # The first run uses N
+    run(smoke_n * 2 - 1, 1)
+    run(smoke_n - 1 + max_n - 1, 1)
+    run(smoke_n - 2 + max_n - 1, 1)
+    run(1 + max_n - 1, 1)
+
+    # Changes to the test file should reset N to the maximum value
+    make_test_file(with_failure=False)
+    run(max_n * 2, 0)
+    run((max_n - 1) * 2, 0)
+
+    # The history of groups that no longer exist should be pruned
+    def get_group_ids() -> set[str]:
+        state = json.loads((pytester.path / ".pytest_cache" / "v" / SmokeCacheKey.ADAPTIVE).read_text())
+        return {group_id for groups in state.values() for group_id in groups}
+
+    assert any("test_adaptive.py" in x for x in get_group_ids())
+    (pytester.path / "test_adaptive.py").rename(pytester.path / "test_renamed.py")
+    run(max_n * 2, 0)
+    group_ids = get_group_ids()
+    assert group_ids
+    assert not any("test_adaptive.py" in x for x in group_ids)
+
+
+@pytest.mark.parametrize("baseline_n", [None, "0", "2"])
+@pytest.mark.parametrize(
+    ("changed_file", "expected_impacted_test_files"),
+    [
+        ("mypkg/a.py", ["test_1", "test_2"]),
+        ("mypkg/b.py", ["test_2"]),
+        ("mypkg/c.py", []),
+        ("test_3.py", ["test_3"]),
+        ("conftest.py", ["test_1", "test_2", "test_3"]),
+    ],
+)
+def test_smoke_changed_since(
+    pytester: Pytester, changed_file: str, expected_impacted_test_files: list[str], baseline_n: str | None
+) -> None:
+    """Test --smoke-changed-since option.
+
+    N should be applied only to smoke scope groups whose test files import changed modules directly or transitively,
+    or are changed themselves. Other groups should get the baseline N
+    """
+    smoke_n = 3
+    num_tests = 5
+    pytester.makepyfile(
+        **{
+            "mypkg/__init__": "",
+            "mypkg/a": "X = 1",
+            "mypkg/b": "from .a import X",
+            "mypkg/c": "",
+            "conftest": "",
+        }
+    )
+    test_code = generate_test_code(TestFuncSpec(num_params=num_tests))
+    pytester.makepyfile(
+        test_1="from mypkg.a import X\n" + test_code,
+        test_2="import mypkg.b\n" + test_code,
+        test_3=test_code,
+    )
+    if baseline_n is not None:
+        pytester.makeini(f"""
+        [pytest]
+        {SmokeIniOption.SMOKE_CHANGED_BASELINE_N} = {baseline_n}
+        """)
+    for git_args in (["init", "-q"], ["add", "-A"], ["commit", "-qm", "init"]):
+        pytester.run("git", "-c", "user.name=test", "-c", "user.email=test@example.com", *git_args)
+    with open(pytester.path / changed_file, "a") as f:
+        f.write("\n# changed\n")
+
+    result = pytester.runpytest(
+        "--smoke", str(smoke_n), "--smoke-scope", SmokeScope.FILE, "--smoke-changed-since", "HEAD"
+    )
+    assert result.ret == (
+        ExitCode.OK if expected_impacted_test_files or baseline_n != "0" else ExitCode.NO_TESTS_COLLECTED
+    )
+    num_impacted = len(expected_impacted_test_files)
+    num_selected = smoke_n * num_impacted + int(baseline_n or 1) * (3 - num_impacted)
+    result.assert_outcomes(passed=num_selected, deselected=num_tests * 3 - num_selected)
+
+
+def test_smoke_changed_lines(pytester: Pytester) -> None:
+    """Test --smoke-changed-lines option with the coverage map recorded with --smoke-record-coverage.
+
+    Only tests covering the changed lines should be selected from each impacted group, up to N. Tests not recorded in
+    the coverage map should fall back to the import graph
+    """
+    smoke_n = 5
+    pytester.makepyfile(
+        **{
+            "mypkg/__init__": "",
+            "mypkg/util": "def f():\n    return 1\n\n\ndef g():\n    return 2\n",
+        }
+    )
+    pytester.makepyfile(
+        test_a="from mypkg.util import f, g\n"
+        + "".join(f"def test_f{i}():\n    f()\n" for i in range(2))
+        + "".join(f"def test_g{i}():\n    g()\n" for i in range(3)),
+        test_b="import mypkg.util\n" + "".join(f"def test_x{i}():\n    pass\n" for i in range(3)),
+    )
+    args = ["--smoke", str(smoke_n), "--smoke-scope", SmokeScope.FILE]
+
+    result = pytester.runpytest(*args, "--smoke-changed-since", "HEAD", "--smoke-changed-lines")
+    assert result.ret == ExitCode.USAGE_ERROR
+    result.stderr.re_match_lines([r"ERROR: The coverage map has not been recorded yet\. .+"])
+
+    result = pytester.runpytest("--smoke", "100%", "--smoke-record-coverage")
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=8)
+    result.stdout.re_match_lines([r".+ smoke coverage map .+", r"Recorded 8 tests .+", r"Coverage index: .+"])
+
+    for git_args in (["init", "-q"], ["add", "-A"], ["commit", "-qm", "init"]):
+        pytester.run("git", "-c", "user.name=test", "-c", "user.email=test@example.com", *git_args)
+    util = pytester.path / "mypkg" / "util.py"
+    util.write_text(util.read_text().replace("return 2", "return 3"))
+    with open(pytester.path / "test_b.py", "a") as f:
+        f.write("\ndef test_new():\n    pass\n")
+
+    result = pytester.runpytest(*args, "--smoke-changed-since", "HEAD", "-v")
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=9)
+
+    result = pytester.runpytest(*args, "--smoke-changed-since", "HEAD", "--smoke-changed-lines", "-v")
+    assert result.ret == ExitCode.OK
+    # test_x2 is also impacted as a newline is added to its last line
+    result.assert_outcomes(passed=5, deselected=4)
+    result.stdout.re_match_lines(
+        [rf"test_a\.py::test_g{i} PASSED .+" for i in range(3)]
+        + [r"test_b\.py::test_x2 PASSED .+", r"test_b\.py::test_new PASSED .+"]
+    )
+
+    # Module-level lines executed on import are not recorded. Such changes should fall back to the import graph
+    pytester.run("git", "-c", "user.name=test", "-c", "user.email=test@example.com", "commit", "-qam", "update")
+    util.write_text("X = 1\n" + util.read_text())
+    result = pytester.runpytest(*args, "--smoke-changed-since", "HEAD", "--smoke-changed-lines", "-v")
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=9)
+
+    result = pytester.runpytest(*args, "--smoke-changed-lines")
+    assert result.ret == ExitCode.USAGE_ERROR
+    result.stderr.re_match_lines([r"ERROR: The --smoke-changed-lines option requires the --smoke-changed-since option"])
+
+
+def test_smoke_deadline(pytester: Pytester) -> None:
+    """Test --smoke-deadline option.
+
+    Selected tests should be reordered round-robin over smoke scope groups, and remaining tests should be skipped once
+    the deadline is exceeded
+    """
+    test_code = """
+    import time
+    import pytest
+
+    @pytest.mark.parametrize("p", range(3))
+    def test_func(p):
+        time.sleep(1)
+    """
+    pytester.makepyfile(test_a=test_code, test_b=test_code)
+    result = pytester.runpytest("--smoke", "100%", "--smoke-scope", SmokeScope.FILE, "--smoke-deadline", "1.5", "-v")
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=2, skipped=4)
+    result.stdout.re_match_lines(
+        [
+            r"test_a\.py::test_func\[0\] PASSED .+",
+            r"test_b\.py::test_func\[0\] PASSED .+",
+            r"test_a\.py::test_func\[1\] SKIPPED \(The smoke deadline \(1\.5s\) was exceeded\) .+",
+            r"test_b\.py::test_func\[1\] SKIPPED .+",
+            r"test_a\.py::test_func\[2\] SKIPPED .+",
+            r"test_b\.py::test_func\[2\] SKIPPED .+",
+            r"=+ smoke deadline =+",
+            r"The smoke deadline \(1\.5s\) was exceeded\. 4/6 selected tests were skipped",
+        ]
+    )
+
+
+@pytest.mark.parametrize("value", ["0", "-1", "foo", "10x"])
+def test_smoke_deadline_with_invalid_value(pytester: Pytester, value: str) -> None:
+    """Test --smoke-deadline option with an invalid value"""
+    result = pytester.runpytest("--smoke", "--smoke-deadline", value)
+    assert result.ret == ExitCode.USAGE_ERROR
+    result.stderr.re_match_lines([rf".+ The value must be a positive duration .+ '{value}' was given\."])
+
+
+@pytest.mark.parametrize("should_fail", [False, True])
+def test_smoke_escalate(pytester: Pytester, should_fail: bool) -> None:
+    """Test --smoke-escalate option.
+
+    Selected tests should be executed in the order of nested tiers, and tests in subsequent tiers should be skipped
+    once a test in a tier fails
+    """
+    num_tests = 10
+    func_body = f"\tassert {TestFuncSpec.param_arg_name} != 1" if should_fail else None
+    pytester.makepyfile(
+        generate_test_code(
+            TestFileSpec([TestFuncSpec(num_params=num_tests), TestFuncSpec(num_params=num_tests, func_body=func_body)])
+        )
+    )
+    result = pytester.runpytest("--smoke", "--smoke-escalate", "1,3,50%", "-v")
+    test_ids = re.findall(rf"test_.+\.py::({TEST_NAME_BASE}\d\[\d+\]) (?:PASSED|FAILED|SKIPPED)", str(result.stdout))
+    assert test_ids == [
+        f"{TEST_NAME_BASE}{i}[{p}]" for p_range in ([0], [1, 2], [3, 4]) for i in (1, 2) for p in p_range
+    ]
+    if should_fail:
+        assert result.ret == ExitCode.TESTS_FAILED
+        result.assert_outcomes(passed=5, failed=1, skipped=4, deselected=10)
+        result.stdout.re_match_lines(
+            [
+                rf".+::{TEST_NAME_BASE}1\[3\] SKIPPED \(Smoke tier 2 failed\. Escalation to tier 3 was stopped\) .+",
+                r"=+ smoke escalation =+",
+                r"tier 1 \(N=1\): 2 passed",
+                r"tier 2 \(N=3\): 3 passed, 1 failed",
+                r"tier 3 \(N=50\.0%\): 4 not run",
+            ]
+        )
+    else:
+        assert result.ret == ExitCode.OK
+        result.assert_outcomes(passed=10, deselected=10)
+        result.stdout.re_match_lines(
+            [
+                r"=+ smoke escalation =+",
+                r"tier 1 \(N=1\): 2 passed",
+                r"tier 2 \(N=3\): 4 passed",
+                r"tier 3 \(N=50\.0%\): 4 passed",
+            ]
+        )
+
+
+@pytest.mark.xdist
+def test_smoke_escalate_with_xdist(pytester: Pytester) -> None:
+    """Test --smoke-escalate option can not be used with pytest-xdist"""
+    result = pytester.runpytest("--smoke", "--smoke-escalate", "1,2", "-n", "2")
+    assert result.ret == ExitCode.USAGE_ERROR
+    result.stderr.re_match_lines(
+        [r"ERROR: The --smoke-escalate option cannot be used with the -n/--numprocesses option"]
+    )
+
+
+@pytest.mark.parametrize("value", ["1", "1,foo", "1,0"])
+def test_smoke_escalate_with_invalid_value(pytester: Pytester, value: str) -> None:
+    """Test --smoke-escalate option with an invalid value"""
+    result = pytester.runpytest("--smoke", "--smoke-escalate", value)
+    assert result.ret == ExitCode.USAGE_ERROR
+    result.stderr.re_match_lines([r"ERROR: .+ '.+' was given\."])
+
+
+def test_smoke_threads(pytester: Pytester) -> None:
+    """Test --smoke-threads option.
+
+    Thread-safe tests without function-scoped fixtures should run concurrently, and reports should be logged in the
+    original order
+    """
+    pytester.makepyfile("""
+    import threading
+
+    import pytest
+
+    barrier = threading.Barrier(3, timeout=60)
+
+
+    @pytest.fixture(scope="module")
+    def shared():
+        return "shared"
+
+
+    @pytest.mark.smoke(threadsafe=True)
+    @pytest.mark.parametrize("p", range(3))
+    def test_concurrent(shared, p):
+        # Every test waits for the others, which times out unless all of them run at the same time
+        barrier.wait()
+        assert p != 1
+
+
+    @pytest.mark.smoke(threadsafe=True)
+    def test_function_scoped_fixture(tmp_path):
+        assert threading.current_thread() is threading.main_thread()
+
+
+    @pytest.fixture
+    def indirect(request):
+        return request.param
+
+
+    @pytest.mark.smoke(threadsafe=True)
+    @pytest.mark.parametrize("indirect", range(2), indirect=True)
+    def test_indirect_function_scoped_fixture(indirect):
+        assert threading.current_thread() is threading.main_thread()
+
+
+    def test_not_marked():
+        assert threading.current_thread() is threading.main_thread()
+    """)
+    result = pytester.runpytest("--smoke", "100%", "--smoke-threads", "3", "-v")
+    assert result.ret == ExitCode.TESTS_FAILED
+    result.assert_outcomes(passed=6, failed=1)
+    result.stdout.re_match_lines(
+        [
+            r".+::test_concurrent\[0\] PASSED .+",
+            r".+::test_concurrent\[1\] FAILED .+",
+            r".+::test_concurrent\[2\] PASSED .+",
+            r".+::test_function_scoped_fixture PASSED .+",
+            r".+::test_indirect_function_scoped_fixture\[0\] PASSED .+",
+            r".+::test_indirect_function_scoped_fixture\[1\] PASSED .+",
+            r".+::test_not_marked PASSED .+",
+            r"smoke threads: 3 thread-safe tests executed concurrently on 3 threads \(estimated time saved: .+\)",
+        ]
+    )
+
+
+def test_smoke_threads_with_memoize(pytester: Pytester) -> None:
+    """Test --smoke-threads option can not be used with --smoke-memoize option"""
+    result = pytester.runpytest("--smoke", "--smoke-threads", "2", "--smoke-memoize")
+    assert result.ret == ExitCode.USAGE_ERROR
+    result.stderr.re_match_lines([r"ERROR: The --smoke-threads option cannot be used with the --smoke-memoize option"])
+
+
+@pytest.mark.xdist
+def test_smoke_threads_with_xdist(pytester: Pytester) -> None:
+    """Test --smoke-threads option can not be used with pytest-xdist"""
+    result = pytester.runpytest("--smoke", "--smoke-threads", "2", "-n", "2")
+    assert result.ret == ExitCode.USAGE_ERROR
+    result.stderr.re_match_lines(
+        [r"ERROR: The --smoke-threads option cannot be used with the -n/--numprocesses option"]
+    )
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Linux only")
+def test_smoke_forks(pytester: Pytester) -> None:
+    """Test --smoke-forks option.
+
+    Regular smoke tests should be executed in forked workers, and their reports should be logged in the main process.
+    Tests not reported by a crashed worker should fail
+    """
+    test_code = """
+    import os
+
+    import pytest
+
+    # Test modules are imported only once in the main process
+    MAIN_PID = os.getpid()
+
+
+    @pytest.mark.parametrize("p", range(3))
+    def test_func(p):
+        assert os.getpid() != MAIN_PID
+        assert p != 1
+    """
+    pytester.makepyfile(test_a=test_code, test_b=test_code)
+    pytester.makepyfile(test_crash="import os\n\n\ndef test_crash():\n    os._exit(1)\n")
+    result = pytester.runpytest("--smoke", "2", "--smoke-scope", SmokeScope.FILE, "--smoke-forks", "2")
+    assert result.ret == ExitCode.TESTS_FAILED
+    result.assert_outcomes(passed=2, failed=3, deselected=2)
+    result.stdout.re_match_lines(
+        [
+            r"The smoke fork worker \(pid=\d+\) crashed before reporting this test",
+            r"smoke forks: 3 work units executed on 2 forked workers \(average startup: .+ms\), 1 crashed",
+        ]
+    )
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Linux only")
+def test_smoke_forks_with_mustpass_failure(pytester: Pytester) -> None:
+    """Test regular smoke tests executed in forked workers are skipped when a must-pass test fails"""
+    pytester.makepyfile("""
+    import pytest
+
+    @pytest.mark.smoke(mustpass=True)
+    def test_mustpass():
+        assert False
+
+    @pytest.mark.parametrize("p", range(3))
+    def test_func(p):
+        pass
+    """)
+    pytester.makeini(f"""
+    [pytest]
+    {SmokeIniOption.SMOKE_MARKED_TESTS_AS_CRITICAL} = true
+    """)
+    result = pytester.runpytest("--smoke", "3", "--smoke-forks", "2")
+    assert result.ret == ExitCode.TESTS_FAILED
+    result.assert_outcomes(failed=1, skipped=3)
+
+
+@pytest.mark.skipif(not sys.platform.startswith("linux"), reason="Linux only")
+@pytest.mark.parametrize("option", ["--smoke-memoize", "--smoke-record-coverage", "--smoke-profile-tests"])
+def test_smoke_forks_with_incompatible_option(pytester: Pytester, option: str) -> None:
+    """Test --smoke-forks option can not be used with options that wrap the runtest protocol"""
+    result = pytester.runpytest("--smoke", "--smoke-forks", "2", option)
+    assert result.ret == ExitCode.USAGE_ERROR
+    result.stderr.re_match_lines([rf"ERROR: The --smoke-forks option cannot be used with the {option} option"])
+
+
+@pytest.mark.xdist
+def test_smoke_forks_with_xdist(pytester: Pytester) -> None:
+    """Test --smoke-forks option can not be used with pytest-xdist"""
+    result = pytester.runpytest("--smoke", "--smoke-forks", "2", "-n", "2")
+    assert result.ret == ExitCode.USAGE_ERROR
+    result.stderr.re_match_lines([r"ERROR: The --smoke-forks option cannot be used with the -n/--numprocesses option"])
+
+
+@pytest.mark.parametrize("memory_lean", [False, True])
+def test_smoke_memory_lean(pytester: Pytester, memory_lean: bool) -> None:
+    """Test --smoke-memory-lean option.
+
+    Deselected items should be garbage collected right after the collection, while the terminal output still reports
+    the number of deselected tests
+    """
+    num_tests = 100
+    pytester.makeconftest("""
+    import gc
+    import weakref
+
+    import pytest
+
+    refs = []
+
+    @pytest.hookimpl(tryfirst=True)
+    def pytest_collection_modifyitems(items):
+        refs.extend(weakref.ref(x) for x in items)
+
+    def pytest_collection_finish(session):
+        gc.collect()
+        selected = set(session.items)
+        num_alive = sum(1 for x in refs if (item := x()) is not None and item not in selected)
+        print(f"alive deselected items: {num_alive}")
+    """)
+    pytester.makepyfile(generate_test_code(TestFuncSpec(num_params=num_tests)))
+    args = ["--smoke", "-s"]
+    if memory_lean:
+        args.append("--smoke-memory-lean")
+    # The hook recorder of an in-process run keeps references to deselected items
+    result = pytester.runpytest_subprocess(*args)
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=1, deselected=num_tests - 1)
+    if memory_lean:
+        result.stdout.re_match_lines(
+            [
+                r"alive deselected items: 0",
+                rf"smoke memory lean: released {num_tests - 1} deselected items \(\d+ objects garbage collected in "
+                r"\d+\.\dms\)",
+            ]
+        )
+    else:
+        result.stdout.re_match_lines([rf"alive deselected items: {num_tests - 1}"])
+        result.stdout.no_re_match_line(r"smoke memory lean: .+")
+
+
+@pytest.mark.parametrize(
+    ("quota_option", "quota", "expected_test_ids"),
+    [
+        (
+            "--smoke-max-per-file",
+            4,
+            [f"test_{f}.py::{TEST_NAME_BASE}{i}[{p}]" for f in "ab" for i, p in [(1, 0), (1, 1), (2, 0), (3, 0)]],
+        ),
+        (
+            "--smoke-max-per-dir",
+            4,
+            [f"test_a.py::{TEST_NAME_BASE}{i}[0]" for i in range(1, 4)] + [f"test_b.py::{TEST_NAME_BASE}1[0]"],
+        ),
+        (
+            "--smoke-max-total",
+            8,
+            [f"test_{f}.py::{TEST_NAME_BASE}{i}[0]" for f in "ab" for i in range(1, 4)]
+            + [f"test_a.py::{TEST_NAME_BASE}{i}[1]" for i in range(1, 3)],
+        ),
+    ],
+)
+def test_smoke_quotas(pytester: Pytester, quota_option: str, quota: int, expected_test_ids: list[str]) -> None:
+    """Test --smoke-max-per-file, --smoke-max-per-dir, and --smoke-max-total options.
+
+    Tests exceeding the quotas should be deselected round-robin over smoke scope groups
+    """
+    smoke_n = 2
+    num_tests = 5
+    test_file_spec = TestFileSpec([TestFuncSpec(num_params=num_tests) for _ in range(3)])
+    pytester.makepyfile(test_a=generate_test_code(test_file_spec), test_b=generate_test_code(test_file_spec))
+    num_all_tests = get_num_tests(test_file_spec) * 2
+    result = pytester.runpytest("--smoke", str(smoke_n), quota_option, str(quota), "--co", "-q")
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(deselected=num_all_tests - len(expected_test_ids))
+    test_ids = re.findall(rf"(test_.+\.py::{TEST_NAME_BASE}\d\[\d+\])", str(result.stdout))
+    assert sorted(test_ids) == sorted(expected_test_ids)
+
+
+@pytest.mark.parametrize("select_mode", [SmokeSelectMode.FIRST, SmokeSelectMode.RANDOM])
+def test_smoke_manifest(pytester: Pytester, select_mode: str) -> None:
+    """Test --smoke-manifest and --smoke-from-manifest options.
+
+    The selection replayed from the manifest should be identical to the recorded one, without going through the
+    selection logic
+    """
+    smoke_n = 3
+    num_tests = 20
+    num_critical_tests = 2
+    param_marker = lambda p: "smoke(mustpass=True)" if p >= num_tests - num_critical_tests else None  # noqa
+    pytester.makepyfile(generate_test_code(TestFuncSpec(num_params=num_tests, param_marker=param_marker)))
+    pytester.makeini(f"""
+    [pytest]
+    {SmokeIniOption.SMOKE_MARKED_TESTS_AS_CRITICAL} = true
+    """)
+    included_test_idx = num_tests - num_critical_tests - 1
+    pytester.makeconftest(f"""
+    def pytest_smoke_include(item, scope):
+        return item.name.endswith("[{included_test_idx}]")
+    """)
+    manifest_path = pytester.path / "manifest.json"
+    result = pytester.runpytest(
+        "--smoke", str(smoke_n), "--smoke-select-mode", select_mode, "--smoke-manifest", str(manifest_path), "-v"
+    )
+    assert result.ret == ExitCode.OK
+    num_selected = smoke_n + num_critical_tests + 1
+    result.assert_outcomes(passed=num_selected, deselected=num_tests - num_selected)
+    recorded_test_ids = re.findall(rf"(test_.+\.py::{TEST_NAME_BASE}\[\d+\]) PASSED", str(result.stdout))
+
+    manifest = json.loads(manifest_path.read_text())
+    assert manifest["scope"] == SmokeScope.AUTO
+    assert manifest["select_mode"] == select_mode
+    assert manifest["n"] == smoke_n
+    assert (manifest["seed"] is not None) is (select_mode == SmokeSelectMode.RANDOM)
+    assert [x["nodeid"] for x in manifest["items"]] == recorded_test_ids
+    assert [(x["critical"], x["mustpass"]) for x in manifest["items"]] == [(True, True)] * num_critical_tests + [
+        (False, False)
+    ] * (smoke_n + 1)
+    assert [x["nodeid"].split("::")[-1] for x in manifest["items"] if x["included"]] == [
+        f"{TEST_NAME_BASE}[{included_test_idx}]"
+    ]
+
+    # None of the hooks should be called during replay
+    pytester.makeconftest("""
+    def pytest_smoke_exclude(item, scope):
+        raise Exception("hook should not be called")
+
+    def pytest_smoke_include(item, scope):
+        raise Exception("hook should not be called")
+    """)
+    result = pytester.runpytest("--smoke", "--smoke-from-manifest", str(manifest_path), "-v")
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=num_selected, deselected=num_tests - num_selected)
+    assert re.findall(rf"(test_.+\.py::{TEST_NAME_BASE}\[\d+\]) PASSED", str(result.stdout)) == recorded_test_ids
+    assert str(result.stdout).count("PASSED (must-pass)") == num_critical_tests
+
+
+@pytest.mark.parametrize("with_xdist", [False, pytest.param(True, marks=pytest.mark.xdist)])
+def test_smoke_durations(pytester: Pytester, with_xdist: bool) -> None:
+    """Test --smoke-durations option.
+
+    Setup, call, and teardown durations should be aggregated per smoke scope group, and the K slowest groups should be
+    reported
+    """
+    pytester.makepyfile(
+        test_a="""
+        import time
+        import pytest
+
+        @pytest.fixture
+        def slow_setup():
+            time.sleep(0.05)
+
+        @pytest.mark.parametrize("p", range(2))
+        def test_func(slow_setup, p):
+            time.sleep(0.1)
+        """,
+        test_b="""
+        import pytest
+
+        @pytest.mark.parametrize("p", range(3))
+        def test_func(p):
+            pass
+        """,
+    )
+    args = ["--smoke", "100%", "--smoke-scope", SmokeScope.FILE, "--smoke-durations", "1"]
+    if with_xdist:
+        args.extend(["-n", "2"])
+    result = pytester.runpytest(*args)
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=5)
+    result.stdout.re_match_lines(
+        [
+            r"=+ smoke durations =+",
+            r"Top 1 slowest groups out of 2 \(total test time: \d+\.\d+s, wall time: \d+\.\d+s\):",
+            r"\s+total\s+share\s+setup\s+call\s+teardown\s+tests\s+avg/test\s+group",
+            r"\s+0\.\d+s\s+\d{2}\.\d%\s+0\.1\ds\s+0\.2\ds\s+0\.\d+s\s+2\s+0\.1\d+s\s+.+test_a\.py",
+        ]
+    )
+    assert "smoke report" not in str(result.stdout)
+    assert "test_b.py" not in str(result.stdout).split("smoke durations")[1]
+
+
+@pytest.mark.parametrize("with_xdist", [False, pytest.param(True, marks=pytest.mark.xdist)])
+def test_smoke_profile_tests(pytester: Pytester, with_xdist: bool) -> None:
+    """Test --smoke-profile-tests option.
+
+    Sampled call stacks should be aggregated per smoke scope group and for the whole run, and written as collapsed
+    stacks and a pstats dump
+    """
+    test_code = """
+    import time
+
+    import pytest
+
+    def busy_loop():
+        start = time.process_time()
+        while time.process_time() - start < 0.1:
+            pass
+
+    @pytest.mark.parametrize("p", range(2))
+    def test_func(p):
+        busy_loop()
+    """
+    pytester.makepyfile(test_a=test_code, test_b=test_code)
+    args = ["--smoke", "100%", "--smoke-scope", SmokeScope.FILE, "--smoke-profile-tests", "profile"]
+    if with_xdist:
+        args.extend(["-n", "2"])
+    result = pytester.runpytest(*args)
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=4)
+    result.stdout.re_match_lines(
+        [
+            r"=+ smoke profile =+",
+            r"\d+ samples from 4 tests in 2 groups over 0\.\d+s of CPU time \(effective sampling interval: .+ms\)",
+            r"profiler overhead: \d+\.\dms \(\d+\.\d+% of the profiled call time\)",
+            r"Top \d+ functions by self samples:",
+            r"\s+\d+\s+\d+\.\d%\s+busy_loop \(test_[ab]\.py:\d+\)",
+        ]
+    )
+
+    profile_dir = pytester.path / "profile"
+    stacks = (profile_dir / "profile.collapsed").read_text().splitlines()
+    assert stacks
+    assert all(re.fullmatch(r"test_func \(test_[ab]\.py:\d+\);.+ \d+", x) for x in stacks)
+    stacks_by_group = (profile_dir / "profile-by-group.collapsed").read_text().splitlines()
+    assert {x.split(";")[0] for x in stacks_by_group} == {str(pytester.path / f"test_{x}.py") for x in "ab"}
+    stats = pstats.Stats(str(profile_dir / "profile.pstats"))
+    assert {func_name for _, _, func_name in stats.stats} >= {"test_func", "busy_loop"}  # type: ignore[attr-defined]
+
+
+@pytest.mark.parametrize("with_xdist", [False, pytest.param(True, marks=pytest.mark.xdist)])
+def test_smoke_resources(pytester: Pytester, with_xdist: bool) -> None:
+    """Test --smoke-resources option with --smoke-resources-tracemalloc.
+
+    Resource usage of each test should be aggregated from test reports, and the heaviest tests and groups should be
+    reported
+    """
+    pytester.makepyfile(
+        test_a="""
+        import time
+
+        def test_cpu():
+            start = time.process_time()
+            while time.process_time() - start < 0.2:
+                pass
+
+        def test_noop():
+            pass
+        """,
+        test_b="""
+        def test_memory():
+            data = bytearray(20 * 1024 * 1024)
+            del data
+        """,
+    )
+    args = ["--smoke", "100%", "--smoke-scope", SmokeScope.FILE, "--smoke-resources=1", "--smoke-resources-tracemalloc"]
+    if with_xdist:
+        args.extend(["-n", "2"])
+    result = pytester.runpytest(*args)
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=3)
+    result.stdout.re_match_lines(
+        [
+            r"=+ smoke resources =+",
+            r"Top 1 tests by CPU time:",
+            r"\s+user\s+sys\s+RSS growth\s+alloc peak\s+test",
+            r"\s+0\.[12]\ds\s+\d+\.\d{2}s\s+\S+\s+\S+\s+test_a\.py::test_cpu",
+            r"Top 1 tests by peak allocation:",
+            r"\s+user\s+sys\s+RSS growth\s+alloc peak\s+test",
+            r"\s+\d+\.\d{2}s\s+\d+\.\d{2}s\s+\S+\s+20\.\dMiB\s+test_b\.py::test_memory",
+            r"Top 1 groups by CPU time:",
+            r"\s+user\s+sys\s+RSS growth\s+alloc peak\s+group",
+            r".+ \S+test_a\.py",
+            r"Top 1 groups by peak allocation:",
+            r"\s+user\s+sys\s+RSS growth\s+alloc peak\s+group",
+            r".+ 20\.\dMiB\s+\S+test_b\.py",
+        ]
+    )
+
+
+def test_smoke_resources_tracemalloc_without_resources(pytester: Pytester) -> None:
+    """Test --smoke-resources-tracemalloc option requires --smoke-resources option"""
+    result = pytester.runpytest("--smoke", "--smoke-resources-tracemalloc")
+    assert result.ret == ExitCode.USAGE_ERROR
+    result.stderr.re_match_lines(
+        [r"ERROR: The --smoke-resources-tracemalloc option requires the --smoke-resources option"]
+    )
+
+
+@pytest.mark.parametrize("with_xdist", [False, pytest.param(True, marks=pytest.mark.xdist)])
+def test_smoke_collect_profile(pytester: Pytester, with_xdist: bool) -> None:
+    """Test --smoke-collect-profile option.
+
+    The collection time of each test module and directory should be reported along with the share of test modules
+    without selected tests, and recorded in the pytest cache
+    """
+    pytester.makeconftest("""
+    def pytest_smoke_exclude(item, scope):
+        return item.path.name == "test_slow.py"
+    """)
+    pytester.makepyfile(
+        **{
+            "tests/test_slow": "import time\n\ntime.sleep(0.3)\n\n\ndef test_func():\n    pass\n",
+            "tests/test_fast": "def test_func():\n    pass\n",
+        }
+    )
+    args = ["--smoke", "--smoke-collect-profile=2"]
+    if with_xdist:
+        args.extend(["-n", "2"])
+    result = pytester.runpytest(*args)
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=1, deselected=1)
+    result.stdout.re_match_lines(
+        [
+            r"=+ smoke collection profile =+",
+            r"collection: \d+\.\d{2}s wall time, \d+\.\d{2}s in 2 test modules, \d+\.\d{2}s in 2 directories "
+            r"\(including conftest\.py\)",
+            r"1 of 2 test modules have no selected smoke tests, accounting for \d+\.\d{2}s \(\d+\.\d%\) of the "
+            r"collection time of test modules",
+            r"Top 2 modules and directories by collection time:",
+            r"\s+time\s+memory\s+selected\s+module/directory",
+            r"\s+\d+\.\d{3}s\s+\S+\s+0  tests/test_slow\.py",
+            r"\s+\d\.\d{3}s\s+\S+\s+1  .+",
+        ]
+    )
+    costs = json.loads((pytester.path / ".pytest_cache" / "v" / SmokeCacheKey.COLLECTION).read_text())
+    assert set(costs) == {".", "tests", "tests/test_slow.py", "tests/test_fast.py"}
+    assert costs["tests/test_slow.py"]["duration"] >= 0.3
+
+
+def test_smoke_from_manifest_invalid(pytester: Pytester) -> None:
+    """Test --smoke-from-manifest option with a manifest file that can not be loaded"""
+    pytester.makepyfile(generate_test_code(TestFuncSpec()))
+    result = pytester.runpytest("--smoke", "--smoke-from-manifest", "foo.json")
+    assert result.ret == ExitCode.USAGE_ERROR
+    result.stderr.re_match_lines([r"ERROR: Unable to load the smoke manifest file 'foo\.json': .+"])
+
+
+@pytest.mark.parametrize("with_xdist", [False, pytest.param(True, marks=pytest.mark.xdist)])
+def test_smoke_memoize(pytester: Pytester, with_xdist: bool) -> None:
+    """Test --smoke-memoize option.
+
+    Tests that passed in the previous run should be reported as cached passes without being executed, unless their
+    test module or dependency files are changed
+    """
+    pytester.makefile(".txt", data="foo")
+    pytester.makepyfile(
+        test_a="""
+        import pytest
+
+        @pytest.mark.smoke(depends="*.txt")
+        @pytest.mark.parametrize("p", range(3))
+        def test_func(p):
+            pass
+        """,
+        test_b="""
+        def test_func():
+            pass
+        """,
+    )
+    args = ["--smoke", "100%", "--smoke-memoize", "-v"]
+    if with_xdist:
+        args.extend(["-n", "2"])
+
+    result = pytester.runpytest(*args)
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=4)
+    assert "(cached)" not in str(result.stdout)
+
+    result = pytester.runpytest(*args)
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=4)
+    result.stdout.re_match_lines([r".*PASSED \(cached\).*"] * 4 + [r"smoke memoize: 4 tests reported as cached .+"])
+
+    (pytester.path / "data.txt").write_text("bar")
+    result = pytester.runpytest(*args)
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=4)
+    result.stdout.re_match_lines([r"smoke memoize: 1 test reported as cached .+"])
+    assert str(result.stdout).count("PASSED (cached)") == 1
+
+    pytester.makeini(f"""
+    [pytest]
+    {SmokeIniOption.SMOKE_MEMOIZE_MAX_ENTRIES} = 1
+    """)
+    result = pytester.runpytest(*args)
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=4)
+    result = pytester.runpytest(*args)
+    assert result.ret == ExitCode.OK
+    result.stdout.re_match_lines([r"smoke memoize: 1 test reported as cached .+"])
+
+
+def test_smoke_memoize_teardown(pytester: Pytester) -> None:
+    """Test --smoke-memoize option tears down fixtures of previously executed tests when a cached pass is followed by a
+    test executed in another module
+    """
+    pytester.makefile(".txt", data="foo")
+    pytester.makepyfile(
+        test_x="""
+        import pytest
+
+        @pytest.fixture(scope="module")
+        def shared():
+            yield
+            print("teardown shared")
+
+        @pytest.mark.smoke(depends="*.txt")
+        def test_x1(shared):
+            pass
+
+        def test_x2(shared):
+            pass
+        """,
+        test_y="""
+        def test_y1():
+            pass
+        """,
+    )
+    args = ["--smoke", "100%", "--smoke-memoize", "-v", "-s"]
+    result = pytester.runpytest(*args)
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=3)
+
+    # test_x1 is executed, test_x2 is cached, and test_y1 is executed
+    (pytester.path / "data.txt").write_text("bar")
+    (pytester.path / "test_y.py").write_text("def test_y1():\n    print('run y1')\n")
+    result = pytester.runpytest(*args)
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=3)
+    result.stdout.re_match_lines(
+        [
+            r"test_x\.py::test_x1 PASSED$",
+            r"test_x\.py::test_x2 PASSED \(cached\)teardown shared$",
+            r"test_y\.py::test_y1 run y1$",
+            r"PASSED$",
+        ]
+    )
+
+
+@pytest.mark.parametrize("option", ["--smoke-deadline", "--smoke-escalate"])
+def test_smoke_memoize_with_skipping_option(pytester: Pytester, option: str) -> None:
+    """Test --smoke-memoize option does not report cached passes for tests that --smoke-deadline or --smoke-escalate
+    option skips
+    """
+    pytester.makefile(".txt", data="ok")
+    pytester.makepyfile("""
+    from pathlib import Path
+
+    import pytest
+
+    @pytest.mark.smoke(depends="*.txt")
+    def test_first():
+        assert Path("data.txt").read_text() == "ok"
+
+    def test_second():
+        pass
+    """)
+    args = ["--smoke", "100%", "--smoke-scope", SmokeScope.FILE, "--smoke-memoize", "-v"]
+    result = pytester.runpytest(*args, "--smoke-escalate", "1,2")
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=2)
+
+    if option == "--smoke-deadline":
+        result = pytester.runpytest(*args, "--smoke-deadline", "0.001")
+        assert result.ret == ExitCode.OK
+        result.assert_outcomes(skipped=2)
+    else:
+        # test_first in tier 1 fails, so the cached pass of test_second in tier 2 should not be reported
+        (pytester.path / "data.txt").write_text("ng")
+        result = pytester.runpytest(*args, "--smoke-escalate", "1,2")
+        assert result.ret == ExitCode.TESTS_FAILED
+        result.assert_outcomes(failed=1, skipped=1)
+    assert "(cached)" not in str(result.stdout)
+
+
+@pytest.mark.parametrize("with_xdist", [False, pytest.param(True, marks=pytest.mark.xdist)])
+def test_smoke_history(pytester: Pytester, with_xdist: bool) -> None:
+    """Test --smoke-history option.
+
+    The outcome and phase durations of each executed test should be recorded to the history store, and results older
+    than the retention period should be deleted
+    """
+    pytester.makepyfile(
+        """
+        import pytest
+
+        @pytest.mark.parametrize("p", range(3))
+        def test_pass(p):
+            pass
+
+        def test_fail():
+            assert False
+
+        def test_skip():
+            pytest.skip()
+        """
+    )
+    args = ["--smoke", "100%", "--smoke-scope", SmokeScope.FILE, "--smoke-history"]
+    if with_xdist:
+        args.extend(["-n", "2"])
+    db_path = pytester.path / ".pytest_cache" / "d" / "smoke" / "history.db"
+    query = (
+        "SELECT tests.nodeid, groups.group_id, results.outcome, results.call_duration FROM results "
+        "JOIN tests ON tests.id = results.test_id JOIN groups ON groups.id = results.group_id"
+    )
+
+    result = pytester.runpytest(*args)
+    assert result.ret == ExitCode.TESTS_FAILED
+    result.assert_outcomes(passed=3, failed=1, skipped=1)
+    with closing(sqlite3.connect(db_path)) as conn:
+        rows = conn.execute(query).fetchall()
+    assert {group_id for _, group_id, *_ in rows} == {str(pytester.path / "test_smoke_history.py")}
+    assert sorted((nodeid, outcome) for nodeid, _, outcome, _ in rows) == [
+        ("test_smoke_history.py::test_fail", "failed"),
+        *[(f"test_smoke_history.py::test_pass[{i}]", "passed") for i in range(3)],
+        ("test_smoke_history.py::test_skip", "skipped"),
+    ]
+    assert all(call_duration > 0 for *_, call_duration in rows)
+
+    with closing(sqlite3.connect(db_path)) as conn, conn:
+        conn.execute("UPDATE results SET finished_at = finished_at - 86400 * 2")
+    pytester.makeini(f"""
+    [pytest]
+    {SmokeIniOption.SMOKE_HISTORY_RETENTION_DAYS} = 1
+    """)
+    result = pytester.runpytest(*args)
+    assert result.ret == ExitCode.TESTS_FAILED
+    with closing(sqlite3.connect(db_path)) as conn:
+        assert len(conn.execute(query).fetchall()) == 5
+        assert conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0] == 1
+
+
+def test_smoke_history_write_error(pytester: Pytester) -> None:
+    """Test an error while writing the last batch of results to the history store is reported without blocking the end
+    of the session
+    """
+    pytester.makeconftest("""
+    from pytest_smoke.extensions.history import HistoryStore
+
+    def add_results(*args, **kwargs):
+        raise RuntimeError("write error")
+
+    HistoryStore.add_results = add_results
+    """)
+    pytester.makepyfile(generate_test_code(TestFuncSpec()))
+    result = pytester.runpytest_subprocess("--smoke", "--smoke-history", timeout=60)
+    assert result.ret != ExitCode.OK
+    result.stderr.re_match_lines([r".*RuntimeError: write error"])
+
+
+def test_smoke_history_with_memoize(pytester: Pytester) -> None:
+    """Test results replayed by --smoke-memoize are recorded as cached to the history store, and are excluded from the
+    performance baseline
+    """
+    pytester.makepyfile(generate_test_code(TestFuncSpec()))
+    args = ["--smoke", "--smoke-memoize", "--smoke-perf-baseline"]
+    db_path = pytester.path / ".pytest_cache" / "d" / "smoke" / "history.db"
+    query = "SELECT results.outcome, results.call_duration FROM results ORDER BY results.finished_at"
+
+    for _ in range(4):
+        result = pytester.runpytest(*args)
+        assert result.ret == ExitCode.OK
+    # Cached passes are neither compared against nor added to the baseline
+    assert "smoke performance" not in str(result.stdout)
+    with closing(sqlite3.connect(db_path)) as conn:
+        rows = conn.execute(query).fetchall()
+    assert [outcome for outcome, _ in rows] == ["passed"] + ["cached"] * 3
+    assert rows[1][1] == 0.0
+
+
+def test_smoke_perf_baseline(pytester: Pytester) -> None:
+    """Test --smoke-perf-baseline and --smoke-perf-fail-ratio options.
+
+    Tests significantly slower than the baseline of recent runs should be reported, and the run should fail only when
+    the slowdown exceeds the given ratio
+    """
+    pytester.makefile(".txt", sleep="0.01")
+    pytester.makepyfile(
+        """
+        import time
+        from pathlib import Path
+
+        def test_slow():
+            time.sleep(float(Path("sleep.txt").read_text()))
+
+        def test_fast():
+            pass
+        """
+    )
+    args = ["--smoke", "100%", "--smoke-perf-baseline"]
+    for _ in range(3):
+        result = pytester.runpytest(*args, "--smoke-perf-fail-ratio", "2")
+        assert result.ret == ExitCode.OK
+        result.stdout.re_match_lines([r"=+ smoke performance =+", r"0/2 passed tests compared .+, 0 significant .+"])
+
+    (pytester.path / "sleep.txt").write_text("0.1")
+    result = pytester.runpytest(*args)
+    assert result.ret == ExitCode.OK
+    result.stdout.re_match_lines(
+        [
+            r"2/2 passed tests compared against the baseline of up to 10 recent runs, 1 significant slowdowns detected",
+            r"\s+duration\s+median\s+ratio\s+z-score\s+test",
+            r"\s+0\.1\d+s\s+0\.0\d+s\s+\d+\.\dx\s+\d+\.\d\s+.+::test_slow",
+        ]
+    )
+
+    result = pytester.runpytest(*args, "--smoke-perf-fail-ratio", "2")
+    assert result.ret == ExitCode.TESTS_FAILED
+    result.assert_outcomes(passed=2)
+    result.stdout.re_match_lines([r"Failing the run as slowdowns exceed the threshold \(2\.0x\)"])
+
+    result = pytester.runpytest("--smoke", "--smoke-perf-fail-ratio", "2")
+    assert result.ret == ExitCode.USAGE_ERROR
+    result.stderr.re_match_lines([r"ERROR: The --smoke-perf-fail-ratio option requires the --smoke-perf-baseline .+"])
+
+
+@pytest.mark.parametrize("with_xdist", [False, pytest.param(True, marks=pytest.mark.xdist)])
+def test_smoke_report(pytester: Pytester, with_xdist: bool) -> None:
+    """Test --smoke-report and --smoke-report-json options"""
+    smoke_n = 2
+    top_k = 2
+    num_tests = [10, 5, 20]
+    test_file_spec = TestFileSpec([TestFuncSpec(num_params=n) for n in num_tests])
+    pytester.makepyfile(generate_test_code(test_file_spec))
+    json_path = pytester.path / "report.json"
+    args = ["--smoke", str(smoke_n), "--smoke-report", str(top_k), "--smoke-report-json", str(json_path)]
+    if with_xdist:
+        args.extend(["-n", "2"])
+    result = pytester.runpytest(*args)
+    assert result.ret == ExitCode.OK
+    num_all_tests = sum(num_tests)
+    num_selected = smoke_n * len(num_tests)
+    result.assert_outcomes(passed=num_selected, deselected=num_all_tests - num_selected)
+    result.stdout.re_match_lines(
+        [
+            r"=+ smoke report =+",
+            rf"scope: {SmokeScope.AUTO}, select mode: {SmokeSelectMode.FIRST}, N: {smoke_n}",
+            rf"{len(num_tests)} groups, {num_all_tests} collected, {num_selected} selected .+",
+            rf"Top {top_k} groups by duration:",
+            rf"Top {top_k} groups by size:",
+            r"\s+duration\s+collected\s+selected\s+deselected\s+group",
+            rf"\s+\d+\.\d+s\s+20\s+{smoke_n}\s+{20 - smoke_n}\s+.+::{TEST_NAME_BASE}3",
+            rf"\s+\d+\.\d+s\s+10\s+{smoke_n}\s+{10 - smoke_n}\s+.+::{TEST_NAME_BASE}1",
+            r"Group sizes \(collected\):",
+            r"\s+4-7\s+1 #+",
+            r"\s+8-15\s+1 #+",
+            r"\s+16-31\s+1 #+",
+            r"Group durations:",
+        ]
+    )
+    report = json.loads(json_path.read_text())
+    assert len(report) == len(num_tests)
+    for i, n in enumerate(num_tests, start=1):
+        group_report = next(v for k, v in report.items() if k.endswith(f"::{TEST_NAME_BASE}{i}"))
+        assert group_report["collected"] == n
+        assert group_report["selected"] == smoke_n
+        assert group_report["deselected"] == n - smoke_n
+        assert group_report["duration"] > 0
+
+
 @pytest.mark.parametrize("num_fails", [0, 1, 2])
 @pytest.mark.parametrize("runif", [None, False, True])
 @pytest.mark.parametrize("mustpass", [None, False, True])
@@ -213,6 +1413,106 @@ def test_smoke_marker_critical_tests(pytester: Pytester, mustpass: bool, runif:
             assert result_word == "PASSED"
 
 
+def test_smoke_marker_critical_tests_order(pytester: Pytester) -> None:
+    """Test that must-pass tests run before other critical tests, and critical tests are ordered by the ratio of their
+    historical duration to their failure probability
+    """
+    pytester.makepyfile("""
+    import time
+    import pytest
+
+    def test_regular():
+        pass
+
+    @pytest.mark.smoke
+    def test_slow():
+        time.sleep(0.1)
+
+    @pytest.mark.smoke
+    def test_fail():
+        time.sleep(0.05)
+        assert False
+
+    @pytest.mark.smoke
+    def test_fast():
+        pass
+
+    @pytest.mark.smoke(mustpass=True)
+    def test_mustpass_slow():
+        time.sleep(0.1)
+
+    @pytest.mark.smoke(mustpass=True)
+    def test_mustpass_fast():
+        pass
+    """)
+    pytester.makeini(f"""
+    [pytest]
+    {SmokeIniOption.SMOKE_MARKED_TESTS_AS_CRITICAL} = true
+    """)
+
+    def run_tests() -> list[str]:
+        result = pytester.runpytest("--smoke", "-v")
+        result.assert_outcomes(passed=5, failed=1)
+        return re.findall(r"test_.+\.py::(test_\w+) (?:PASSED|FAILED)", str(result.stdout))
+
+    # No history yet. Must-pass tests run first while the original order is retained otherwise
+    assert run_tests() == [
+        "test_mustpass_slow",
+        "test_mustpass_fast",
+        "test_slow",
+        "test_fail",
+        "test_fast",
+        "test_regular",
+    ]
+    # Ordered by the history recorded in the previous run
+    assert run_tests() == [
+        "test_mustpass_fast",
+        "test_mustpass_slow",
+        "test_fast",
+        "test_fail",
+        "test_slow",
+        "test_regular",
+    ]
+
+
+def test_smoke_marker_critical_tests_order_without_cacheprovider(pytester: Pytester) -> None:
+    """Test that critical tests are kept in the collection order, except for must-pass tests, when the cacheprovider
+    plugin is disabled
+    """
+    pytester.makepyfile("""
+    import pytest
+
+    def test_regular():
+        pass
+
+    @pytest.mark.smoke
+    def test_fail():
+        assert False
+
+    @pytest.mark.smoke
+    def test_fast():
+        pass
+
+    @pytest.mark.smoke(mustpass=True)
+    def test_mustpass():
+        pass
+    """)
+    pytester.makeini(f"""
+    [pytest]
+    {SmokeIniOption.SMOKE_MARKED_TESTS_AS_CRITICAL} = true
+    """)
+    for _ in range(2):
+        result = pytester.runpytest("--smoke", "-v", "-p", "no:cacheprovider")
+        assert result.ret == ExitCode.TESTS_FAILED
+        result.assert_outcomes(passed=3, failed=1)
+        assert re.findall(r"test_.+\.py::(test_\w+) (?:PASSED|FAILED)", str(result.stdout)) == [
+            "test_mustpass",
+            "test_fail",
+            "test_fast",
+            "test_regular",
+        ]
+
+
 @pytest.mark.xdist
 @pytest.mark.usefixtures("generate_test_files")
 @pytest.mark.parametrize("select_mode", [None, *SmokeSelectMode])
@@ -256,6 +1556,66 @@ def test_smoke_xdist_disabled(pytester: Pytester, select_mode: str | None) -> No
     result.assert_outcomes(passed=1, deselected=num_tests - 1)
 
 
+@pytest.mark.xdist
+def test_smoke_xdist_affinity(pytester: Pytester) -> None:
+    """Test --smoke-xdist-affinity option.
+
+    Smoke scope groups that share a session-scoped fixture should be distributed to the same worker so that the fixture
+    is set up only once
+    """
+    pytester.makeconftest("""
+    import pytest
+
+    def _record_setup(name):
+        with open("setups.txt", "a") as f:
+            f.write(name + "\\n")
+
+    @pytest.fixture(scope="session")
+    def db():
+        _record_setup("db")
+
+    @pytest.fixture(scope="session")
+    def data():
+        _record_setup("data")
+    """)
+    for name, fixture_name in (("test_a", "db"), ("test_b", "data"), ("test_c", "db"), ("test_d", None)):
+        pytester.makepyfile(
+            **{
+                name: f"""
+                import pytest
+
+                @pytest.mark.parametrize("i", range(5))
+                def test_something(i{", " + fixture_name if fixture_name else ""}):
+                    pass
+                """
+            }
+        )
+    result = pytester.runpytest(
+        "--smoke", "100%", "--smoke-scope", SmokeScope.FILE, "--smoke-xdist-affinity", "-n", "2", "-v"
+    )
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=20)
+    result.stdout.re_match_lines(
+        [
+            r"scheduling tests via SmokeAffinityScheduling",
+            r"smoke xdist affinity: 4 smoke scope groups distributed in 3 work units, estimated fixture setups saved: "
+            r"1 \(3 -> 2\)",
+        ]
+    )
+    assert sorted((pytester.path / "setups.txt").read_text().splitlines()) == ["data", "db"]
+
+
+@pytest.mark.xdist
+@pytest.mark.parametrize("dist_option", [["--dist", "load"], ["--dist", "loadscope"], ["-d"]])
+def test_smoke_xdist_affinity_with_dist_option(pytester: Pytester, dist_option: list[str]) -> None:
+    """Test --smoke-xdist-affinity option can not be used with an explicit dist option"""
+    result = pytester.runpytest("--smoke", "--smoke-xdist-affinity", "-n", "2", *dist_option)
+    assert result.ret == ExitCode.USAGE_ERROR
+    result.stderr.re_match_lines(
+        [r"ERROR: The --smoke-xdist-affinity option cannot be used with an explicit dist option \(--dist or -d\)"]
+    )
+
+
 @pytest.mark.filterwarnings("ignore::pluggy.PluggyTeardownRaisedWarning")
 @pytest.mark.parametrize("n", ["-1", "0", "0.5", "1.1", "foo", " -1%", "0%", "101%", "bar%"])
 def test_smoke_invalid_n(pytester: Pytester, n: str) -> None:
@@ -267,7 +1627,39 @@ def test_smoke_invalid_n(pytester: Pytester, n: str) -> None:
     )
 
 
-@pytest.mark.parametrize("option", ["--smoke-scope", "--smoke-select-mode"])
+@pytest.mark.parametrize(
+    "option",
+    [
+        "--smoke-scope",
+        "--smoke-select-mode",
+        "--smoke-adaptive=1",
+        "--smoke-changed-since",
+        "--smoke-changed-lines",
+        "--smoke-record-coverage",
+        "--smoke-memoize",
+        "--smoke-history",
+        "--smoke-perf-baseline",
+        "--smoke-perf-fail-ratio=2",
+        "--smoke-profile-tests",
+        "--smoke-resources=1",
+        "--smoke-resources-tracemalloc",
+        "--smoke-collect-profile=1",
+        "--smoke-deadline=1",
+        "--smoke-escalate=1,2",
+        "--smoke-xdist-affinity",
+        "--smoke-threads=1",
+        "--smoke-forks=1",
+        "--smoke-memory-lean",
+        "--smoke-max-per-file=1",
+        "--smoke-max-per-dir=1",
+        "--smoke-max-total=1",
+        "--smoke-manifest",
+        "--smoke-from-manifest",
+        "--smoke-report=1",
+        "--smoke-report-json",
+        "--smoke-durations=1",
+    ],
+)
 def test_smoke_without_n_option(pytester: Pytester, option: str) -> None:
     """Test the --smoke option is required to use any functionality provided by the plugin"""
     result = pytester.runpytest(option, "foo")
@@ -125,3 +125,63 @@ def test_smoke_hook_pytest_smoke_sort_by_select_mode(pytester: Pytester, with_ho
         assert [int(n) for n in matched_test_nums] == sorted([x for x in range(num_tests)], key=lambda x: x % 2)[
             :smoke_n
         ]
+
+
+@pytest.mark.parametrize("fall_back", [False, True])
+def test_smoke_hook_pytest_smoke_select_from_group(pytester: Pytester, fall_back: bool) -> None:
+    """Test custom select mode using the pytest_smoke_select_from_group hook.
+
+    The hook should be called only for smoke scope groups that have more candidate tests than N, and returning None
+    should fall back to the pytest_smoke_sort_by_select_mode hook
+    """
+    custom_select_mode = "my-select-mode"
+    smoke_n = 2
+    pytester.makepyfile(
+        test_a=generate_test_code(TestFuncSpec(num_params=5)),
+        test_b=generate_test_code(TestFuncSpec(num_params=2)),
+        test_c=generate_test_code(TestFuncSpec(num_params=5)),
+    )
+    pytester.makeconftest(f"""
+    calls = []
+
+    def pytest_smoke_include(item, scope):
+        return item.path.name == "test_c.py"
+
+    def pytest_smoke_select_from_group(group_id, items, n, scope, select_mode):
+        calls.append((group_id, len(items), n, scope, select_mode))
+        if {fall_back}:
+            return None
+        # The last N tests
+        return items[-n:]
+
+    def pytest_smoke_sort_by_select_mode(items):
+        # sort tests by odd/even index
+        return sorted(items, key=lambda x: items.index(x) % 2)
+
+    def pytest_terminal_summary(terminalreporter):
+        terminalreporter.write_line(f"calls: {{calls}}")
+    """)
+    result = pytester.runpytest(
+        "--smoke", str(smoke_n), "--smoke-scope", "file", "--smoke-select-mode", custom_select_mode, "-v"
+    )
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=smoke_n * 2 + 5, deselected=3)
+    result.stdout.re_match_lines([rf"calls: \[\('.+test_a\.py', 5, {smoke_n}, 'file', '{custom_select_mode}'\)\]"])
+    test_nums_a = [int(n) for n in re.findall(rf"test_a\.py::{TEST_NAME_BASE}\[(\d+)\] PASSED", str(result.stdout))]
+    assert test_nums_a == ([0, 2] if fall_back else [3, 4])
+
+
+def test_smoke_hook_pytest_smoke_select_from_group_fewer_than_n(pytester: Pytester) -> None:
+    """Test that items returned by the pytest_smoke_select_from_group hook are final even if fewer than N items are
+    returned
+    """
+    num_tests = 5
+    pytester.makepyfile(generate_test_code(TestFuncSpec(num_params=num_tests)))
+    pytester.makeconftest("""
+    def pytest_smoke_select_from_group(group_id, items, n, scope, select_mode):
+        return items[-1:]
+    """)
+    result = pytester.runpytest("--smoke", "3", "--smoke-scope", "file", "--smoke-select-mode", "my-select-mode", "-v")
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=1, deselected=num_tests - 1)
+    assert re.findall(rf"test_.+\.py::{TEST_NAME_BASE}\[(\d+)\] PASSED", str(result.stdout)) == [str(num_tests - 1)]
@@ -155,14 +155,72 @@ def test_smoke_ini_option_smoke_marked_tests_as_critical(pytester: Pytester, val
     result.assert_outcomes(passed=num_passes, deselected=num_tests_1 + num_tests_2 - num_passes)
 
 
+def test_smoke_ini_option_smoke_exclude_and_include_from(pytester: Pytester) -> None:
+    """Test smoke_exclude and smoke_include_from INI options.
+
+    Tests matching the exclude rules should never be selected, and tests matching the rules in the include files should
+    be included as additional smoke tests
+    """
+    pytester.makepyfile(
+        **{
+            "tests/test_a": """
+            import pytest
+
+            @pytest.mark.parametrize("p", range(2))
+            def test_param(p):
+                pass
+
+            @pytest.mark.parametrize("p", range(3))
+            def test_func(p):
+                pass
+
+            @pytest.mark.skip
+            def test_skipped():
+                pass
+            """,
+            "tests/test_b": """
+            class TestClass:
+                def test_1(self):
+                    pass
+
+                def test_2(self):
+                    pass
+            """,
+            "tests/sub/test_c": "def test_func():\n    pass\n",
+        }
+    )
+    pytester.makefile(".txt", include="# Additional smoke tests\n\ntests/test_a.py::test_func[2]\ntests/test_b.py::*\n")
+    pytester.makeini(f"""
+    [pytest]
+    {SmokeIniOption.SMOKE_EXCLUDE} =
+        tests/test_a.py::test_func[0]
+        tests/test_a.py::test_param
+        tests/su?
+        marker:skip
+    {SmokeIniOption.SMOKE_INCLUDE_FROM} = include.txt
+    """)
+    result = pytester.runpytest("--smoke", "--smoke-scope", SmokeScope.FILE, "-v")
+    assert result.ret == ExitCode.OK
+    result.assert_outcomes(passed=4, deselected=5)
+    assert re.findall(r"(tests/\S+) PASSED", str(result.stdout)) == [
+        "tests/test_a.py::test_func[1]",
+        "tests/test_a.py::test_func[2]",
+        "tests/test_b.py::TestClass::test_1",
+        "tests/test_b.py::TestClass::test_2",
+    ]
+
+
 @pytest.mark.parametrize(
-    "ini_option",
+    ("ini_option", "value"),
     [
-        pytest.param(x, marks=pytest.mark.xdist if x == SmokeIniOption.SMOKE_DEFAULT_XDIST_DIST_BY_SCOPE else [])
+        pytest.param(x, value, marks=pytest.mark.xdist if x == SmokeIniOption.SMOKE_DEFAULT_XDIST_DIST_BY_SCOPE else [])
+        # Any rules are valid for smoke_exclude, and no files are valid for smoke_include_from
         for x in SmokeIniOption
+        if x != SmokeIniOption.SMOKE_EXCLUDE
+        for value in ["foo", ""]
+        if value or x != SmokeIniOption.SMOKE_INCLUDE_FROM
     ],
 )
-@pytest.mark.parametrize("value", ["foo", ""])
 def test_smoke_ini_option_with_invalid_value(pytester: Pytester, ini_option: str, value: str) -> None:
     """Test INI options with an invalid value are handled as a usage error"""
     pytester.makepyfile(generate_test_code(TestFuncSpec()))